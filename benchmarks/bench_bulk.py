@@ -0,0 +1,99 @@
+"""
+Export and re-import generated devices; reporting throughput and peak memory.
+
+Run with ``python -m benchmarks.bench_bulk --devices 10000000`` from the
+repository root. The files are written to a temporary directory.
+"""
+import argparse
+import os
+import resource
+import tempfile
+import time
+
+from fido_u2f import bulk
+from fido_u2f.device import DeviceRecord
+from fido_u2f.enums import U2FTransport
+
+APP_ID = "https://example.com"
+
+
+def generate(count):
+    public_key = b"\x04" + bytes(range(64))
+    for i in range(count):
+        yield (
+            "user{}".format(i // 2),
+            DeviceRecord(
+                "U2F_V2",
+                APP_ID,
+                i.to_bytes(8, "big") * 8,
+                public_key,
+                i & 0xFFFFFFFF,
+                U2FTransport.USB.value,
+            ),
+        )
+
+
+class CountingSink(bulk.DeviceSink):
+    def __init__(self):
+        self.count = 0
+
+    def write_batch(self, devices):
+        self.count += len(devices)
+
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def timed(name, func, count):
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    print(
+        "{:<16} {:>10.2f}s {:>12.0f} devices/s {:>10.1f} MiB peak RSS".format(
+            name, seconds, count / seconds, peak_rss_mib()
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", type=int, default=1000000)
+    args = parser.parse_args()
+    count = args.devices
+
+    with tempfile.TemporaryDirectory() as directory:
+        jsonl_path = os.path.join(directory, "devices.jsonl")
+        binary_path = os.path.join(directory, "devices.u2fx")
+
+        def export_jsonl():
+            with open(jsonl_path, "w") as f:
+                bulk.write_jsonl(generate(count), f)
+
+        def export_binary():
+            with open(binary_path, "wb") as f:
+                bulk.write_binary(generate(count), f)
+
+        def import_jsonl():
+            with open(jsonl_path) as f:
+                bulk.import_devices(bulk.read_jsonl(f), CountingSink())
+
+        def import_binary():
+            with open(binary_path, "rb") as f:
+                bulk.import_devices(bulk.read_binary(f), CountingSink())
+
+        timed("export jsonl", export_jsonl, count)
+        timed("export binary", export_binary, count)
+        timed("import jsonl", import_jsonl, count)
+        timed("import binary", import_binary, count)
+        print(
+            "file sizes: jsonl {:.1f} MiB, binary {:.1f} MiB".format(
+                os.path.getsize(jsonl_path) / 2 ** 20,
+                os.path.getsize(binary_path) / 2 ** 20,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Measure the memory and (de)serialisation cost of ``DeviceRecord``.
+
+Compares it against a plain ``DeviceRegistration`` subclass holding its
+attributes in ``__dict__``; serialisation is compared against JSON.
+
+Run with ``python -m benchmarks.bench_device_record`` from the repository root.
+"""
+import json
+import os
+import timeit
+import tracemalloc
+
+from fido_u2f.device import DeviceRecord
+from fido_u2f.enums import U2FTransport
+from fido_u2f.soft_u2f import SoftDevice
+from fido_u2f.utils import websafe_decode, websafe_encode
+
+APP_ID = "https://example.com"
+DEVICES = 100000
+
+
+def make_soft_device():
+    return SoftDevice(
+        version="U2F_V2",
+        app_id=APP_ID,
+        key_handle=os.urandom(64),
+        public_key=os.urandom(65),
+        transports=[U2FTransport.USB],
+        counter=1234,
+    )
+
+
+def make_record():
+    return DeviceRecord(
+        "U2F_V2", APP_ID, os.urandom(64), os.urandom(65), 1234, U2FTransport.USB.value
+    )
+
+
+def bytes_per_device(factory):
+    tracemalloc.start()
+    devices = [factory() for _ in range(DEVICES)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del devices
+    return size / DEVICES
+
+
+def to_json(record):
+    return json.dumps(
+        {
+            "version": record.version,
+            "appId": record.app_id,
+            "keyHandle": websafe_encode(record.key_handle),
+            "publicKey": websafe_encode(record.public_key),
+            "counter": record.counter,
+            "transports": record.transports,
+        }
+    )
+
+
+def from_json(data):
+    value = json.loads(data)
+    return DeviceRecord(
+        value["version"],
+        value["appId"],
+        websafe_decode(value["keyHandle"]),
+        websafe_decode(value["publicKey"]),
+        value["counter"],
+        value["transports"],
+    )
+
+
+def micros(func, number=20000):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    print("{:<32} {:>12}".format("memory", "bytes/device"))
+    for name, factory in [
+        ("DeviceRegistration (__dict__)", make_soft_device),
+        ("DeviceRecord (__slots__)", make_record),
+    ]:
+        print("{:<32} {:>12.0f}".format(name, bytes_per_device(factory)))
+
+    record = make_record()
+    binary = record.to_bytes()
+    text = to_json(record)
+    print()
+    print(
+        "{:<32} {:>8} {:>10} {:>10}".format("encoding", "bytes", "dump us", "load us")
+    )
+    print(
+        "{:<32} {:>8} {:>10.2f} {:>10.2f}".format(
+            "DeviceRecord.to_bytes",
+            len(binary),
+            micros(record.to_bytes),
+            micros(lambda: DeviceRecord.from_bytes(binary)),
+        )
+    )
+    print(
+        "{:<32} {:>8} {:>10.2f} {:>10.2f}".format(
+            "JSON",
+            len(text),
+            micros(lambda: to_json(record)),
+            micros(lambda: from_json(text)),
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
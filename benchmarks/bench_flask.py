@@ -0,0 +1,237 @@
+"""
+Compare the sample Flask app's original handlers against the ``FlaskU2F`` extension.
+
+Both apps serve the same SQLite database of ``--users`` users with
+``--devices`` devices each, through Flask's test client. The original
+handlers are reproduced here as they were: the index lazy-loads each user's
+devices, the script is read from disk on every request, and each signing
+request renders the user's devices again. Reports requests/s and SQL queries
+per request.
+
+Run with ``python -m benchmarks.bench_flask`` from the repository root; it
+needs ``flask`` and ``sqlalchemy``.
+"""
+import argparse
+import json
+import pathlib
+import timeit
+
+from flask import Flask, session
+from sqlalchemy import Column, ForeignKey, Integer, LargeBinary, String, event
+from sqlalchemy import create_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship, scoped_session, selectinload, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from fido_u2f.device import DeviceRegistration
+from fido_u2f.enums import U2FTransport
+from fido_u2f.flask_ext import SCRIPT_PATH, FlaskU2F, U2FDeviceStore
+from fido_u2f.registration import U2FRegistrationManager
+from fido_u2f.verification import U2FSigningManager
+
+APP_ID = "https://example.com"
+REPEAT = 3
+
+Base = declarative_base()
+
+
+class User(Base):
+    __tablename__ = "User"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    devices = relationship("Device", back_populates="user")
+
+
+class Device(Base, DeviceRegistration):
+    __tablename__ = "Device"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("User.id"))
+    user = relationship("User", back_populates="devices")
+    version = Column(String)
+    app_id = Column(String)
+    key_handle = Column(LargeBinary)
+    public_key = Column(LargeBinary)
+    transports = Column(Integer)
+    counter = Column(Integer)
+
+    @property
+    def u2f_transports(self):
+        return U2FTransport._from_internal_int(self.transports)
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self.executed)
+
+    def executed(self, *args):
+        self.count += 1
+
+
+def create_database(users, devices):
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(engine)
+    db = scoped_session(sessionmaker(bind=engine))
+    transports = U2FTransport._to_internal_int([U2FTransport.USB])
+    for i in range(users):
+        user = User(name="user{}".format(i))
+        for j in range(devices):
+            key_handle = (i * devices + j).to_bytes(8, "big") * 8
+            user.devices.append(
+                Device(
+                    version="U2F_V2",
+                    app_id=APP_ID,
+                    key_handle=key_handle,
+                    public_key=b"\x04" + bytes(range(64)),
+                    transports=transports,
+                    counter=0,
+                )
+            )
+        db.add(user)
+    db.commit()
+    return engine, db
+
+
+class Manager(U2FRegistrationManager, U2FSigningManager):
+    def create_device_registration_model(self, **kwargs):
+        raise NotImplementedError
+
+    def update_device_registration_counter(self, *, device, counter):
+        raise NotImplementedError
+
+
+def create_original_app(db):
+    """The sample app's handlers, before the extension."""
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "benchmark"
+    app.teardown_appcontext(lambda exc: db.remove())
+    manager = Manager(APP_ID)
+
+    @app.route("/")
+    def index():
+        dat = "<table>"
+        dat += "<tr><th>Username</th><th>Registered keys</th></tr>"
+        for user in db.query(User).all():
+            dat += "<tr><td>" + user.name + "</td><td><table>\n"
+            dat += "<tr><th>Index</th><th>Key Handle</th><th>Counter</th></tr>\n"
+            for idx, key in enumerate(user.devices):
+                dat += "<tr><td>{0}</td><td>{1.key_handle}</td>".format(idx, key)
+                dat += "<td>{0.counter}</td></tr>\n".format(key)
+            dat += "</table></td></tr>"
+        dat += "</table>"
+        return dat
+
+    @app.route("/u2f/u2f.js")
+    def script():
+        return pathlib.Path(SCRIPT_PATH).open("r").read()
+
+    @app.route("/u2f/sign")
+    def signing_request():
+        user = db.query(User).filter_by(id=session["user_id"]).one()
+        return json.dumps(manager.create_signing_challenge(session, user.devices))
+
+    return app
+
+
+class DeviceStore(U2FDeviceStore):
+    def __init__(self, db):
+        self.db = db
+
+    def current_user(self):
+        return session.get("user_id")
+
+    def load_devices(self, user_id):
+        return self.db.query(Device).filter_by(user_id=user_id).all()
+
+    def page_devices(self, user_id, offset, limit):
+        query = self.db.query(Device).filter_by(user_id=user_id)
+        devices = query.order_by(Device.id).offset(offset).limit(limit).all()
+        return query.count(), devices
+
+    def add_device(self, user_id, **kwargs):
+        raise NotImplementedError
+
+    def update_counter(self, device, counter):
+        raise NotImplementedError
+
+
+def create_extension_app(db):
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "benchmark"
+    app.teardown_appcontext(lambda exc: db.remove())
+    FlaskU2F(app, store=DeviceStore(db), app_id=APP_ID)
+    template = app.jinja_env.from_string(
+        "<table><tr><th>Username</th><th>Registered keys</th></tr>"
+        "{% for user in users %}<tr><td>{{ user.name }}</td><td><table>\n"
+        "<tr><th>Index</th><th>Key Handle</th><th>Counter</th></tr>\n"
+        "{% for key in user.devices %}<tr><td>{{ loop.index0 }}</td>"
+        "<td>{{ key.key_handle }}</td><td>{{ key.counter }}</td></tr>\n"
+        "{% endfor %}</table></td></tr>{% endfor %}</table>"
+    )
+
+    @app.route("/")
+    def index():
+        users = db.query(User).options(selectinload(User.devices)).all()
+        return template.render(users=users)
+
+    return app
+
+
+def measure(client, counter, path, headers=None):
+    """Return the requests/s and the queries made per request."""
+
+    def get():
+        response = client.get(path, headers=headers)
+        assert response.status_code in (200, 304), response.status_code
+        return response
+
+    get()
+    timer = timeit.Timer(get)
+    # Each timed run lasts at least 0.2s.
+    number, _ = timer.autorange()
+    before = counter.count
+    best = min(timer.repeat(REPEAT, number)) / number
+    queries = (counter.count - before) / (REPEAT * number)
+    return 1 / best, queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--devices", type=int, default=5, help="devices per user")
+    args = parser.parse_args()
+
+    engine, db = create_database(args.users, args.devices)
+    counter = QueryCounter(engine)
+    apps = [
+        ("original", create_original_app(db)),
+        ("extension", create_extension_app(db)),
+    ]
+    script = FlaskU2F(store=DeviceStore(db), app_id=APP_ID).script
+    cases = [
+        ("index", "/", None),
+        ("script", "/u2f/u2f.js", None),
+        ("script (cached)", "/u2f/u2f.js", {"If-None-Match": '"%s"' % script.etag}),
+        ("signing request", "/u2f/sign", None),
+    ]
+    print("{} users with {} devices each".format(args.users, args.devices))
+    print("{:<18} {:<10} {:>12} {:>10}".format("", "app", "requests/s", "queries"))
+    for name, path, headers in cases:
+        for app_name, app in apps:
+            with app.test_client() as client:
+                with client.session_transaction() as sess:
+                    sess["user_id"] = 1
+                rate, queries = measure(client, counter, path, headers)
+            print(
+                "{:<18} {:<10} {:>12.0f} {:>10.1f}".format(
+                    name, app_name, rate, queries
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Compare the offset-based response parsers with the original ``bytearray`` ones.
+
+Run with ``python -m benchmarks.bench_parse`` from the repository root.
+"""
+import struct
+import timeit
+import tracemalloc
+
+from fido_u2f.registration import RegistrationData
+from fido_u2f.soft_u2f import SoftU2FToken
+from fido_u2f.utils import (
+    fix_invalid_yubico_certs,
+    parse_tlv_encoded_length,
+    pop_bytes,
+    websafe_decode,
+)
+from fido_u2f.verification import SignatureData
+
+APP_ID = "https://example.com"
+
+
+class LegacyRegistrationData:
+    """The original ``RegistrationData`` parser."""
+
+    def __init__(self, data):
+        buf = bytearray(data)
+        buf.pop(0)
+        self.public_key = pop_bytes(buf, 65)
+        self.key_handle = pop_bytes(buf, buf.pop(0))
+        cert_len = parse_tlv_encoded_length(buf)
+        self.certificate = fix_invalid_yubico_certs(pop_bytes(buf, cert_len))
+        self.signature = bytes(buf)
+
+
+class LegacySignatureData:
+    """The original ``SignatureData`` parser."""
+
+    def __init__(self, data):
+        buf = bytearray(data)
+        self.user_presence = buf.pop(0)
+        self.counter = struct.unpack(">I", pop_bytes(buf, 4))[0]
+        self.signature = bytes(buf)
+
+
+def registration_fields(cls):
+    def parse(data):
+        parsed = cls(data)
+        return parsed.public_key, parsed.key_handle, parsed.signature
+
+    return parse
+
+
+def signature_fields(cls):
+    def parse(data):
+        parsed = cls(data)
+        return parsed.user_presence, parsed.counter, parsed.signature
+
+    return parse
+
+
+def measure(func, data, number=20000):
+    seconds = min(timeit.repeat(lambda: func(data), number=number, repeat=3))
+    tracemalloc.start()
+    func(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds / number * 1e6, peak
+
+
+def main():
+    token = SoftU2FToken()
+    reg = token.register(APP_ID, "challenge")
+    (key_handle,) = token.keys
+    sig = token.sign(APP_ID, "challenge", key_handle)
+    reg_data = websafe_decode(reg["registrationData"])
+    sig_data = websafe_decode(sig["signatureData"])
+    # The certificate is left out of the registration case; checking it
+    #  against the known-bad Yubico certificates costs the same either way.
+    cases = [
+        ("registration (bytearray)", registration_fields(LegacyRegistrationData)),
+        ("registration (offsets)", registration_fields(RegistrationData)),
+        ("signature (bytearray)", signature_fields(LegacySignatureData)),
+        ("signature (offsets)", signature_fields(SignatureData)),
+    ]
+    print("{:<28} {:>10} {:>16}".format("parser", "us/parse", "peak bytes"))
+    for name, func in cases:
+        data = reg_data if name.startswith("registration") else sig_data
+        micros, allocated = measure(func, data)
+        print("{:<28} {:>10.2f} {:>16}".format(name, micros, allocated))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Deterministic inputs for the benchmark suite.
+
+Every key, key handle and certificate serial number is derived from
+``SEED``, so each run measures exactly the same registrations and devices.
+The ECDSA signatures, in the attestation certificate and the responses, are
+still randomised; so their bytes (and, by a byte or two, their DER lengths)
+differ between runs, though not the work to verify them.
+"""
+from fido_u2f.device import DeviceRecord
+from fido_u2f.soft_u2f import SoftU2FToken
+from fido_u2f.utils import websafe_decode
+
+APP_ID = "https://example.com"
+CHALLENGE = "Hs0Yx1OfwxQbY6cvRGoMG-mw5zdxLp5n8Y1pxvDIkkY"
+SEED = 20180101
+DEVICE_COUNTS = (1, 10, 1000)
+
+
+class Fixtures:
+    def __init__(self, seed: int = SEED) -> None:
+        self.token = SoftU2FToken(seed=seed)
+        self.registration_response = self.token.register(APP_ID, CHALLENGE)
+        (self.key_handle,) = self.token.keys
+        self.signing_response = self.token.sign(APP_ID, CHALLENGE, self.key_handle)
+        self.registration_data = websafe_decode(
+            self.registration_response["registrationData"]
+        )
+        self.signature_data = websafe_decode(self.signing_response["signatureData"])
+        self.device = DeviceRecord.from_device(self.token.device(self.key_handle))
+        self.devices = {
+            count: self._devices(seed + count, count) for count in DEVICE_COUNTS
+        }
+
+    @staticmethod
+    def _devices(seed: int, count: int):
+        token = SoftU2FToken(seed=seed)
+        for _ in range(count):
+            token.register(APP_ID, CHALLENGE)
+        return [
+            DeviceRecord.from_device(token.device(key_handle))
+            for key_handle in sorted(token.keys)
+        ]
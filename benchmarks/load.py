@@ -0,0 +1,279 @@
+"""
+Drive the registration and login flows under load with software tokens.
+
+Each simulated user registers one ``SoftU2FToken`` key and then logs in with
+it ``--logins`` times; ``--concurrency`` users run at once. Throughput and
+latency percentiles are reported for every stage of the flows, including the
+time the token itself takes to respond.
+
+Against the managers, in-process::
+
+    python -m benchmarks.load inprocess --users 1000 --logins 10
+
+Against the sample Flask app (``fido_u2f/sample/flask.py``), over HTTP::
+
+    FLASK_APP=fido_u2f.sample.flask flask run --port 5000 --with-threads
+    python -m benchmarks.load http --url http://localhost:5000 --users 50
+
+Run from the repository root.
+"""
+import argparse
+import collections
+import contextlib
+import http.cookiejar
+import json
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from fido_u2f.registration import U2FRegistrationManager
+from fido_u2f.soft_u2f import SoftDevice, SoftU2FToken
+from fido_u2f.utils import websafe_encode
+from fido_u2f.verification import U2FSigningManager
+
+APP_ID = "https://example.com"
+SEED = 20180101
+PERCENTILES = (("p50", 0.5), ("p99", 0.99), ("p999", 0.999))
+
+
+class StageTimer:
+    """
+    Latencies, in seconds, and error counts for each stage of a flow; and
+    the number of flows completed.
+    """
+
+    def __init__(self):
+        self.flows = 0
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        # The first exception raised by each stage.
+        self.first_errors = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.errors[name] += 1
+            self.first_errors.setdefault(name, e)
+            raise
+        self.latencies[name].append(time.perf_counter() - start)
+
+    def merge(self, other):
+        for name, latencies in other.latencies.items():
+            self.latencies[name].extend(latencies)
+        self.errors.update(other.errors)
+        for name, error in other.first_errors.items():
+            self.first_errors.setdefault(name, error)
+        self.flows += other.flows
+
+
+def percentile(ordered, fraction):
+    """The nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return float("nan")
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def report(timer, elapsed, out=sys.stdout):
+    flows = timer.flows
+    print(
+        "{} flows in {:.2f}s; {:.0f} flows/s".format(flows, elapsed, flows / elapsed),
+        file=out,
+    )
+    columns = ["stage", "count", "errors", "ops/s"] + [
+        "{} ms".format(name) for name, _ in PERCENTILES
+    ]
+    row = "{:<18} {:>8} {:>7} {:>10}" + " {:>9}" * len(PERCENTILES)
+    print(row.format(*columns), file=out)
+    for name in sorted(set(timer.latencies) | set(timer.errors)):
+        ordered = sorted(timer.latencies[name])
+        print(
+            row.format(
+                name,
+                len(ordered),
+                timer.errors[name],
+                "{:.0f}".format(len(ordered) / elapsed),
+                *[
+                    "{:.3f}".format(percentile(ordered, fraction) * 1e3)
+                    for _, fraction in PERCENTILES
+                ]
+            ),
+            file=out,
+        )
+    for name, error in sorted(timer.first_errors.items()):
+        print("{} failed: {!r}".format(name, error), file=out)
+
+
+class Manager(U2FRegistrationManager, U2FSigningManager):
+    def create_device_registration_model(self, *, transports, **kwargs):
+        return SoftDevice(transports=transports, **kwargs)
+
+    def update_device_registration_counter(self, *, device, counter):
+        device.counter = counter
+        return device
+
+
+class InProcessUser:
+    """A user driving the managers directly."""
+
+    def __init__(self, manager, token, timer):
+        self.manager = manager
+        self.token = token
+        self.timer = timer
+        self.session = {}
+        self.devices = []
+
+    def register(self):
+        with self.timer.stage("register.challenge"):
+            request = self.manager.create_registration_challenge(
+                self.session, self.devices
+            )
+        with self.timer.stage("register.token"):
+            response = self.token.register(
+                request["appId"], request["registerRequests"][0]["challenge"]
+            )
+        with self.timer.stage("register.verify"):
+            device = self.manager.process_registration_response(self.session, response)
+        self.devices.append(device)
+        self.timer.flows += 1
+
+    def login(self):
+        with self.timer.stage("login.challenge"):
+            request = self.manager.create_signing_challenge(self.session, self.devices)
+        with self.timer.stage("login.token"):
+            response = self.token.sign(
+                request["appId"],
+                request["challenge"],
+                request["registeredKeys"][0]["keyHandle"],
+            )
+        with self.timer.stage("login.verify"):
+            self.manager.process_signing_response(self.session, response, self.devices)
+        self.timer.flows += 1
+
+
+class HttpUser:
+    """
+    A user driving the sample Flask app; with its own session cookie.
+
+    The app's forms log the user in; the flows then use the JSON endpoints of
+    its ``FlaskU2F`` extension.
+    """
+
+    def __init__(self, url, name, token, timer):
+        self.url = url.rstrip("/")
+        self.name = name
+        self.token = token
+        self.timer = timer
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+
+    def _request(self, path, form=None, data=None):
+        headers = {}
+        body = None
+        if data is not None:
+            body = json.dumps(data).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        elif form is not None:
+            body = urllib.parse.urlencode(form).encode("ascii")
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        request = urllib.request.Request(self.url + path, body, headers)
+        with self.opener.open(request) as response:
+            return response.read().decode("utf-8")
+
+    def register(self):
+        with self.timer.stage("register.start"):
+            self._request("/register", {"name": self.name})
+            request = json.loads(self._request("/u2f/register"))
+        with self.timer.stage("register.token"):
+            response = self.token.register(
+                request["appId"], request["registerRequests"][0]["challenge"]
+            )
+        with self.timer.stage("register.finish"):
+            self._request("/u2f/register", data=response)
+        self.timer.flows += 1
+
+    def login(self):
+        with self.timer.stage("login.start"):
+            self._request("/login", {"name": self.name})
+            request = json.loads(self._request("/u2f/sign"))
+        with self.timer.stage("login.token"):
+            # The user's keys may include ones from an earlier run.
+            owned = {websafe_encode(key_handle) for key_handle in self.token.keys}
+            key_handle = next(
+                key["keyHandle"]
+                for key in request["registeredKeys"]
+                if key["keyHandle"] in owned
+            )
+            response = self.token.sign(
+                request["appId"], request["challenge"], key_handle
+            )
+        with self.timer.stage("login.finish"):
+            self._request("/u2f/sign", data=response)
+        self.timer.flows += 1
+
+
+def run(make_user, users, logins, concurrency):
+    """Run ``users`` simulated users; returning their merged stage timer."""
+    timers = []
+    lock = threading.Lock()
+
+    def simulate(index):
+        timer = StageTimer()
+        with lock:
+            timers.append(timer)
+        user = make_user(index, SoftU2FToken(seed=SEED + index), timer)
+        try:
+            user.register()
+            for _ in range(logins):
+                user.login()
+        except Exception:
+            # Counted against the stage that failed; the user gives up.
+            return False
+        return True
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        completed = sum(executor.map(simulate, range(users)))
+    elapsed = time.perf_counter() - start
+    merged = StageTimer()
+    for timer in timers:
+        merged.merge(timer)
+    return merged, elapsed, completed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("target", choices=["inprocess", "http"])
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--logins", type=int, default=10, help="logins per user")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    if args.target == "inprocess":
+        manager = Manager(APP_ID)
+
+        def make_user(index, token, timer):
+            return InProcessUser(manager, token, timer)
+
+    else:
+
+        def make_user(index, token, timer):
+            return HttpUser(args.url, "load-{}".format(index), token, timer)
+
+    timer, elapsed, completed = run(
+        make_user, args.users, args.logins, args.concurrency
+    )
+    report(timer, elapsed)
+    return 0 if completed == args.users else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
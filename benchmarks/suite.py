@@ -0,0 +1,227 @@
+"""
+Time every hot path in the package.
+
+Run with ``python -m benchmarks.suite`` from the repository root::
+
+    python -m benchmarks.suite --json baseline.json
+    python -m benchmarks.suite --compare baseline.json
+
+``--compare`` flags every benchmark whose best time is more than
+``--threshold`` slower than the baseline's, and exits with status 1 if any
+are. ``--filter`` only runs benchmarks whose name contains the given text.
+"""
+import argparse
+import functools
+import json
+import platform
+import statistics
+import sys
+import timeit
+
+import cryptography
+
+from fido_u2f.device import device_as_client_dict
+from fido_u2f.enums import RequestType, U2FTransport
+from fido_u2f.key_list import RenderedKeyList
+from fido_u2f.registration import RegistrationData
+from fido_u2f.utils import (
+    check_client_data,
+    decode_client_data,
+    sha_256,
+    validate_client_data,
+    websafe_decode,
+    websafe_encode,
+)
+from fido_u2f.verification import SignatureData, U2FSigningManager
+
+from .fixtures import APP_ID, CHALLENGE, DEVICE_COUNTS, Fixtures
+
+# Each timed run lasts at least this long, in seconds.
+MIN_RUN_TIME = 0.05
+REPEAT = 5
+THRESHOLD = 0.1
+
+
+class SigningManager(U2FSigningManager):
+    def update_device_registration_counter(self, *, device, counter):
+        return device
+
+
+def benchmarks(fixtures):
+    """Return ``(name, function)`` pairs; each function takes no arguments."""
+    reg_response = fixtures.registration_response
+    sig_response = fixtures.signing_response
+    reg_bytes = fixtures.registration_data
+    sig_bytes = fixtures.signature_data
+    key_handle = websafe_encode(fixtures.key_handle)
+    app_param = sha_256(APP_ID.encode("idna"))
+    reg_chal_param = sha_256(websafe_decode(reg_response["clientData"]))
+    sig_chal_param = sha_256(websafe_decode(sig_response["clientData"]))
+    public_key = fixtures.device.public_key
+    manager = SigningManager(APP_ID)
+    session = {}
+
+    def client_data_param(raw_client_data, request_type):
+        # As the managers do; validating the client data and hashing it.
+        client_data = decode_client_data(raw_client_data)
+        check_client_data(client_data, request_type, APP_ID, CHALLENGE)
+        return sha_256(client_data)
+
+    def registration_parse():
+        data = RegistrationData(reg_bytes)
+        return data.public_key, data.key_handle, data.certificate, data.signature
+
+    def registration_verify():
+        RegistrationData(reg_bytes).verify(app_param, reg_chal_param)
+
+    def signature_parse():
+        data = SignatureData(sig_bytes)
+        return data.user_presence, data.counter, data.signature
+
+    def signature_verify():
+        SignatureData(sig_bytes).verify(app_param, sig_chal_param, public_key)
+
+    cases = [
+        ("websafe_encode", lambda: websafe_encode(fixtures.key_handle)),
+        ("websafe_decode", lambda: websafe_decode(key_handle)),
+        (
+            "validate_client_data[register]",
+            lambda: validate_client_data(
+                reg_response["clientData"], RequestType.REGISTER, APP_ID, CHALLENGE
+            ),
+        ),
+        (
+            "validate_client_data[sign]",
+            lambda: validate_client_data(
+                sig_response["clientData"], RequestType.SIGN, APP_ID, CHALLENGE
+            ),
+        ),
+        (
+            "client_data_param[sign]",
+            lambda: client_data_param(sig_response["clientData"], RequestType.SIGN),
+        ),
+        ("RegistrationData.parse", registration_parse),
+        ("RegistrationData.verify", registration_verify),
+        ("SignatureData.parse", signature_parse),
+        ("SignatureData.verify", signature_verify),
+        # USB and NFC; as a typical security key reports.
+        ("U2FTransport.from_byte", lambda: U2FTransport.from_byte(0x30)),
+        ("device_as_client_dict", lambda: device_as_client_dict(fixtures.device)),
+    ]
+    for count in DEVICE_COUNTS:
+        devices = fixtures.devices[count]
+        cases.append(
+            (
+                "create_signing_challenge[{}]".format(count),
+                functools.partial(manager.create_signing_challenge, session, devices),
+            )
+        )
+        cases.append(
+            (
+                "create_signing_challenge_json[{}]".format(count),
+                functools.partial(
+                    manager.create_signing_challenge_json,
+                    session,
+                    RenderedKeyList(APP_ID, devices),
+                ),
+            )
+        )
+    return cases
+
+
+def measure(func, min_run_time=MIN_RUN_TIME, repeat=REPEAT):
+    """Return the best and median time of one call, in microseconds."""
+    timer = timeit.Timer(func)
+    number = 1
+    while timer.timeit(number) < min_run_time:
+        number *= 2
+    times = [seconds / number * 1e6 for seconds in timer.repeat(repeat, number)]
+    return {
+        "best_us": min(times),
+        "median_us": statistics.median(times),
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cryptography": cryptography.__version__,
+    }
+
+
+def run(name_filter=None, min_run_time=MIN_RUN_TIME, repeat=REPEAT, out=sys.stdout):
+    results = {}
+    for name, func in benchmarks(Fixtures()):
+        if name_filter and name_filter not in name:
+            continue
+        results[name] = measure(func, min_run_time, repeat)
+        print("{:<36} {:>12.2f} us".format(name, results[name]["best_us"]), file=out)
+    return {"environment": environment(), "results": results}
+
+
+def compare(results, baseline, threshold=THRESHOLD, out=sys.stdout):
+    """
+    Print each benchmark's time relative to the baseline.
+
+    Returns the names of the benchmarks that are more than ``threshold``
+    slower than the baseline.
+    """
+    regressions = []
+    header = ("benchmark", "baseline", "current", "ratio")
+    print("{:<36} {:>12} {:>12} {:>8}".format(*header), file=out)
+    for name, current in sorted(results["results"].items()):
+        base = baseline["results"].get(name)
+        if base is None:
+            line = "{:<36} {:>12} {:>12.2f}".format(name, "-", current["best_us"])
+            print(line, file=out)
+            continue
+        ratio = current["best_us"] / base["best_us"]
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(
+            "{:<36} {:>12.2f} {:>12.2f} {:>7.2f}x{}".format(
+                name, base["best_us"], current["best_us"], ratio, flag
+            ),
+            file=out,
+        )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--json", metavar="PATH", help="write the results to PATH")
+    parser.add_argument(
+        "--compare", metavar="PATH", help="compare against the results in PATH"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=THRESHOLD,
+        help="the slowdown flagged as a regression (default: %(default)s)",
+    )
+    parser.add_argument("--filter", help="only run benchmarks containing this text")
+    parser.add_argument("--min-run-time", type=float, default=MIN_RUN_TIME)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    args = parser.parse_args(argv)
+
+    results = run(args.filter, args.min_run_time, args.repeat)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
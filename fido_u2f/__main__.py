@@ -0,0 +1,143 @@
+"""
+Command line tools.
+
+``python -m fido_u2f reverify ARCHIVE...`` re-verifies archived responses
+(see ``fido_u2f.reverify``) on every CPU; writing a verdict per line, as JSON
+lines, and reporting the throughput on stderr.
+"""
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .constants import REVERIFY_CHUNK_SIZE
+from .reverify import ReverifySummary, reverify
+
+from . import _typing as typ  # isort:skip
+
+_JSON_SEPARATORS = (",", ":")
+
+
+class _Progress:
+    """Reports the throughput on stderr; at most every ``interval`` seconds."""
+
+    def __init__(self, summary: ReverifySummary, interval: float) -> None:
+        self.summary = summary
+        self.interval = interval
+        self.start = self.last = time.perf_counter()
+
+    def update(self) -> None:
+        now = time.perf_counter()
+        if self.interval and now - self.last >= self.interval:
+            self.last = now
+            self.report(now)
+
+    def report(self, now: typ.Optional[float] = None) -> None:
+        if now is None:
+            now = time.perf_counter()
+        elapsed = max(now - self.start, 1e-9)
+        summary = self.summary
+        print(
+            "{} responses ({} valid, {} invalid) in {:.1f}s; {:.0f} responses/s".format(
+                summary.total,
+                summary.valid,
+                summary.invalid,
+                elapsed,
+                summary.total / elapsed,
+            ),
+            file=sys.stderr,
+        )
+
+
+def reverify_command(args: argparse.Namespace) -> int:
+    summary = ReverifySummary()
+    progress = _Progress(summary, args.progress)
+    executor = None
+    if args.processes != 1:
+        executor = ProcessPoolExecutor(args.processes or None)
+    out = args.output
+    try:
+        for archive in args.archives:
+            verdicts = reverify(
+                archive,
+                executor=executor,
+                chunk_size=args.chunk_size,
+                attestation_roots=args.attestation_roots,
+            )
+            for verdict in verdicts:
+                summary.add(verdict)
+                if len(args.archives) > 1:
+                    verdict["archive"] = archive.name
+                out.write(json.dumps(verdict, separators=_JSON_SEPARATORS))
+                out.write("\n")
+                progress.update()
+            out.flush()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    progress.report()
+    for reason, count in summary.reasons.most_common():
+        print("{:>10} {}".format(count, reason), file=sys.stderr)
+    return 1 if summary.invalid else 0
+
+
+def main(argv: typ.Optional[typ.Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m fido_u2f")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    parser_reverify = commands.add_parser(
+        "reverify",
+        help="re-verify archived registration and signing responses",
+        description=(
+            "Re-verify archived responses; writing a verdict for each as JSON "
+            "lines. Exits with 1 if any response is invalid."
+        ),
+    )
+    parser_reverify.add_argument(
+        "archives",
+        nargs="+",
+        type=argparse.FileType("r", encoding="utf-8"),
+        help="JSON lines archives of responses; - for stdin",
+    )
+    parser_reverify.add_argument(
+        "-o",
+        "--output",
+        type=argparse.FileType("w", encoding="utf-8"),
+        default="-",
+        help="where to write the verdicts; stdout by default",
+    )
+    parser_reverify.add_argument(
+        "-j",
+        "--processes",
+        type=int,
+        default=0,
+        help="worker processes; 0 (the default) for one per CPU, 1 for none",
+    )
+    parser_reverify.add_argument(
+        "--chunk-size",
+        type=int,
+        default=REVERIFY_CHUNK_SIZE,
+        help="responses sent to a worker at a time",
+    )
+    parser_reverify.add_argument(
+        "--attestation-roots",
+        metavar="DIRECTORY",
+        help="only trust attestation certificates issued by the CAs in DIRECTORY",
+    )
+    parser_reverify.add_argument(
+        "--progress",
+        type=float,
+        default=10.0,
+        metavar="SECONDS",
+        help="report the throughput this often; 0 to only report at the end",
+    )
+    parser_reverify.set_defaults(run=reverify_command)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,3 +4,8 @@ from typing import *  # noqa: F401, F403
 # Python 3.5 support
 if not hasattr(typ, "Collection"):
     Collection = typ.Sequence
+if not hasattr(typ, "ContextManager"):
+    _T_co = typ.TypeVar("_T_co", covariant=True)
+
+    class ContextManager(typ.Generic[_T_co]):  # type: ignore
+        pass
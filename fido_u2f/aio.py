@@ -0,0 +1,248 @@
+"""
+Asyncio variants of the registration and signing managers.
+
+The storage hooks are coroutines, and the parsing and signature verification
+are run on an executor so they don't block the event loop. The session is
+only used on the event loop; its challenge is taken before verifying. Every
+processing method takes an optional ``timeout`` in seconds; the challenge is
+consumed even when the request times out or is cancelled.
+"""
+import abc
+import asyncio
+import functools
+from concurrent.futures import Executor
+
+from .app_context import AppContext
+from .attestation import AttestationTrustStore
+from .challenge_store import ChallengeStore
+from .challenge_tokens import ChallengeTokens
+from .constants import U2F_V2
+from .counters import check_counter_increased
+from .device import DeviceRegistration
+from .enums import U2FTransports
+from .registration import U2FRegistrationManager
+from .tracing import CERTIFICATE, DECODE, REGISTRATION, SIGNING, STORE, Tracer, span
+from .utils import ClientData, load_response_body
+from .verification import U2FSigningManager
+
+from . import _typing as typ  # isort:skip
+
+T = typ.TypeVar("T")
+
+# ``asyncio.get_running_loop`` is new in Python 3.7.
+get_running_loop = getattr(asyncio, "get_running_loop", asyncio.get_event_loop)
+
+
+class _AsyncManagerMixin:
+
+    executor = None  # type: typ.Optional[Executor]
+    # The default timeout, in seconds, for processing a response.
+    TIMEOUT = None  # type: typ.Optional[float]
+
+    async def run_in_executor(
+        self, func: typ.Callable[..., T], *args: typ.Any, **kwargs: typ.Any
+    ) -> T:
+        """
+        Run ``func`` on the manager's executor.
+
+        Without an executor the event loop's default executor is used.
+        """
+        loop = get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs)
+        )
+
+    async def with_timeout(
+        self, awaitable: typ.Awaitable[T], timeout: typ.Optional[float]
+    ) -> T:
+        if timeout is None:
+            timeout = self.TIMEOUT
+        if timeout is None:
+            return await awaitable
+        return await asyncio.wait_for(awaitable, timeout)
+
+
+class AsyncU2FRegistrationManager(_AsyncManagerMixin, U2FRegistrationManager):
+    def __init__(
+        self,
+        app_id: typ.Union[str, AppContext],
+        *,
+        executor: typ.Optional[Executor] = None,
+        attestation_trust_store: typ.Optional[AttestationTrustStore] = None,
+        challenge_store: typ.Optional[ChallengeStore] = None,
+        challenge_tokens: typ.Optional[ChallengeTokens] = None,
+        tracer: typ.Optional[Tracer] = None
+    ) -> None:
+        super().__init__(
+            app_id,
+            attestation_trust_store=attestation_trust_store,
+            challenge_store=challenge_store,
+            challenge_tokens=challenge_tokens,
+            tracer=tracer,
+        )
+        self.executor = executor
+
+    @abc.abstractmethod
+    async def create_device_registration_model(  # type: ignore
+        self,
+        *,
+        version: str,
+        app_id: str,
+        key_handle: bytes,
+        public_key: bytes,
+        transports: U2FTransports
+    ) -> DeviceRegistration:
+        ...
+
+    async def process_registration_response(  # type: ignore
+        self,
+        session: typ.MutableMapping[str, typ.Any],
+        response_dict: typ.Mapping[str, str],
+        *,
+        timeout: typ.Optional[float] = None
+    ) -> DeviceRegistration:
+        return await self.with_timeout(
+            self._process_registration_response(session, response_dict), timeout
+        )
+
+    async def process_registration_body(  # type: ignore
+        self,
+        session: typ.MutableMapping[str, typ.Any],
+        body: typ.Union[str, bytes],
+        *,
+        timeout: typ.Optional[float] = None
+    ) -> DeviceRegistration:
+        with span(self.tracer, DECODE):
+            response_dict = load_response_body(body)
+        return await self.process_registration_response(
+            session, response_dict, timeout=timeout
+        )
+
+    async def _process_registration_response(
+        self,
+        session: typ.MutableMapping[str, typ.Any],
+        response_dict: typ.Mapping[str, str],
+    ) -> DeviceRegistration:
+        with span(self.tracer, REGISTRATION):
+            client_data = self.decode_response_client_data(response_dict)
+            challenge = self.take_registration_challenge(
+                session, response_dict, client_data
+            )
+            registration_data = await self.run_in_executor(
+                self._verify_registration_data, response_dict, challenge, client_data
+            )
+            with span(self.tracer, STORE):
+                return await self.create_device_registration_model(
+                    version=U2F_V2,
+                    app_id=self.app_id,
+                    key_handle=registration_data.key_handle,
+                    public_key=registration_data.public_key,
+                    transports=registration_data.get_supported_transports(),
+                )
+
+    def _verify_registration_data(
+        self,
+        response_dict: typ.Mapping[str, str],
+        challenge: str,
+        client_data: typ.Optional[ClientData],
+    ) -> typ.Any:
+        registration_data = self.verify_registration_data(
+            response_dict, challenge, client_data=client_data
+        )
+        # Parse the certificate here; rather than on the event loop.
+        with span(self.tracer, CERTIFICATE):
+            registration_data.get_supported_transports()
+        return registration_data
+
+
+class AsyncU2FSigningManager(_AsyncManagerMixin, U2FSigningManager):
+    @abc.abstractmethod
+    async def update_device_registration_counter(  # type: ignore
+        self, *, device: DeviceRegistration, counter: int
+    ) -> DeviceRegistration:
+        ...
+
+    async def process_signing_response(  # type: ignore
+        self,
+        session: typ.MutableMapping[str, typ.Any],
+        response_dict: typ.Mapping[str, str],
+        registered_devices: typ.Collection[DeviceRegistration] = (),
+        *,
+        timeout: typ.Optional[float] = None
+    ) -> DeviceRegistration:
+        return await self.with_timeout(
+            self._process_signing_response(session, response_dict, registered_devices),
+            timeout,
+        )
+
+    async def process_signing_body(  # type: ignore
+        self,
+        session: typ.MutableMapping[str, typ.Any],
+        body: typ.Union[str, bytes],
+        registered_devices: typ.Collection[DeviceRegistration] = (),
+        *,
+        timeout: typ.Optional[float] = None
+    ) -> DeviceRegistration:
+        with span(self.tracer, DECODE):
+            response_dict = load_response_body(body)
+        return await self.process_signing_response(
+            session, response_dict, registered_devices, timeout=timeout
+        )
+
+    async def process_signing_responses(  # type: ignore
+        self,
+        requests: typ.Iterable[
+            typ.Tuple[
+                typ.MutableMapping[str, typ.Any],
+                typ.Mapping[str, str],
+                typ.Collection[DeviceRegistration],
+            ]
+        ],
+        *,
+        timeout: typ.Optional[float] = None
+    ) -> typ.List[typ.Union[DeviceRegistration, BaseException]]:
+        """
+        Process many requests concurrently.
+
+        The result for each request is either the updated device or the
+        exception raised while processing it; ``timeout`` applies per request.
+        """
+        return await asyncio.gather(
+            *[
+                self.process_signing_response(*request, timeout=timeout)
+                for request in requests
+            ],
+            return_exceptions=True
+        )
+
+    async def _process_signing_response(
+        self,
+        session: typ.MutableMapping[str, typ.Any],
+        response_dict: typ.Mapping[str, str],
+        registered_devices: typ.Collection[DeviceRegistration],
+    ) -> DeviceRegistration:
+        with span(self.tracer, SIGNING):
+            client_data = self.decode_response_client_data(response_dict)
+            challenge = self.take_signing_challenge(session, response_dict, client_data)
+            device, signature_data = await self.run_in_executor(
+                self.verify_signing_data,
+                response_dict,
+                challenge,
+                registered_devices,
+                client_data=client_data,
+            )
+            return await self.update_counter(device, signature_data.counter)
+
+    async def update_counter(  # type: ignore
+        self, device: DeviceRegistration, counter: int
+    ) -> DeviceRegistration:
+        with span(self.tracer, STORE):
+            if self.counter_sink is not None:
+                # Recording may read the store, or flush to it; so not on the
+                #  event loop.
+                await self.run_in_executor(self.counter_sink.record, device, counter)
+                return device
+            check_counter_increased(device, counter)
+            return await self.update_device_registration_counter(
+                device=device, counter=counter
+            )
@@ -0,0 +1,81 @@
+from .cache import LRUCache
+from .constants import APP_CONTEXT_CACHE_SIZE
+from .utils import sha_256
+
+from . import _typing as typ  # isort:skip
+
+ManagerT = typ.TypeVar("ManagerT")
+
+
+class AppContext:
+    """
+    The state derived from an app ID; computed once and shared between requests.
+
+    ``trusted_facets`` are the additional origins that may use this app ID.
+    The app ID itself is always a trusted origin.
+    """
+
+    __slots__ = ("app_id", "app_param", "trusted_facets")
+
+    def __init__(self, app_id: str, trusted_facets: typ.Iterable[str] = ()) -> None:
+        self.app_id = app_id
+        self.app_param = sha_256(app_id.encode("idna"))
+        self.trusted_facets = frozenset(trusted_facets) | {app_id}
+
+    def __repr__(self) -> str:
+        return "AppContext({!r}, trusted_facets={!r})".format(
+            self.app_id, sorted(self.trusted_facets - {self.app_id})
+        )
+
+    def is_trusted_origin(self, origin: str) -> bool:
+        return origin in self.trusted_facets
+
+
+_app_contexts = LRUCache(APP_CONTEXT_CACHE_SIZE)
+
+
+def compile_app_context(app_id: typ.Union[str, AppContext]) -> AppContext:
+    """
+    Return the ``AppContext`` for the app ID; reusing a cached one if possible.
+    """
+    if isinstance(app_id, AppContext):
+        return app_id
+    context = _app_contexts.get(app_id)
+    if context is None:
+        context = AppContext(app_id)
+        _app_contexts.put(app_id, context)
+    return context
+
+
+class ManagerPool(typ.Generic[ManagerT]):
+    """
+    A bounded pool of managers; keyed by app ID.
+
+    ``factory`` is given the ``AppContext`` for the app ID and should return a
+    manager for it. ``resolve_app_context`` maps an app ID to its context, use
+    it to load a tenant's trusted facets.
+    """
+
+    def __init__(
+        self,
+        factory: typ.Callable[[AppContext], ManagerT],
+        maxsize: int = 1024,
+        resolve_app_context: typ.Callable[[str], AppContext] = compile_app_context,
+    ) -> None:
+        self.factory = factory
+        self.resolve_app_context = resolve_app_context
+        self._managers = LRUCache(maxsize)
+
+    def __len__(self) -> int:
+        return len(self._managers)
+
+    def get(self, app_id: str) -> ManagerT:
+        manager = self._managers.get(app_id)
+        if manager is None:
+            manager = self.factory(self.resolve_app_context(app_id))
+            self._managers.put(app_id, manager)
+        return manager
+
+    def discard(self, app_id: str) -> None:
+        """Remove the app's manager; the next ``get`` will create a new one."""
+        self._managers.pop(app_id)
@@ -0,0 +1,195 @@
+import pathlib
+
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+
+from .cache import LRUCache
+from .constants import ATTESTATION_CACHE_SIZE, ATTESTATION_MAX_CHAIN_LENGTH
+from .exceptions import U2FInvalidDataException
+
+from . import _typing as typ  # isort:skip
+
+PEM_CERTIFICATE_END = b"-----END CERTIFICATE-----"
+PEM_SUFFIXES = (".pem", ".crt")
+
+_CertificatesByName = typ.Dict[x509.Name, typ.List[x509.Certificate]]
+
+
+def load_pem_certificates(data: bytes) -> typ.List[x509.Certificate]:
+    """Load every certificate in a PEM bundle."""
+    certificates = []
+    for block in data.split(PEM_CERTIFICATE_END)[:-1]:
+        certificates.append(
+            x509.load_pem_x509_certificate(
+                block + PEM_CERTIFICATE_END, default_backend()
+            )
+        )
+    return certificates
+
+
+def is_signed_by(certificate: x509.Certificate, issuer: x509.Certificate) -> bool:
+    """Check that ``issuer`` issued and signed ``certificate``."""
+    if certificate.issuer != issuer.subject:
+        return False
+    public_key = issuer.public_key()
+    try:
+        if isinstance(public_key, ec.EllipticCurvePublicKey):
+            public_key.verify(
+                certificate.signature,
+                certificate.tbs_certificate_bytes,
+                ec.ECDSA(certificate.signature_hash_algorithm),
+            )
+        elif isinstance(public_key, rsa.RSAPublicKey):
+            public_key.verify(
+                certificate.signature,
+                certificate.tbs_certificate_bytes,
+                padding.PKCS1v15(),
+                certificate.signature_hash_algorithm,
+            )
+        else:
+            return False
+    except InvalidSignature:
+        return False
+    return True
+
+
+def is_ca(certificate: x509.Certificate) -> bool:
+    """
+    Check that ``certificate`` may issue certificates.
+
+    It needs the basic constraints extension, with the CA flag set; and, if it
+    has the key usage extension, ``keyCertSign``.
+    """
+    extensions = certificate.extensions
+    try:
+        basic_constraints = extensions.get_extension_for_class(x509.BasicConstraints)
+    except x509.ExtensionNotFound:
+        return False
+    if not basic_constraints.value.ca:
+        return False
+    try:
+        key_usage = extensions.get_extension_for_class(x509.KeyUsage)
+    except x509.ExtensionNotFound:
+        return True
+    return key_usage.value.key_cert_sign
+
+
+class AttestationTrustStore:
+    """
+    A set of trusted root and intermediate CAs for attestation certificates.
+
+    A certificate is trusted when it is signed by a root; either directly or
+    through a chain of intermediates. Verdicts are cached by the certificate's
+    SHA-256 fingerprint, so each distinct batch certificate is only verified
+    once. Only CA certificates (see ``is_ca``) are used as issuers. Validity
+    periods are not checked; attestation certificates are burnt into the
+    devices and routinely outlive them.
+    """
+
+    def __init__(
+        self,
+        roots: typ.Iterable[x509.Certificate] = (),
+        intermediates: typ.Iterable[x509.Certificate] = (),
+        *,
+        cache_size: int = ATTESTATION_CACHE_SIZE
+    ) -> None:
+        self._roots = {}  # type: _CertificatesByName
+        self._intermediates = {}  # type: _CertificatesByName
+        self.verdicts = LRUCache(cache_size)
+        for root in roots:
+            self.add_root(root)
+        for intermediate in intermediates:
+            self.add_intermediate(intermediate)
+
+    @classmethod
+    def from_pem_files(
+        cls,
+        roots: typ.Iterable[typ.Union[str, pathlib.Path]],
+        intermediates: typ.Iterable[typ.Union[str, pathlib.Path]] = (),
+        **kwargs: typ.Any
+    ) -> "AttestationTrustStore":
+        return cls(
+            [cert for path in roots for cert in _load_pem_file(path)],
+            [cert for path in intermediates for cert in _load_pem_file(path)],
+            **kwargs
+        )
+
+    @classmethod
+    def from_directory(
+        cls, directory: typ.Union[str, pathlib.Path], **kwargs: typ.Any
+    ) -> "AttestationTrustStore":
+        """
+        Load every ``.pem`` and ``.crt`` file in the directory.
+
+        Self-signed CA certificates are roots; other CA certificates are
+        intermediates. Anything else can't issue certificates, and is skipped.
+        """
+        roots = []
+        intermediates = []
+        for path in sorted(pathlib.Path(str(directory)).iterdir()):
+            if path.suffix.lower() not in PEM_SUFFIXES:
+                continue
+            for cert in _load_pem_file(path):
+                if not is_ca(cert):
+                    continue
+                if cert.issuer == cert.subject and is_signed_by(cert, cert):
+                    roots.append(cert)
+                else:
+                    intermediates.append(cert)
+        return cls(roots, intermediates, **kwargs)
+
+    def add_root(self, certificate: x509.Certificate) -> None:
+        self._roots.setdefault(certificate.subject, []).append(certificate)
+        self.verdicts.clear()
+
+    def add_intermediate(self, certificate: x509.Certificate) -> None:
+        self._intermediates.setdefault(certificate.subject, []).append(certificate)
+        self.verdicts.clear()
+
+    def is_trusted(
+        self, certificate: x509.Certificate, fingerprint: typ.Optional[bytes] = None
+    ) -> bool:
+        if fingerprint is None:
+            fingerprint = certificate.fingerprint(hashes.SHA256())
+        trusted = self.verdicts.get(fingerprint)
+        if trusted is None:
+            trusted = self._verify_chain(certificate)
+            self.verdicts.put(fingerprint, trusted)
+        return trusted
+
+    def verify(self, registration_data: typ.Any) -> None:
+        """
+        Check the attestation certificate of a ``RegistrationData``.
+
+        Raises ``U2FInvalidDataException`` if the certificate is not trusted.
+        """
+        certificate = registration_data.get_x509_certificate()
+        if not self.is_trusted(certificate, registration_data.fingerprint):
+            raise U2FInvalidDataException("Attestation certificate is not trusted")
+
+    def _verify_chain(self, certificate: x509.Certificate) -> bool:
+        chain = [certificate]
+        while len(chain) <= ATTESTATION_MAX_CHAIN_LENGTH:
+            current = chain[-1]
+            for root in self._roots.get(current.issuer, ()):
+                if is_ca(root) and is_signed_by(current, root):
+                    return True
+            for issuer in self._intermediates.get(current.issuer, ()):
+                if (
+                    issuer not in chain
+                    and is_ca(issuer)
+                    and is_signed_by(current, issuer)
+                ):
+                    chain.append(issuer)
+                    break
+            else:
+                return False
+        return False
+
+
+def _load_pem_file(path: typ.Union[str, pathlib.Path]) -> typ.List[x509.Certificate]:
+    with open(str(path), "rb") as f:
+        return load_pem_certificates(f.read())
@@ -0,0 +1,259 @@
+"""
+Streaming export and import of device registrations.
+
+Devices are streamed as ``(owner_id, device)`` pairs, as taken by
+``build_device_registry``, in one of two formats:
+
+JSON lines
+    One object per line; the fields of ``device_as_client_dict`` plus the
+    ``owner``, ``publicKey`` (base64url) and ``counter``.
+Binary
+    A ``U2FX`` header, then each device as a length-prefixed UTF-8 owner ID
+    followed by a ``DeviceRecord``.
+
+The readers and writers work on one device at a time, so any number of
+devices can be moved in constant memory. ``import_devices`` writes the
+devices to a ``DeviceSink`` in batches.
+"""
+import abc
+import json
+import struct
+
+from .constants import BULK_BATCH_SIZE, U2F_V2
+from .device import DeviceRecord, DeviceRegistration, device_as_client_dict
+from .enums import U2FTransport
+from .exceptions import U2FInvalidDataException
+from .utils import websafe_decode, websafe_encode
+
+from . import _typing as typ  # isort:skip
+
+MAGIC = b"U2FX"
+FORMAT = 1
+HEADER = struct.Struct(">4sB3x")
+OWNER_LENGTH = struct.Struct(">H")
+
+OwnedDevice = typ.Tuple[str, DeviceRegistration]
+OwnedRecord = typ.Tuple[str, DeviceRecord]
+# Called with the (zero-based) index of an invalid entry, and the error.
+InvalidHandler = typ.Callable[[int, U2FInvalidDataException], None]
+
+_TRANSPORTS_BY_NAME = {t.internal_name: t.value for t in U2FTransport}
+_JSON_SEPARATORS = (",", ":")
+
+
+def validate_record(record: DeviceRecord) -> None:
+    """Raise ``U2FInvalidDataException`` if the record can't be a U2F device."""
+    if record.version != U2F_V2:
+        raise U2FInvalidDataException("Unsupported device version")
+    if not record.app_id:
+        raise U2FInvalidDataException("Device has no app ID")
+    if not 0 < len(record.key_handle) < 256:
+        raise U2FInvalidDataException("Device key handle has an invalid length")
+    if len(record.public_key) != 65 or record.public_key[0] != 0x04:
+        raise U2FInvalidDataException("Device public key is not a P-256 point")
+    if not 0 <= record.counter <= 0xFFFFFFFF:
+        raise U2FInvalidDataException("Device counter is out of range")
+    if not -1 <= record.transports <= 0xFF:
+        raise U2FInvalidDataException("Device transports are out of range")
+
+
+def _invalid(
+    index: int,
+    error: U2FInvalidDataException,
+    on_invalid: typ.Optional[InvalidHandler],
+) -> None:
+    if on_invalid is None:
+        raise U2FInvalidDataException(
+            "Device {}: {}".format(index, error.args[0])
+        ) from error
+    on_invalid(index, error)
+
+
+def device_as_export_dict(
+    owner: str, device: DeviceRegistration
+) -> typ.Dict[str, typ.Any]:
+    data = device_as_client_dict(device, cache=False)
+    data["owner"] = owner
+    data["publicKey"] = websafe_encode(device.public_key)
+    data["counter"] = device.counter or 0
+    return data
+
+
+def record_from_export_dict(data: typ.Mapping[str, typ.Any]) -> OwnedRecord:
+    try:
+        transport_names = data["transports"]
+        if transport_names is None:
+            transports = -1
+        else:
+            transports = 0
+            for name in transport_names:
+                transports |= _TRANSPORTS_BY_NAME[name]
+        owner = data["owner"]
+        record = DeviceRecord(
+            data["version"],
+            data["appId"],
+            websafe_decode(data["keyHandle"]),
+            websafe_decode(data["publicKey"]),
+            data["counter"],
+            transports,
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        raise U2FInvalidDataException("Device is missing or has invalid fields") from e
+    if not (
+        isinstance(owner, str)
+        and isinstance(record.version, str)
+        and isinstance(record.app_id, str)
+        and isinstance(record.counter, int)
+    ):
+        raise U2FInvalidDataException("Device is missing or has invalid fields")
+    return owner, record
+
+
+def write_jsonl(devices: typ.Iterable[OwnedDevice], f: typ.TextIO) -> int:
+    """Write the devices to a text file, one per line; returning the count."""
+    count = 0
+    for owner, device in devices:
+        data = device_as_export_dict(owner, device)
+        f.write(json.dumps(data, separators=_JSON_SEPARATORS))
+        f.write("\n")
+        count += 1
+    return count
+
+
+def read_jsonl(
+    f: typ.Iterable[str], *, on_invalid: typ.Optional[InvalidHandler] = None
+) -> typ.Iterator[OwnedRecord]:
+    """
+    Read the devices written by ``write_jsonl``.
+
+    Invalid devices raise ``U2FInvalidDataException``; unless ``on_invalid``
+    is given, in which case it is called and the device is skipped.
+    """
+    index = 0
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            owner, record = _parse_json_line(line)
+            validate_record(record)
+        except U2FInvalidDataException as e:
+            _invalid(index, e, on_invalid)
+        else:
+            yield owner, record
+        index += 1
+
+
+def _parse_json_line(line: str) -> OwnedRecord:
+    try:
+        data = json.loads(line)
+    except ValueError as e:
+        raise U2FInvalidDataException("Device is not valid JSON") from e
+    if not isinstance(data, dict):
+        raise U2FInvalidDataException("Device is not a JSON object")
+    return record_from_export_dict(data)
+
+
+def write_binary(devices: typ.Iterable[OwnedDevice], f: typ.BinaryIO) -> int:
+    """Write the devices to a binary file; returning the count."""
+    f.write(HEADER.pack(MAGIC, FORMAT))
+    count = 0
+    for owner, device in devices:
+        owner_bytes = owner.encode("utf-8")
+        f.write(OWNER_LENGTH.pack(len(owner_bytes)))
+        f.write(owner_bytes)
+        if not isinstance(device, DeviceRecord):
+            device = DeviceRecord.from_device(device)
+        f.write(device.to_bytes())
+        count += 1
+    return count
+
+
+def read_binary(
+    f: typ.BinaryIO, *, on_invalid: typ.Optional[InvalidHandler] = None
+) -> typ.Iterator[OwnedRecord]:
+    """
+    Read the devices written by ``write_binary``.
+
+    ``on_invalid`` is as for ``read_jsonl``; but a truncated file always
+    raises, as nothing after it can be read.
+    """
+    magic, fmt = HEADER.unpack(_read_exactly(f, HEADER.size))
+    if magic != MAGIC or fmt != FORMAT:
+        raise U2FInvalidDataException("Not a device export file")
+    return _read_binary_devices(f, on_invalid)
+
+
+def _read_binary_devices(
+    f: typ.BinaryIO, on_invalid: typ.Optional[InvalidHandler]
+) -> typ.Iterator[OwnedRecord]:
+    index = 0
+    while True:
+        prefix = f.read(OWNER_LENGTH.size)
+        if not prefix:
+            return
+        if len(prefix) != OWNER_LENGTH.size:
+            raise U2FInvalidDataException("Device export file is truncated")
+        (owner_length,) = OWNER_LENGTH.unpack(prefix)
+        owner_bytes = _read_exactly(f, owner_length)
+        header = _read_exactly(f, DeviceRecord.HEADER.size)
+        # The lengths of the version, app ID, key handle and public key.
+        body = _read_exactly(f, sum(DeviceRecord.HEADER.unpack(header)[3:]))
+        try:
+            owner = _decode_owner(owner_bytes)
+            record = DeviceRecord.from_bytes(header + body)
+            validate_record(record)
+        except U2FInvalidDataException as e:
+            _invalid(index, e, on_invalid)
+        else:
+            yield owner, record
+        index += 1
+
+
+def _decode_owner(owner: bytes) -> str:
+    try:
+        return str(owner, "utf-8")
+    except UnicodeDecodeError as e:
+        raise U2FInvalidDataException("Device owner is not UTF-8") from e
+
+
+def _read_exactly(f: typ.BinaryIO, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise U2FInvalidDataException("Device export file is truncated")
+    return data
+
+
+class DeviceSink(abc.ABC):
+    @abc.abstractmethod
+    def write_batch(self, devices: typ.Sequence[OwnedRecord]) -> None:
+        """
+        Store, and commit, a batch of devices.
+
+        The batch is not reused once this returns.
+        """
+        ...
+
+
+def import_devices(
+    devices: typ.Iterable[OwnedRecord],
+    sink: DeviceSink,
+    *,
+    batch_size: int = BULK_BATCH_SIZE
+) -> int:
+    """
+    Write the devices to ``sink``, ``batch_size`` at a time.
+
+    Returns the number of devices written.
+    """
+    count = 0
+    batch = []  # type: typ.List[OwnedRecord]
+    for device in devices:
+        batch.append(device)
+        if len(batch) >= batch_size:
+            sink.write_batch(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        sink.write_batch(batch)
+        count += len(batch)
+    return count
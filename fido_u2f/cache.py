@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+from . import _typing as typ  # isort:skip
+
+CacheStats = namedtuple(
+    "CacheStats", ["hits", "misses", "evictions", "size", "maxsize"]
+)
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    A thread-safe, size-bounded, least-recently-used mapping.
+
+    Setting ``maxsize`` to ``0`` disables the cache; every lookup is then a
+    miss and nothing is stored.
+    """
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        if maxsize < 0:
+            raise ValueError("maxsize must not be negative.")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()  # type: typ.MutableMapping[typ.Hashable, typ.Any]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: typ.Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key: typ.Hashable, default: typ.Any = None) -> typ.Any:
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)  # type: ignore
+            self.hits += 1
+            return value
+
+    def put(self, key: typ.Hashable, value: typ.Any) -> None:
+        with self._lock:
+            self._put(key, value)
+
+    def get_or_create(
+        self, key: typ.Hashable, factory: typ.Callable[[], typ.Any]
+    ) -> typ.Any:
+        """
+        Return the cached value for ``key``; creating it with ``factory``.
+
+        The factory is called outside of the lock, so two threads missing on
+        the same key at once may both call it; the last one to finish wins.
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.put(key, value)
+        return value
+
+    def pop(self, key: typ.Hashable, default: typ.Any = None) -> typ.Any:
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def resize(self, maxsize: int) -> None:
+        """Change the maximum size; evicting entries if it has shrunk."""
+        if maxsize < 0:
+            raise ValueError("maxsize must not be negative.")
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                self.hits, self.misses, self.evictions, len(self._data), self.maxsize
+            )
+
+    def _put(self, key: typ.Hashable, value: typ.Any) -> None:
+        if self.maxsize == 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)  # type: ignore
+        self._evict()
+
+    def _evict(self) -> None:
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)  # type: ignore
+            self.evictions += 1
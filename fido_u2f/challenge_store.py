@@ -0,0 +1,174 @@
+"""
+Server-side storage for issued challenges.
+
+With a challenge store the managers keep only a short, random ticket in the
+session; the challenge itself is held by the store until it is used or it
+expires.
+"""
+import abc
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .constants import CHALLENGE_STORE_SHARDS, CHALLENGE_STORE_SIZE, CHALLENGE_TTL
+from .utils import websafe_encode
+
+from . import _typing as typ  # isort:skip
+
+
+def new_ticket() -> str:
+    return websafe_encode(os.urandom(16))
+
+
+class ChallengeStore(abc.ABC):
+    @abc.abstractmethod
+    def put(self, challenge: str) -> str:
+        """Store the challenge; returning the ticket to retrieve it with."""
+        ...
+
+    @abc.abstractmethod
+    def pop(self, ticket: str) -> typ.Optional[str]:
+        """
+        Remove and return the challenge for the ticket.
+
+        Returns ``None`` if the ticket is unknown or the challenge has expired.
+        """
+        ...
+
+
+class _Shard:
+    __slots__ = ("lock", "challenges")
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # Ticket -> (expiry, challenge); in insertion, and so expiry, order.
+        self.challenges = OrderedDict()  # type: typ.Dict[str, typ.Tuple[float, str]]
+
+
+class MemoryChallengeStore(ChallengeStore):
+    """
+    An in-process challenge store.
+
+    Tickets are spread over ``shards`` independently locked shards. Every
+    challenge has the same time to live, so each shard is ordered by expiry;
+    expired challenges are dropped from its front whenever it is used. Once
+    a shard is full its oldest challenges are discarded.
+    """
+
+    def __init__(
+        self,
+        ttl: float = CHALLENGE_TTL,
+        maxsize: int = CHALLENGE_STORE_SIZE,
+        shards: int = CHALLENGE_STORE_SHARDS,
+        clock: typ.Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.ttl = ttl
+        self.shard_size = max(1, maxsize // shards)
+        self.clock = clock
+        self._shards = [_Shard() for _ in range(shards)]
+
+    def __len__(self) -> int:
+        return sum(len(shard.challenges) for shard in self._shards)
+
+    def put(self, challenge: str) -> str:
+        ticket = new_ticket()
+        now = self.clock()
+        shard = self._shard(ticket)
+        with shard.lock:
+            self._expire(shard, now)
+            shard.challenges[ticket] = (now + self.ttl, challenge)
+            while len(shard.challenges) > self.shard_size:
+                shard.challenges.popitem(last=False)  # type: ignore
+        return ticket
+
+    def pop(self, ticket: str) -> typ.Optional[str]:
+        now = self.clock()
+        shard = self._shard(ticket)
+        with shard.lock:
+            self._expire(shard, now)
+            entry = shard.challenges.pop(ticket, None)
+        if entry is None:
+            return None
+        return entry[1]
+
+    def _shard(self, ticket: str) -> _Shard:
+        return self._shards[hash(ticket) % len(self._shards)]
+
+    @staticmethod
+    def _expire(shard: _Shard, now: float) -> None:
+        challenges = shard.challenges
+        while challenges:
+            ticket, (expiry, _) = next(iter(challenges.items()))
+            if expiry > now:
+                break
+            del challenges[ticket]
+
+
+class SQLiteChallengeStore(ChallengeStore):
+    """
+    A challenge store in an SQLite database; shared by every process using it.
+
+    Each thread uses its own connection. Expired challenges are deleted as
+    new ones are stored.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = CHALLENGE_TTL,
+        clock: typ.Callable[[], float] = time.time,
+    ) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS u2f_challenges ("
+                " ticket TEXT PRIMARY KEY,"
+                " challenge TEXT NOT NULL,"
+                " expires REAL NOT NULL"
+                ")"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS u2f_challenges_expires"
+                " ON u2f_challenges (expires)"
+            )
+
+    def put(self, challenge: str) -> str:
+        ticket = new_ticket()
+        now = self.clock()
+        with self._connection() as connection:
+            connection.execute("DELETE FROM u2f_challenges WHERE expires <= ?", (now,))
+            connection.execute(
+                "INSERT INTO u2f_challenges (ticket, challenge, expires)"
+                " VALUES (?, ?, ?)",
+                (ticket, challenge, now + self.ttl),
+            )
+        return ticket
+
+    def pop(self, ticket: str) -> typ.Optional[str]:
+        connection = self._connection()
+        with connection:
+            # Take the write lock first; so only one process can use a ticket.
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT challenge, expires FROM u2f_challenges WHERE ticket = ?",
+                (ticket,),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute("DELETE FROM u2f_challenges WHERE ticket = ?", (ticket,))
+        challenge, expires = row
+        if expires <= self.clock():
+            return None
+        return challenge
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None)
+            self._local.connection = connection
+        return connection
@@ -0,0 +1,199 @@
+"""
+Stateless challenges.
+
+Give the managers ``ChallengeTokens`` and each challenge they issue is a
+token, authenticated with an HMAC, rather than random bytes kept in the
+session or a challenge store::
+
+    tokens = ChallengeTokens({1: secret})
+    manager = MyManager(app_id, challenge_tokens=tokens)
+
+The token holds when it was issued and a random nonce; the MAC also covers
+the app ID, the step (registration or signing) and the user's binding. The
+client echoes the token back in its client data, so any process with the
+same keys can check the response; whichever one issued the challenge.
+
+The managers bind each token to ``CHALLENGE_BINDING_KEY`` in the session,
+and won't issue or take one without it; so a response only answers for the
+user it was made for.
+
+Tokens can be used until they expire, unless a ``ReplayGuard`` is given;
+which remembers the nonces of used tokens until they expire. Without one, a
+captured response can be replayed, by the same user, for the token's whole
+TTL. A ``MemoryReplayGuard`` only knows of the tokens used in its own
+process.
+
+Keys are identified by a number from 0 to 255, which is part of the token.
+To rotate keys add the new key, then make it current once every process has
+it; remove the old key once its last tokens have expired.
+"""
+import abc
+import hmac
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from .constants import (
+    CHALLENGE_REPLAY_GUARD_SIZE,
+    CHALLENGE_TOKEN_CLOCK_SKEW,
+    CHALLENGE_TTL,
+)
+from .exceptions import U2FInvalidDataException
+from .utils import websafe_decode, websafe_encode
+
+from . import _typing as typ  # isort:skip
+
+TOKEN_VERSION = 1
+# The version, key ID, the time the token was issued and the nonce.
+_HEADER = struct.Struct(">BBQ16s")
+_FIELD_LENGTH = struct.Struct(">I")
+_MAC_LENGTH = 16
+TOKEN_LENGTH = _HEADER.size + _MAC_LENGTH
+
+
+class ReplayGuard(abc.ABC):
+    @abc.abstractmethod
+    def first_use(self, nonce: bytes, expires: float) -> bool:
+        """
+        Record the use of the nonce; returning whether it is the first use.
+
+        The nonce need only be remembered until ``expires``, a ``time.time``.
+        """
+        ...
+
+
+class MemoryReplayGuard(ReplayGuard):
+    """
+    An in-process replay guard.
+
+    Once ``maxsize`` nonces are remembered, the oldest are forgotten; so a
+    token could then be replayed.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = CHALLENGE_REPLAY_GUARD_SIZE,
+        clock: typ.Callable[[], float] = time.time,
+    ) -> None:
+        self.maxsize = maxsize
+        self.clock = clock
+        self._lock = threading.Lock()
+        # Nonce -> expiry; in the order they were used.
+        self._used = OrderedDict()  # type: typ.Dict[bytes, float]
+
+    def __len__(self) -> int:
+        return len(self._used)
+
+    def first_use(self, nonce: bytes, expires: float) -> bool:
+        now = self.clock()
+        with self._lock:
+            used = self._used
+            # Nonces are used in roughly the order they expire in; so this
+            #  drops most of the expired ones.
+            while used:
+                oldest, oldest_expires = next(iter(used.items()))
+                if oldest_expires > now:
+                    break
+                del used[oldest]
+            if nonce in used:
+                return False
+            used[nonce] = expires
+            while len(used) > self.maxsize:
+                used.popitem(last=False)  # type: ignore
+        return True
+
+
+class ChallengeTokens:
+    """
+    Issue and check challenge tokens.
+
+    ``keys`` maps each key ID to its secret; ``current_key_id`` is the key
+    new tokens are signed with, by default the highest ID. Tokens are valid
+    for ``ttl`` seconds; without a ``replay_guard`` they can be used as often
+    as they are presented in that time, so a captured response can be
+    replayed until its token expires.
+    """
+
+    def __init__(
+        self,
+        keys: typ.Mapping[int, bytes],
+        current_key_id: typ.Optional[int] = None,
+        *,
+        ttl: float = CHALLENGE_TTL,
+        replay_guard: typ.Optional[ReplayGuard] = None,
+        clock: typ.Callable[[], float] = time.time
+    ) -> None:
+        if not keys:
+            raise ValueError("At least one key is needed.")
+        for key_id, secret in keys.items():
+            if not 0 <= key_id <= 0xFF:
+                raise ValueError("Key IDs must be from 0 to 255.")
+            if len(secret) < 16:
+                raise ValueError("Keys must be at least 16 bytes.")
+        if current_key_id is None:
+            current_key_id = max(keys)
+        if current_key_id not in keys:
+            raise ValueError("The current key is not one of the keys.")
+        self.keys = dict(keys)
+        self.current_key_id = current_key_id
+        self.ttl = ttl
+        self.replay_guard = replay_guard
+        self.clock = clock
+
+    def _mac(
+        self, secret: bytes, header: bytes, app_id: str, purpose: str, binding: str
+    ) -> bytes:
+        mac = hmac.new(secret, header, "sha256")
+        # Each field is length-prefixed; so no two sets of fields are alike.
+        for field in (app_id, purpose, binding):
+            encoded = field.encode("utf-8")
+            mac.update(_FIELD_LENGTH.pack(len(encoded)))
+            mac.update(encoded)
+        return mac.digest()[:_MAC_LENGTH]
+
+    def issue(self, app_id: str, purpose: str, binding: str = "") -> str:
+        """
+        A new token for the app ID, step and user.
+
+        ``purpose`` keeps the tokens of one step from being used for
+        another; the managers use their session keys. ``binding`` is anything
+        that identifies the user, such as their ID.
+        """
+        header = _HEADER.pack(
+            TOKEN_VERSION, self.current_key_id, int(self.clock()), os.urandom(16)
+        )
+        secret = self.keys[self.current_key_id]
+        return websafe_encode(
+            header + self._mac(secret, header, app_id, purpose, binding)
+        )
+
+    def verify(self, token: str, app_id: str, purpose: str, binding: str = "") -> None:
+        """
+        Check the token was issued, by ``issue``, for the same arguments.
+
+        Raises ``U2FInvalidDataException`` if it wasn't; or it has expired,
+        or (with a replay guard) has been used before.
+        """
+        try:
+            data = websafe_decode(token)
+        except (TypeError, ValueError) as e:
+            raise U2FInvalidDataException("Challenge token is invalid") from e
+        if len(data) != TOKEN_LENGTH:
+            raise U2FInvalidDataException("Challenge token is invalid")
+        header, mac = data[: _HEADER.size], data[_HEADER.size :]
+        version, key_id, issued, nonce = _HEADER.unpack(header)
+        secret = self.keys.get(key_id)
+        if version != TOKEN_VERSION or secret is None:
+            raise U2FInvalidDataException("Challenge token is invalid")
+        expected = self._mac(secret, header, app_id, purpose, binding)
+        if not hmac.compare_digest(mac, expected):
+            raise U2FInvalidDataException("Challenge token is invalid")
+        now = self.clock()
+        expires = issued + self.ttl
+        if expires <= now or issued > now + CHALLENGE_TOKEN_CLOCK_SKEW:
+            raise U2FInvalidDataException("Challenge token has expired")
+        if self.replay_guard is not None:
+            if not self.replay_guard.first_use(nonce, expires):
+                raise U2FInvalidDataException("Challenge token was already used")
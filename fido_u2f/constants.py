@@ -2,12 +2,88 @@ from cryptography import x509
 
 U2F_V2 = "U2F_V2"
 U2F_TRANSPORT_EXTENSION_OID = x509.ObjectIdentifier("1.3.6.1.4.1.45724.2.1.1")
+# The fields of a response that must be strings, when given.
+RESPONSE_STRING_FIELDS = (
+    "version",
+    "keyHandle",
+    "registrationData",
+    "signatureData",
+    "clientData",
+)
 
 
 PUB_KEY_DER_PREFIX = bytes.fromhex(
     "3059301306072a8648ce3d020106082a8648ce3d030107034200"
 )
 
+# The number of loaded device public keys to keep in memory.
+PUBLIC_KEY_CACHE_SIZE = 4096
+# The number of devices whose ``registeredKeys`` entry is kept in memory.
+CLIENT_DICT_CACHE_SIZE = 4096
+# The number of users whose rendered ``registeredKeys`` are kept in memory.
+KEY_LIST_CACHE_SIZE = 10000
+# The number of compiled app IDs to keep in memory.
+APP_CONTEXT_CACHE_SIZE = 1024
+# The number of attestation certificate verdicts to keep in memory.
+ATTESTATION_CACHE_SIZE = 1024
+# The number of seconds an issued challenge can be used for, when stored in a
+#  challenge store.
+CHALLENGE_TTL = 300
+# The maximum number of challenges held by an in-memory challenge store.
+CHALLENGE_STORE_SIZE = 100000
+CHALLENGE_STORE_SHARDS = 16
+# The number of seconds a challenge token may claim to be issued in the future;
+#  allowing for the clocks of the processes sharing its keys to differ.
+CHALLENGE_TOKEN_CLOCK_SKEW = 30
+# The maximum number of used challenge tokens remembered by an in-memory
+#  replay guard.
+CHALLENGE_REPLAY_GUARD_SIZE = 100000
+# Flush batched counter updates once this many devices have new counters...
+COUNTER_FLUSH_SIZE = 500
+# ...or this many seconds have passed.
+COUNTER_FLUSH_INTERVAL = 1.0
+# The number of devices whose last seen counter is kept in memory.
+COUNTER_CACHE_SIZE = 100000
+# The maximum number of intermediates between an attestation certificate and
+#  a trusted root.
+ATTESTATION_MAX_CHAIN_LENGTH = 8
+# The number of devices given to a sink at a time, when importing devices.
+BULK_BATCH_SIZE = 1000
+# The upper bounds, in seconds, of the metrics' latency histogram buckets.
+METRICS_LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+# The maximum number of distinct failure reasons counted per stage; any more
+#  are counted as "other".
+METRICS_MAX_REASONS = 64
+# The number of archived responses sent to a worker at a time, when
+#  re-verifying an archive.
+REVERIFY_CHUNK_SIZE = 200
+# The verification server: the largest job it accepts, in bytes; and the jobs
+#  each connection may have in flight.
+VERIFY_SERVER_MAX_FRAME = 64 * 1024
+VERIFY_SERVER_MAX_PENDING = 64
+# The number of seconds a verification client waits for a verdict.
+VERIFY_CLIENT_TIMEOUT = 5.0
+# The Flask extension's device listings; the default and largest page sizes.
+FLASK_DEVICES_PER_PAGE = 20
+FLASK_MAX_DEVICES_PER_PAGE = 100
+# The number of seconds browsers may cache the Flask extension's script for
+#  before checking its ETag.
+FLASK_ASSET_MAX_AGE = 3600
+
 
 INVALID_YUBICO_CERT_SHASUMS = [
     bytes.fromhex("349bca1031f8c82c4ceca38b9cebf1a69df9fb3b94eed99eb3fb9aa3822d26e8"),
@@ -0,0 +1,280 @@
+"""
+Batched, write-behind storage of device counters.
+
+A ``WriteBehindCounterSink`` takes over from
+``U2FSigningManager.update_device_registration_counter``. It rejects any
+counter that hasn't increased since the last one it saw for the device,
+coalesces the accepted counters per key handle and periodically writes them
+to a ``CounterStore`` in a single batch.
+"""
+import abc
+import logging
+import sqlite3
+import threading
+import time
+
+from .cache import LRUCache
+from .constants import COUNTER_CACHE_SIZE, COUNTER_FLUSH_INTERVAL, COUNTER_FLUSH_SIZE
+from .device import DeviceRegistration
+from .exceptions import U2FInvalidDataException
+from .utils import websafe_encode
+
+from . import _typing as typ  # isort:skip
+
+logger = logging.getLogger(__name__)
+
+# Devices are identified by their app ID and key handle.
+DeviceKey = typ.Tuple[str, bytes]
+
+
+def device_key(device: DeviceRegistration) -> DeviceKey:
+    return (device.app_id, bytes(device.key_handle))
+
+
+def check_counter_increased(device: DeviceRegistration, counter: int) -> None:
+    """Raise if ``counter`` is not greater than the device's stored counter."""
+    if device.counter is not None and counter <= device.counter:
+        raise U2FInvalidDataException("Device counter did not increase")
+
+
+class CounterStore(abc.ABC):
+    @abc.abstractmethod
+    def compare_and_set(
+        self, counters: typ.Mapping[DeviceKey, int]
+    ) -> typ.Collection[DeviceKey]:
+        """
+        Store each new counter if it is greater than the stored one.
+
+        Each update must be atomic with respect to other workers sharing the
+        store. Returns the keys whose counters were not updated.
+        """
+        ...
+
+    @abc.abstractmethod
+    def get(self, app_id: str, key_handle: bytes) -> typ.Optional[int]:
+        """The device's stored counter; or ``None`` if it has none."""
+        ...
+
+
+def log_conflicts(rejected: typ.Collection[DeviceKey]) -> None:
+    """
+    Log the devices whose counters the store rejected.
+
+    Another worker had already stored a later counter for each of them; the
+    device may have been cloned, or its response replayed.
+    """
+    for app_id, key_handle in rejected:
+        logger.error(
+            "Counter conflict for key handle %s of %s; the device may be cloned",
+            websafe_encode(key_handle),
+            app_id,
+        )
+
+
+class MemoryCounterStore(CounterStore):
+    def __init__(self) -> None:
+        self.counters = {}  # type: typ.Dict[DeviceKey, int]
+        self._lock = threading.Lock()
+
+    def compare_and_set(
+        self, counters: typ.Mapping[DeviceKey, int]
+    ) -> typ.Collection[DeviceKey]:
+        rejected = []
+        with self._lock:
+            for key, counter in counters.items():
+                if self.counters.get(key, -1) < counter:
+                    self.counters[key] = counter
+                else:
+                    rejected.append(key)
+        return rejected
+
+    def get(self, app_id: str, key_handle: bytes) -> typ.Optional[int]:
+        with self._lock:
+            return self.counters.get((app_id, bytes(key_handle)))
+
+
+class SQLiteCounterStore(CounterStore):
+    """
+    Counters in an SQLite database; safe to share between worker processes.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS u2f_counters ("
+                " app_id TEXT NOT NULL,"
+                " key_handle BLOB NOT NULL,"
+                " counter INTEGER NOT NULL,"
+                " PRIMARY KEY (app_id, key_handle)"
+                ")"
+            )
+
+    def compare_and_set(
+        self, counters: typ.Mapping[DeviceKey, int]
+    ) -> typ.Collection[DeviceKey]:
+        rejected = []
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany(
+                "INSERT OR IGNORE INTO u2f_counters (app_id, key_handle, counter)"
+                " VALUES (?, ?, -1)",
+                list(counters),
+            )
+            for (app_id, key_handle), counter in counters.items():
+                cursor = connection.execute(
+                    "UPDATE u2f_counters SET counter = ?"
+                    " WHERE app_id = ? AND key_handle = ? AND counter < ?",
+                    (counter, app_id, key_handle, counter),
+                )
+                if cursor.rowcount != 1:
+                    rejected.append((app_id, key_handle))
+        return rejected
+
+    def get(self, app_id: str, key_handle: bytes) -> typ.Optional[int]:
+        row = (
+            self._connection()
+            .execute(
+                "SELECT counter FROM u2f_counters WHERE app_id = ? AND key_handle = ?",
+                (app_id, bytes(key_handle)),
+            )
+            .fetchone()
+        )
+        return None if row is None else row[0]
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+
+class WriteBehindCounterSink:
+    """
+    Coalesce counter updates and write them to ``store`` in batches.
+
+    Pending counters are flushed once ``max_batch`` devices have updates, or
+    when ``max_delay`` seconds have passed since the last flush; checked on
+    each update, or by a background thread once ``start`` is called.
+
+    Counters are checked in-process against the highest counter seen for the
+    device, and its stored counter; a device that hasn't been seen since the
+    sink was created, or that has been evicted from the cache, is looked up
+    in the store. The store's compare-and-set then guards against other
+    workers. Devices the store rejects are passed to ``on_conflict``; by
+    default, ``log_conflicts``.
+
+    A flush that fails is logged, and its counters are kept for the next one;
+    the update that triggered it still succeeds.
+    """
+
+    def __init__(
+        self,
+        store: CounterStore,
+        *,
+        max_batch: int = COUNTER_FLUSH_SIZE,
+        max_delay: float = COUNTER_FLUSH_INTERVAL,
+        cache_size: int = COUNTER_CACHE_SIZE,
+        on_conflict: typ.Optional[
+            typ.Callable[[typ.Collection[DeviceKey]], None]
+        ] = log_conflicts,
+        clock: typ.Callable[[], float] = time.monotonic
+    ) -> None:
+        self.store = store
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.on_conflict = on_conflict
+        self.clock = clock
+        self.flushes = 0
+        self._last_seen = LRUCache(cache_size)
+        self._pending = {}  # type: typ.Dict[DeviceKey, int]
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._next_flush = clock() + max_delay
+        self._stopped = threading.Event()
+        self._thread = None  # type: typ.Optional[threading.Thread]
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def record(self, device: DeviceRegistration, counter: int) -> None:
+        """
+        Queue the device's new counter.
+
+        Raises ``U2FInvalidDataException`` if the counter has not increased.
+        """
+        key = device_key(device)
+        with self._lock:
+            last_seen = self._last_seen.get(key)
+        if last_seen is None:
+            # The device's own counter may be stale; other workers only
+            #  update the store.
+            last_seen = self.store.get(*key)
+        with self._lock:
+            check_counter_increased(device, counter)
+            # Another thread may have recorded a counter in the meantime.
+            last_seen = self._last_seen.get(key, last_seen)
+            if last_seen is not None and counter <= last_seen:
+                raise U2FInvalidDataException("Device counter did not increase")
+            self._last_seen.put(key, counter)
+            self._pending[key] = counter
+            flush = (
+                len(self._pending) >= self.max_batch
+                or self.clock() >= self._next_flush
+            )
+        if flush:
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing device counters failed")
+
+    def flush(self) -> None:
+        """
+        Write every pending counter to the store.
+
+        If the store raises, the counters are kept for the next flush.
+        """
+        # Only one flush at a time; so batches reach the store in order.
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._next_flush = self.clock() + self.max_delay
+            if not pending:
+                return
+            try:
+                rejected = self.store.compare_and_set(pending)
+            except Exception:
+                with self._lock:
+                    for key, counter in pending.items():
+                        self._pending[key] = max(counter, self._pending.get(key, 0))
+                raise
+            self.flushes += 1
+        if rejected and self.on_conflict is not None:
+            self.on_conflict(rejected)
+
+    def start(self) -> None:
+        """Flush every ``max_delay`` seconds on a background thread."""
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="u2f-counter-sink", daemon=True
+            )
+            self._thread.start()
+
+    def close(self) -> None:
+        """Stop the background thread and flush any pending counters."""
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.max_delay):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing device counters failed")
@@ -1,8 +1,21 @@
+import abc
+import mmap
+import struct
+
+from .cache import LRUCache
+from .constants import CLIENT_DICT_CACHE_SIZE
+from .enums import U2FTransport, U2FTransports
+from .exceptions import U2FInvalidDataException
 from .utils import abstract_attribute, websafe_encode
 
+from . import _typing as typ  # isort:skip
+
 
 class DeviceRegistration:
 
+    # Allow subclasses to use ``__slots__``.
+    __slots__ = ()
+
     version = abstract_attribute()  # type: str
     app_id = abstract_attribute()  # type: str
     key_handle = abstract_attribute()  # type: bytes
@@ -13,24 +26,265 @@ class DeviceRegistration:
     u2f_transports = abstract_attribute()
 
 
-def device_as_client_dict(device: DeviceRegistration) -> typ.Dict[str, typ.Any]:
-    transports = device.u2f_transports
-    if transports is not None:
-        out_transports = sorted(
-            [t.internal_name for t in transports]
-        )  # type: typ.Optional[typ.Collection[str]]
+class DeviceRecord(DeviceRegistration):
+    """
+    A compact, concrete ``DeviceRegistration``.
+
+    The transports are stored as an integer bitmask (``-1`` when unknown).
+    ``to_bytes`` and ``from_bytes`` convert the record to and from a fixed
+    header followed by the variable length fields::
+
+        B  format (1)
+        h  transports bitmask; -1 when unknown
+        I  counter
+        B  length of version
+        H  length of app_id
+        B  length of key_handle
+        B  length of public_key
+        .. version (ASCII), app_id (UTF-8), key_handle, public_key
+    """
+
+    __slots__ = (
+        "version",
+        "app_id",
+        "key_handle",
+        "public_key",
+        "counter",
+        "transports",
+    )
+
+    FORMAT = 1
+    HEADER = struct.Struct(">BhIBHBB")
+
+    def __init__(
+        self,
+        version: str,
+        app_id: str,
+        key_handle: bytes,
+        public_key: bytes,
+        counter: int = 0,
+        transports: int = -1,
+    ) -> None:
+        self.version = version
+        self.app_id = app_id
+        self.key_handle = key_handle
+        self.public_key = public_key
+        self.counter = counter
+        self.transports = transports
+
+    @classmethod
+    def from_device(cls, device: DeviceRegistration) -> "DeviceRecord":
+        return cls(
+            device.version,
+            device.app_id,
+            bytes(device.key_handle),
+            bytes(device.public_key),
+            device.counter or 0,
+            U2FTransport._to_internal_int(device.u2f_transports),
+        )
+
+    @property  # type: ignore
+    def u2f_transports(self) -> U2FTransports:  # type: ignore
+        return U2FTransport._from_internal_int(self.transports)
+
+    @u2f_transports.setter
+    def u2f_transports(self, transports: U2FTransports) -> None:
+        self.transports = U2FTransport._to_internal_int(transports)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, DeviceRecord):
+            return NotImplemented
+        return self._astuple() == other._astuple()
+
+    def __hash__(self) -> int:
+        return hash(self._astuple())
+
+    def __repr__(self) -> str:
+        return "DeviceRecord({!r}, {!r}, {!r}, {!r}, {!r}, {!r})".format(
+            *self._astuple()
+        )
+
+    def _astuple(self) -> typ.Tuple[str, str, bytes, bytes, int, int]:
+        return (
+            self.version,
+            self.app_id,
+            self.key_handle,
+            self.public_key,
+            self.counter,
+            self.transports,
+        )
+
+    def to_bytes(self) -> bytes:
+        version = self.version.encode("ascii")
+        app_id = self.app_id.encode("utf-8")
+        return b"".join(
+            (
+                self.HEADER.pack(
+                    self.FORMAT,
+                    self.transports,
+                    self.counter,
+                    len(version),
+                    len(app_id),
+                    len(self.key_handle),
+                    len(self.public_key),
+                ),
+                version,
+                app_id,
+                self.key_handle,
+                self.public_key,
+            )
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "DeviceRecord":
+        record, end = cls.unpack_from(data)
+        if end != len(data):
+            raise U2FInvalidDataException("Device record has trailing data")
+        return record
+
+    @classmethod
+    def unpack_from(
+        cls, buffer: typ.Union[bytes, memoryview, mmap.mmap], offset: int = 0
+    ) -> typ.Tuple["DeviceRecord", int]:
+        """
+        Read a record from ``buffer`` at ``offset``.
+
+        Returns the record and the offset of the first byte after it.
+        """
+        try:
+            (
+                fmt,
+                transports,
+                counter,
+                version_len,
+                app_id_len,
+                key_handle_len,
+                public_key_len,
+            ) = cls.HEADER.unpack_from(buffer, offset)
+        except struct.error as e:
+            raise U2FInvalidDataException("Device record is truncated") from e
+        if fmt != cls.FORMAT:
+            raise U2FInvalidDataException("Unsupported device record format")
+        start = offset + cls.HEADER.size
+        app_id_start = start + version_len
+        key_handle_start = app_id_start + app_id_len
+        public_key_start = key_handle_start + key_handle_len
+        end = public_key_start + public_key_len
+        if end > len(buffer):
+            raise U2FInvalidDataException("Device record is truncated")
+        record = cls(
+            str(buffer[start:app_id_start], "ascii"),
+            str(buffer[app_id_start:key_handle_start], "utf-8"),
+            bytes(buffer[key_handle_start:public_key_start]),
+            bytes(buffer[public_key_start:end]),
+            counter,
+            transports,
+        )
+        return record, end
+
+
+#: The client dicts of recently seen devices; keyed by the fields they are
+#: built from. Use ``client_dict_cache.resize(0)`` to disable caching.
+client_dict_cache = LRUCache(CLIENT_DICT_CACHE_SIZE)
+
+
+def device_as_client_dict(
+    device: DeviceRegistration, *, cache: bool = True
+) -> typ.Dict[str, typ.Any]:
+    """
+    The device as given to the client in ``registeredKeys``.
+
+    Each call returns a new dict, with a new ``transports`` list. Pass
+    ``cache=False`` when going through many devices once; so they don't
+    evict the devices that are seen often.
+    """
+    if isinstance(device, DeviceRecord):
+        transports = device.transports
     else:
-        out_transports = None
+        transports = U2FTransport._to_internal_int(device.u2f_transports)
+    if cache:
+        key = (device.version, device.app_id, bytes(device.key_handle), transports)
+        data = client_dict_cache.get(key)
+        if data is None:
+            data = _client_dict(device, transports)
+            client_dict_cache.put(key, data)
+    else:
+        data = _client_dict(device, transports)
+    data = dict(data)
+    if data["transports"] is not None:
+        data["transports"] = list(data["transports"])
+    return data
+
+
+def _client_dict(device: DeviceRegistration, transports: int) -> typ.Dict[str, typ.Any]:
+    # The transports are a tuple; so the cached dicts can't be modified.
     return {
         "version": device.version,
         "appId": device.app_id,
         # keyHandle must be base64 encoded
         "keyHandle": websafe_encode(device.key_handle),
-        "transports": out_transports,
+        "transports": (
+            None if transports < 0 else U2FTransport.names_from_byte(transports)
+        ),
     }
 
 
 def filter_devices_by_app_id(
     registered_devices: typ.Collection[DeviceRegistration], app_id: str
-) -> typ.Iterable[DeviceRegistration]:
-    return (device for device in registered_devices if device.app_id == app_id)
+) -> typ.Sequence[DeviceRegistration]:
+    if isinstance(registered_devices, DeviceSource):
+        return registered_devices.devices_for_app_id(app_id)
+    return [device for device in registered_devices if device.app_id == app_id]
+
+
+class DeviceSource(abc.ABC):
+    """
+    Devices that can be looked up by app ID and key handle.
+
+    The managers accept a ``DeviceSource`` anywhere they take a collection
+    of devices; and use it to find the device that signed a response.
+    """
+
+    @abc.abstractmethod
+    def devices_for_app_id(self, app_id: str) -> typ.Sequence[DeviceRegistration]:
+        ...
+
+    @abc.abstractmethod
+    def get_device(
+        self, app_id: str, key_handle: bytes
+    ) -> typ.Optional[DeviceRegistration]:
+        ...
+
+
+class DeviceIndex(DeviceSource):
+    """
+    A materialized collection of devices; indexed by app ID and key handle.
+
+    Build it once for a user's devices and pass it anywhere the managers
+    accept a collection of devices; key handle lookups are then constant time.
+    """
+
+    def __init__(self, devices: typ.Iterable[DeviceRegistration] = ()) -> None:
+        self._devices = tuple(devices)
+        self._by_app_id = {}  # type: typ.Dict[str, typ.List[DeviceRegistration]]
+        self._by_key = {}  # type: typ.Dict[typ.Tuple[str, bytes], DeviceRegistration]
+        for device in self._devices:
+            self._by_app_id.setdefault(device.app_id, []).append(device)
+            self._by_key[(device.app_id, bytes(device.key_handle))] = device
+
+    def __len__(self) -> int:
+        return len(self._devices)
+
+    def __iter__(self) -> typ.Iterator[DeviceRegistration]:
+        return iter(self._devices)
+
+    def __contains__(self, device: object) -> bool:
+        return device in self._devices
+
+    def devices_for_app_id(self, app_id: str) -> typ.Sequence[DeviceRegistration]:
+        return self._by_app_id.get(app_id, ())
+
+    def get_device(
+        self, app_id: str, key_handle: bytes
+    ) -> typ.Optional[DeviceRegistration]:
+        return self._by_key.get((app_id, bytes(key_handle)))
@@ -1,5 +1,9 @@
+import mmap
+import struct
+
 from . import _typing as typ
-from .enums import U2FTransport
+from .cache import LRUCache
+from .enums import U2FTransport, U2FTransports
 
 class DeviceRegistration:
 
@@ -10,5 +14,52 @@ class DeviceRegistration:
     counter: int = ...
 
     # U2FTransports
-    u2f_transports: U2FTransport = ...
-    def device_as_client_dict(self) -> typ.Dict[str, typ.Any]: ...
+    u2f_transports: typ.Optional[typ.Collection[U2FTransport]] = ...
+
+class DeviceRecord(DeviceRegistration):
+    transports: int = ...
+    FORMAT: int = ...
+    HEADER: struct.Struct = ...
+    def __init__(
+        self,
+        version: str,
+        app_id: str,
+        key_handle: bytes,
+        public_key: bytes,
+        counter: int = 0,
+        transports: int = -1,
+    ) -> None: ...
+    @classmethod
+    def from_device(cls, device: DeviceRegistration) -> "DeviceRecord": ...
+    def to_bytes(self) -> bytes: ...
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "DeviceRecord": ...
+    @classmethod
+    def unpack_from(
+        cls, buffer: typ.Union[bytes, memoryview, mmap.mmap], offset: int = 0
+    ) -> typ.Tuple["DeviceRecord", int]: ...
+
+client_dict_cache: LRUCache = ...
+
+def device_as_client_dict(
+    device: DeviceRegistration, *, cache: bool = ...
+) -> typ.Dict[str, typ.Any]: ...
+def filter_devices_by_app_id(
+    registered_devices: typ.Collection[DeviceRegistration], app_id: str
+) -> typ.Sequence[DeviceRegistration]: ...
+
+class DeviceSource:
+    def devices_for_app_id(self, app_id: str) -> typ.Sequence[DeviceRegistration]: ...
+    def get_device(
+        self, app_id: str, key_handle: bytes
+    ) -> typ.Optional[DeviceRegistration]: ...
+
+class DeviceIndex(DeviceSource):
+    def __init__(self, devices: typ.Iterable[DeviceRegistration] = ()) -> None: ...
+    def __len__(self) -> int: ...
+    def __iter__(self) -> typ.Iterator[DeviceRegistration]: ...
+    def __contains__(self, device: object) -> bool: ...
+    def devices_for_app_id(self, app_id: str) -> typ.Sequence[DeviceRegistration]: ...
+    def get_device(
+        self, app_id: str, key_handle: bytes
+    ) -> typ.Optional[DeviceRegistration]: ...
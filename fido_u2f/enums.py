@@ -11,21 +11,31 @@ class U2FTransport(Enum):
     NFC = (0x10, "nfc")
     USB_INTERNAL = (0x08, "usb-internal")
 
-    # def __init__(self, value: int, internal_name: str) -> None:
-    #     self.value = value
-    #     self.internal_name = internal_name
+    def __init__(self, flag: int, internal_name: str) -> None:
+        # ``value`` can't be assigned; so the flag is kept alongside it.
+        self._flag = flag
+        self.internal_name = internal_name
 
     @property
     def value(self):
-        return super().value[0]
-
-    @property
-    def internal_name(self):
-        return super().value[1]
+        return self._flag
 
     @staticmethod
     def from_byte(byte: int) -> typ.Collection["U2FTransport"]:
-        return [t for t in U2FTransport if t.value & byte]
+        """A new list of the transports whose flags are set in ``byte``."""
+        return list(_TRANSPORTS_BY_BYTE[byte & 0xFF])
+
+    @staticmethod
+    def set_from_byte(byte: int) -> typ.FrozenSet["U2FTransport"]:
+        """
+        As ``from_byte``; but a shared, precomputed set rather than a new list.
+        """
+        return _TRANSPORT_SETS_BY_BYTE[byte & 0xFF]
+
+    @staticmethod
+    def names_from_byte(byte: int) -> typ.Tuple[str, ...]:
+        """The sorted ``internal_name`` of each transport set in ``byte``."""
+        return _TRANSPORT_NAMES_BY_BYTE[byte & 0xFF]
 
     @staticmethod
     def to_byte(transports: typ.Collection["U2FTransport"]) -> int:
@@ -55,6 +65,18 @@ class U2FTransport(Enum):
 
 U2FTransports = typ.Optional[typ.Collection[U2FTransport]]
 
+# Every possible transports byte; precomputed as there are only 256 of them.
+_TRANSPORTS_BY_BYTE = tuple(
+    tuple(t for t in U2FTransport if t.value & byte) for byte in range(256)
+)
+_TRANSPORT_SETS_BY_BYTE = tuple(
+    frozenset(transports) for transports in _TRANSPORTS_BY_BYTE
+)
+_TRANSPORT_NAMES_BY_BYTE = tuple(
+    tuple(sorted(t.internal_name for t in transports))
+    for transports in _TRANSPORTS_BY_BYTE
+)
+
 
 @unique
 class RequestType(Enum):
@@ -14,3 +14,12 @@ class U2FInvalidDataException(U2FException):
     """
 
     pass
+
+
+class U2FVerifierException(U2FException):
+    """
+    Raised when a response couldn't be verified by the verification server;
+    it may be unreachable, or have failed.
+    """
+
+    pass
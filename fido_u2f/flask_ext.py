@@ -0,0 +1,360 @@
+"""
+A Flask extension for the registration and signing flows.
+
+Give it a ``U2FDeviceStore``, which knows who the current user is and where
+their devices are kept::
+
+    u2f = FlaskU2F(app, store=MyDeviceStore(), app_id="https://example.com")
+
+It serves, under ``url_prefix``:
+
+``GET register`` and ``GET sign``
+    A registration or signing request, as JSON.
+``POST register`` and ``POST sign``
+    Verify the client's response, posted as JSON.
+``GET devices?page=1&per_page=20``
+    The user's devices; a page at a time.
+``GET u2f.js``
+    The client side; see ``fidoU2F`` in ``fido_u2f/static/u2f.js``. It is
+    read once and served from memory, with an ETag.
+
+Requests are rendered from the user's cached ``RenderedKeyList``; so their
+devices are only loaded when the list changes, and when verifying a signing
+response. The cache is per process; so a list is only cached when the store's
+``devices_version`` says which version of the user's devices it is. Errors
+are JSON too: ``{"error": "..."}``.
+"""
+import abc
+import json
+import os
+
+from flask import Blueprint, Flask, Response, abort, request, session
+from werkzeug.http import quote_etag
+
+from .constants import (
+    FLASK_ASSET_MAX_AGE,
+    FLASK_DEVICES_PER_PAGE,
+    FLASK_MAX_DEVICES_PER_PAGE,
+)
+from .device import DeviceRegistration, device_as_client_dict
+from .exceptions import U2FException
+from .key_list import KeyListCache, RenderedKeyList
+from .registration import U2FRegistrationManager
+from .utils import sha_256, websafe_encode
+from .verification import U2FSigningManager
+
+from . import _typing as typ  # isort:skip
+
+_JSON_SEPARATORS = (",", ":")
+SCRIPT_PATH = os.path.join(os.path.dirname(__file__), "static", "u2f.js")
+
+
+class U2FDeviceStore(abc.ABC):
+    """
+    Where the extension finds the current user, and keeps their devices.
+
+    Users are identified by any hashable ID; such as their primary key.
+    """
+
+    @abc.abstractmethod
+    def current_user(self) -> typ.Optional[typ.Hashable]:
+        """The ID of the request's user; ``None`` if nobody is logged in."""
+        ...
+
+    @abc.abstractmethod
+    def load_devices(self, user_id: typ.Hashable) -> typ.Collection[DeviceRegistration]:
+        """All of the user's devices; in as few queries as possible."""
+        ...
+
+    def devices_version(self, user_id: typ.Hashable) -> typ.Hashable:
+        """
+        Something that changes whenever a device is added to or removed from
+        the user's devices; such as their number and highest ID, from one
+        cheap query. The rendered devices are cached for this version.
+
+        By default ``None``; they aren't cached, as another process may have
+        changed them. A store only used by a single process may return a
+        constant; each process only invalidates its own cache.
+        """
+        return None
+
+    def signing_devices(
+        self, user_id: typ.Hashable
+    ) -> typ.Collection[DeviceRegistration]:
+        """
+        The devices a signing response is checked against; with their current
+        counters. By default ``load_devices``; return a ``DeviceSource``, such
+        as ``SQLAlchemyDeviceRepository.for_user``, to only load the device
+        that signed it.
+        """
+        return self.load_devices(user_id)
+
+    @abc.abstractmethod
+    def page_devices(
+        self, user_id: typ.Hashable, offset: int, limit: int
+    ) -> typ.Tuple[int, typ.Sequence[DeviceRegistration]]:
+        """
+        The number of devices the user has; and at most ``limit`` of them,
+        skipping the first ``offset``.
+        """
+        ...
+
+    @abc.abstractmethod
+    def add_device(
+        self,
+        user_id: typ.Hashable,
+        *,
+        version: str,
+        app_id: str,
+        key_handle: bytes,
+        public_key: bytes,
+        transports: typ.Any
+    ) -> DeviceRegistration:
+        """Save a newly registered device; as ``create_device_registration_model``."""
+        ...
+
+    @abc.abstractmethod
+    def update_counter(
+        self, device: DeviceRegistration, counter: int
+    ) -> DeviceRegistration:
+        """Save the device's new counter."""
+        ...
+
+    def device_verified(
+        self, user_id: typ.Hashable, device: DeviceRegistration
+    ) -> None:
+        """
+        Called once the user has signed with a device. Override it to note,
+        in the session, that they have.
+        """
+        pass
+
+
+class FlaskU2FManager(U2FRegistrationManager, U2FSigningManager):
+    """Both managers; keeping the devices in a ``U2FDeviceStore``."""
+
+    def __init__(
+        self,
+        app_id: str,
+        *,
+        store: U2FDeviceStore,
+        counter_sink: typ.Any = None,
+        **options: typ.Any
+    ) -> None:
+        """
+        The ``options`` are those of ``U2FRegistrationManager``; and
+        ``counter_sink``, as ``U2FSigningManager``.
+        """
+        super().__init__(app_id, **options)
+        self.store = store
+        self.counter_sink = counter_sink
+
+    def create_device_registration_model(self, **kwargs) -> DeviceRegistration:
+        return self.store.add_device(self.store.current_user(), **kwargs)
+
+    def update_device_registration_counter(
+        self, *, device: DeviceRegistration, counter: int
+    ) -> DeviceRegistration:
+        return self.store.update_counter(device, counter)
+
+
+class StaticAsset:
+    """
+    A file served from memory.
+
+    Browsers cache it for ``max_age`` seconds; then revalidate it by its ETag,
+    which is answered with an empty 304 response.
+    """
+
+    __slots__ = ("data", "mimetype", "etag", "max_age", "_headers")
+
+    def __init__(
+        self, data: bytes, mimetype: str, max_age: int = FLASK_ASSET_MAX_AGE
+    ) -> None:
+        self.data = data
+        self.mimetype = mimetype
+        self.etag = sha_256(data)[:16].hex()
+        self.max_age = max_age
+        self._headers = [
+            ("ETag", quote_etag(self.etag)),
+            ("Cache-Control", "public, max-age={}".format(max_age)),
+        ]
+
+    @classmethod
+    def from_path(cls, path: str, mimetype: str, **kwargs: typ.Any) -> "StaticAsset":
+        with open(path, "rb") as f:
+            return cls(f.read(), mimetype, **kwargs)
+
+    def response(self) -> Response:
+        if request.if_none_match.contains(self.etag):
+            return Response(status=304, headers=self._headers)
+        return Response(self.data, mimetype=self.mimetype, headers=self._headers)
+
+
+def _json_response(body: str, status: int = 200) -> Response:
+    return Response(body, status, mimetype="application/json")
+
+
+def _error(status: int, message: str) -> Response:
+    return _json_response(json.dumps({"error": message}), status)
+
+
+def _dumps(data: typ.Any) -> str:
+    return json.dumps(data, separators=_JSON_SEPARATORS)
+
+
+class FlaskU2F:
+    """
+    The extension; see the module's documentation.
+
+    ``key_lists`` holds the users' rendered devices, for the store's
+    ``devices_version``; by default a ``KeyListCache`` of its own. The other
+    ``manager_options`` are given to the ``manager_class``.
+    """
+
+    manager_class = FlaskU2FManager
+    DEVICES_PER_PAGE = FLASK_DEVICES_PER_PAGE
+    MAX_DEVICES_PER_PAGE = FLASK_MAX_DEVICES_PER_PAGE
+
+    manager = None  # type: typ.Optional[FlaskU2FManager]
+
+    def __init__(
+        self,
+        app: typ.Optional[Flask] = None,
+        *,
+        store: U2FDeviceStore,
+        app_id: typ.Optional[str] = None,
+        url_prefix: str = "/u2f",
+        key_lists: typ.Optional[KeyListCache] = None,
+        **manager_options: typ.Any
+    ) -> None:
+        self.store = store
+        self.app_id = app_id
+        self.url_prefix = url_prefix
+        self.key_lists = KeyListCache() if key_lists is None else key_lists
+        self.manager_options = manager_options
+        self.script = StaticAsset.from_path(SCRIPT_PATH, "application/javascript")
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Register the extension's blueprint. Without an ``app_id``, the app's
+        ``U2F_APP_ID`` setting is used.
+        """
+        app_id = self.app_id or app.config["U2F_APP_ID"]
+        self.manager = self.manager_class(
+            app_id, store=self.store, **self.manager_options
+        )
+        app.register_blueprint(self.create_blueprint(), url_prefix=self.url_prefix)
+        app.extensions["fido_u2f"] = self
+
+    def create_blueprint(self) -> Blueprint:
+        blueprint = Blueprint("fido_u2f", __name__)
+        for rule, endpoint, view, method in [
+            ("/register", "registration_request", self.registration_request, "GET"),
+            ("/register", "register", self.register, "POST"),
+            ("/sign", "signing_request", self.signing_request, "GET"),
+            ("/sign", "sign", self.sign, "POST"),
+            ("/devices", "devices", self.devices, "GET"),
+            ("/u2f.js", "script", self.script.response, "GET"),
+        ]:
+            blueprint.add_url_rule(rule, endpoint, view, methods=[method])
+        return blueprint
+
+    def current_user(self) -> typ.Hashable:
+        """The current user's ID; aborting with a 401 if nobody is logged in."""
+        user_id = self.store.current_user()
+        if user_id is None:
+            abort(_error(401, "Not logged in."))
+        return user_id
+
+    def key_list(self, user_id: typ.Hashable) -> RenderedKeyList:
+        """
+        The user's rendered devices; only loading them if they aren't cached
+        for the store's ``devices_version``.
+        """
+        assert self.manager is not None
+        app_id = self.manager.app_id
+        version = self.store.devices_version(user_id)
+        if version is None:
+            return RenderedKeyList(app_id, self.store.load_devices(user_id))
+        return self.key_lists.get(
+            user_id, app_id, lambda: self.store.load_devices(user_id), version
+        )
+
+    def registration_request(self) -> Response:
+        assert self.manager is not None
+        key_list = self.key_list(self.current_user())
+        response = _json_response(
+            self.manager.create_registration_challenge_json(session, key_list)
+        )
+        response.cache_control.no_store = True
+        return response
+
+    def register(self) -> Response:
+        assert self.manager is not None
+        user_id = self.current_user()
+        try:
+            device = self.manager.process_registration_body(session, request.get_data())
+        except U2FException as e:
+            return _error(400, str(e))
+        self.key_lists.invalidate(user_id, self.manager.app_id)
+        return _json_response(_dumps(device_as_client_dict(device)), 201)
+
+    def signing_request(self) -> Response:
+        assert self.manager is not None
+        key_list = self.key_list(self.current_user())
+        if not key_list:
+            return _error(404, "No devices are registered.")
+        response = _json_response(
+            self.manager.create_signing_challenge_json(session, key_list)
+        )
+        response.cache_control.no_store = True
+        return response
+
+    def sign(self) -> Response:
+        assert self.manager is not None
+        user_id = self.current_user()
+        # The counters must be current; so the devices are always loaded.
+        devices = self.store.signing_devices(user_id)
+        try:
+            device = self.manager.process_signing_body(
+                session, request.get_data(), devices
+            )
+        except U2FException as e:
+            return _error(400, str(e))
+        self.store.device_verified(user_id, device)
+        return _json_response(
+            _dumps(
+                {
+                    "keyHandle": websafe_encode(device.key_handle),
+                    "counter": device.counter,
+                }
+            )
+        )
+
+    def devices(self) -> Response:
+        user_id = self.current_user()
+        per_page = request.args.get("per_page", self.DEVICES_PER_PAGE, type=int)
+        per_page = min(max(per_page, 1), self.MAX_DEVICES_PER_PAGE)
+        page = max(request.args.get("page", 1, type=int), 1)
+        total, devices = self.store.page_devices(
+            user_id, (page - 1) * per_page, per_page
+        )
+        listed = []
+        for device in devices:
+            entry = device_as_client_dict(device)
+            entry["counter"] = device.counter
+            listed.append(entry)
+        response = _json_response(
+            _dumps(
+                {"devices": listed, "page": page, "perPage": per_page, "total": total}
+            )
+        )
+        # Unchanged pages are revalidated by their ETag.
+        response.add_etag()
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.make_conditional(request)
+        return response
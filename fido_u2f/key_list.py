@@ -0,0 +1,128 @@
+"""
+Pre-rendered ``registeredKeys`` for issuing challenges.
+
+Each challenge request for a user differs from the last only by its random
+challenge. A ``RenderedKeyList`` renders the user's keys to JSON once; the
+managers' ``create_registration_challenge_json`` and
+``create_signing_challenge_json`` then splice each new challenge into it::
+
+    key_list = key_lists.get(user.id, manager.app_id, lambda: user.devices)
+    body = manager.create_signing_challenge_json(session, key_list)
+
+A ``KeyListCache`` holds the rendered lists. ``invalidate`` a user's list
+when one of their devices is added or removed; or pass a ``version`` that
+changes when they do. New counters don't change the list.
+"""
+import json
+
+from .cache import LRUCache
+from .constants import KEY_LIST_CACHE_SIZE, U2F_V2
+from .device import DeviceRegistration, device_as_client_dict, filter_devices_by_app_id
+from .utils import sha_256
+
+from . import _typing as typ  # isort:skip
+
+_JSON_SEPARATORS = (",", ":")
+
+
+class RenderedKeyList:
+    """
+    A user's devices for one app ID; rendered as the JSON ``registeredKeys``.
+
+    ``etag`` identifies the rendered keys; it only changes when they do.
+    ``version`` is whatever the list was rendered for; see ``KeyListCache``.
+    """
+
+    __slots__ = ("app_id", "json", "etag", "version", "_size", "_app_id_json")
+
+    def __init__(
+        self,
+        app_id: str,
+        devices: typ.Collection[DeviceRegistration],
+        version: typ.Hashable = None,
+    ) -> None:
+        keys = [
+            device_as_client_dict(device, cache=False)
+            for device in filter_devices_by_app_id(devices, app_id)
+        ]
+        self.app_id = app_id
+        self.json = json.dumps(keys, separators=_JSON_SEPARATORS)
+        self.etag = sha_256(self.json.encode("utf-8"))[:16].hex()
+        self.version = version
+        self._size = len(keys)
+        self._app_id_json = json.dumps(app_id)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __repr__(self) -> str:
+        return "<RenderedKeyList {!r}: {} keys, etag {}>".format(
+            self.app_id, self._size, self.etag
+        )
+
+    # The challenges are websafe base64; so they are spliced in unescaped.
+
+    def registration_request(self, challenge: str) -> str:
+        """The JSON of ``create_registration_challenge`` for the challenge."""
+        return "".join(
+            (
+                '{"appId":',
+                self._app_id_json,
+                ',"registerRequests":[{"version":"',
+                U2F_V2,
+                '","challenge":"',
+                challenge,
+                '"}],"registeredKeys":',
+                self.json,
+                "}",
+            )
+        )
+
+    def signing_request(self, challenge: str) -> str:
+        """The JSON of ``create_signing_challenge`` for the challenge."""
+        return "".join(
+            (
+                '{"appId":',
+                self._app_id_json,
+                ',"challenge":"',
+                challenge,
+                '","registeredKeys":',
+                self.json,
+                "}",
+            )
+        )
+
+
+class KeyListCache:
+    """
+    The rendered key lists of recently seen users; keyed by user and app ID.
+
+    The owner can be any hashable that identifies the user.
+    """
+
+    def __init__(self, maxsize: int = KEY_LIST_CACHE_SIZE) -> None:
+        self.lists = LRUCache(maxsize)
+
+    def get(
+        self,
+        owner: typ.Hashable,
+        app_id: str,
+        load_devices: typ.Callable[[], typ.Collection[DeviceRegistration]],
+        version: typ.Hashable = None,
+    ) -> RenderedKeyList:
+        """
+        Return the owner's rendered keys.
+
+        ``load_devices`` is only called when there is no cached list, or its
+        ``version`` differs from the one given.
+        """
+        key = (owner, app_id)
+        key_list = self.lists.get(key)
+        if key_list is None or key_list.version != version:
+            key_list = RenderedKeyList(app_id, load_devices(), version)
+            self.lists.put(key, key_list)
+        return key_list
+
+    def invalidate(self, owner: typ.Hashable, app_id: str) -> None:
+        """Forget the owner's rendered keys; after adding or removing a device."""
+        self.lists.pop((owner, app_id))
@@ -0,0 +1,168 @@
+import abc
+
+from .app_context import AppContext, compile_app_context
+from .challenge_store import ChallengeStore
+from .challenge_tokens import ChallengeTokens
+from .device import DeviceRegistration, filter_devices_by_app_id
+from .exceptions import U2FStateException
+from .key_list import RenderedKeyList
+from .tracing import (
+    CHALLENGE_ISSUED,
+    CHALLENGE_MISSING,
+    CHALLENGE_STORE,
+    CLIENT_DATA,
+    Tracer,
+    span,
+)
+from .utils import ClientData, get_random_challenge, websafe_encode
+
+from . import _typing as typ  # isort:skip
+
+
+class U2FManagerBase(abc.ABC):
+    """The functionality shared by the registration and signing managers."""
+
+    # With challenge tokens, the session key holding whatever identifies the
+    #  user; the tokens are bound to it, and can't be issued without it.
+    CHALLENGE_BINDING_KEY = "u2f_challenge_binding"
+
+    app_context = None  # type: typ.Optional[AppContext]
+    challenge_store = None  # type: typ.Optional[ChallengeStore]
+    challenge_tokens = None  # type: typ.Optional[ChallengeTokens]
+    tracer = None  # type: typ.Optional[Tracer]
+
+    def __init__(
+        self,
+        app_id: typ.Union[str, AppContext],
+        *,
+        challenge_store: typ.Optional[ChallengeStore] = None,
+        challenge_tokens: typ.Optional[ChallengeTokens] = None,
+        tracer: typ.Optional[Tracer] = None
+    ) -> None:
+        self.app_context = compile_app_context(app_id)
+        self.app_id = self.app_context.app_id
+        self.challenge_store = challenge_store
+        self.challenge_tokens = challenge_tokens
+        self.tracer = tracer
+
+    def get_app_context(self) -> AppContext:
+        """
+        Return the context for ``self.app_id``.
+
+        Subclasses that only set ``app_id`` get the shared context for it.
+        """
+        app_context = self.app_context
+        if app_context is None or app_context.app_id != self.app_id:
+            app_context = self.app_context = compile_app_context(self.app_id)
+        return app_context
+
+    def filter_devices_by_app_id(
+        self, registered_devices: typ.Collection[DeviceRegistration]
+    ) -> typ.Sequence[DeviceRegistration]:
+        return filter_devices_by_app_id(registered_devices, self.app_id)
+
+    def check_key_list(self, key_list: RenderedKeyList) -> None:
+        if key_list.app_id != self.app_id:
+            raise ValueError("The key list is for another app ID.")
+
+    def issue_challenge(
+        self, session: typ.MutableMapping[str, typ.Any], key: str
+    ) -> str:
+        """
+        Create a challenge and save it for the session.
+
+        With challenge tokens nothing is saved; the challenge is a token bound
+        to the app ID, ``key`` and ``get_challenge_binding``.
+        """
+        if self.challenge_tokens is None:
+            challenge = websafe_encode(get_random_challenge())
+            self.store_challenge(session, key, challenge)
+            return challenge
+        challenge = self.challenge_tokens.issue(
+            self.app_id, key, self.get_challenge_binding(session)
+        )
+        if self.tracer is not None:
+            self.tracer.event(CHALLENGE_ISSUED, session_key=key)
+        return challenge
+
+    def get_challenge_binding(self, session: typ.Mapping[str, typ.Any]) -> str:
+        """
+        The user a challenge token is bound to; ``CHALLENGE_BINDING_KEY`` in
+        the session.
+
+        Raises ``U2FStateException`` if the session has none; a token bound
+        to no one would answer for any user's response.
+        """
+        binding = session.get(self.CHALLENGE_BINDING_KEY)
+        if binding is None or binding == "":
+            raise U2FStateException("No challenge binding in the session")
+        return str(binding)
+
+    def decode_response_client_data(
+        self, response_dict: typ.Mapping[str, typ.Any]
+    ) -> typ.Optional[ClientData]:
+        """
+        With challenge tokens, decode the response's client data; its token is
+        needed before the response can be verified, so it is decoded up front
+        and passed on. Otherwise ``None``; it is decoded when it is checked.
+        """
+        if self.challenge_tokens is None:
+            return None
+        with span(self.tracer, CLIENT_DATA):
+            return ClientData(response_dict.get("clientData", ""))
+
+    def take_response_challenge(
+        self,
+        session: typ.MutableMapping[str, typ.Any],
+        key: str,
+        response_dict: typ.Mapping[str, typ.Any],
+        client_data: typ.Optional[ClientData] = None,
+    ) -> typ.Optional[str]:
+        """
+        Return the challenge the response should answer; it can't be reused.
+
+        With challenge tokens, this is the token in the response's client
+        data; once it has been verified. ``client_data`` is the response's
+        client data, if it has already been decoded.
+        """
+        if self.challenge_tokens is None:
+            return self.take_challenge(session, key)
+        with span(self.tracer, CHALLENGE_STORE):
+            if client_data is None:
+                client_data = ClientData(response_dict.get("clientData", ""))
+            token = client_data.challenge
+            if isinstance(token, str) and token:
+                self.challenge_tokens.verify(
+                    token, self.app_id, key, self.get_challenge_binding(session)
+                )
+                return token
+        if self.tracer is not None:
+            self.tracer.event(CHALLENGE_MISSING, session_key=key)
+        return None
+
+    def store_challenge(
+        self, session: typ.MutableMapping[str, typ.Any], key: str, challenge: str
+    ) -> None:
+        """
+        Save the challenge for the session.
+
+        With a challenge store the session only holds the store's ticket.
+        """
+        if self.challenge_store is not None:
+            with span(self.tracer, CHALLENGE_STORE):
+                challenge = self.challenge_store.put(challenge)
+        session[key] = challenge
+        if self.tracer is not None:
+            self.tracer.event(CHALLENGE_ISSUED, session_key=key)
+
+    def take_challenge(
+        self, session: typ.MutableMapping[str, typ.Any], key: str
+    ) -> typ.Optional[str]:
+        """Remove and return the session's challenge; if it has one."""
+        challenge = session.pop(key, None)
+        if challenge and self.challenge_store is not None:
+            with span(self.tracer, CHALLENGE_STORE):
+                challenge = self.challenge_store.pop(challenge)
+        if not challenge and self.tracer is not None:
+            self.tracer.event(CHALLENGE_MISSING, session_key=key)
+        return challenge
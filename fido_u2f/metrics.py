@@ -0,0 +1,363 @@
+"""
+Counters and latency histograms for the registration and signing managers.
+
+A ``MetricsTracer`` turns the managers' trace spans (see ``fido_u2f.tracing``)
+into metrics::
+
+    metrics = MetricsRegistry()
+    manager = MyManager(app_id, tracer=MetricsTracer(metrics))
+    print(metrics.exposition())
+
+It records:
+
+``u2f_stage_seconds{stage}``
+    A histogram of the latency of each stage; including the ``registration``
+    and ``signing`` spans around each response as a whole.
+``u2f_stage_failures_total{stage,reason}``
+    The number of times each stage failed, by the reason it failed.
+``u2f_events_total{event}``
+    The number of each event the managers reported.
+
+Each thread records into its own shard of the registry, so recording takes no
+lock; the shards are only combined when a snapshot is taken. A thread's shard
+is folded into the registry's totals once the thread has finished.
+"""
+import bisect
+import http.server
+import re
+import threading
+import time
+import weakref
+
+from .constants import METRICS_LATENCY_BUCKETS, METRICS_MAX_REASONS
+from .exceptions import U2FException
+from .tracing import Tracer
+
+from . import _typing as typ  # isort:skip
+
+STAGE_SECONDS = "u2f_stage_seconds"
+STAGE_FAILURES = "u2f_stage_failures_total"
+EVENTS = "u2f_events_total"
+OTHER_REASON = "other"
+
+Labels = typ.Tuple[typ.Tuple[str, str], ...]
+MetricKey = typ.Tuple[str, Labels]
+
+_NOT_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def failure_reason(exception: BaseException) -> str:
+    """
+    Categorise an exception for the failure counters.
+
+    The managers' exceptions are categorised by their message, as
+    ``lower_snake_case``; anything else by the exception's type.
+    """
+    if isinstance(exception, U2FException) and exception.args:
+        reason = _NOT_WORD.sub("_", str(exception.args[0]).lower()).strip("_")
+        if reason:
+            return reason
+    return type(exception).__name__
+
+
+class HistogramSnapshot:
+    """
+    A histogram's value.
+
+    ``counts[i]`` is the number of observations in ``buckets[i - 1]`` to
+    ``buckets[i]``; the last count is of those above the last bucket.
+    """
+
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(
+        self, buckets: typ.Sequence[float], counts: typ.List[int], total: float
+    ) -> None:
+        self.buckets = buckets
+        self.counts = counts
+        self.sum = total
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def cumulative_counts(self) -> typ.List[int]:
+        total = 0
+        cumulative = []
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+    def merge(self, counts: typ.Sequence[int], total: float) -> None:
+        for i, count in enumerate(counts):
+            self.counts[i] += count
+        self.sum += total
+
+
+class MetricsSnapshot:
+    """The combined value of every metric in a registry, at one moment."""
+
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self) -> None:
+        self.counters = {}  # type: typ.Dict[MetricKey, int]
+        self.histograms = {}  # type: typ.Dict[MetricKey, HistogramSnapshot]
+
+    def counter(self, name: str, **labels: str) -> int:
+        return self.counters.get((name, _labels(labels)), 0)
+
+    def histogram(self, name: str, **labels: str) -> typ.Optional[HistogramSnapshot]:
+        return self.histograms.get((name, _labels(labels)))
+
+    def exposition(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, keys in _by_name(self.counters):
+            lines.append("# TYPE {} counter".format(name))
+            for key in keys:
+                lines.append(
+                    "{}{} {}".format(name, _format_labels(key[1]), self.counters[key])
+                )
+        for name, keys in _by_name(self.histograms):
+            lines.append("# TYPE {} histogram".format(name))
+            for key in keys:
+                histogram = self.histograms[key]
+                bounds = [repr(float(bucket)) for bucket in histogram.buckets]
+                for bound, count in zip(
+                    bounds + ["+Inf"], histogram.cumulative_counts()
+                ):
+                    labels = key[1] + (("le", bound),)
+                    lines.append(
+                        "{}_bucket{} {}".format(name, _format_labels(labels), count)
+                    )
+                labels_text = _format_labels(key[1])
+                lines.append("{}_sum{} {!r}".format(name, labels_text, histogram.sum))
+                lines.append("{}_count{} {}".format(name, labels_text, histogram.count))
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: typ.Mapping[str, str]) -> Labels:
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    pairs = ('{}="{}"'.format(name, _escape(value)) for name, value in labels)
+    return "{" + ",".join(pairs) + "}"
+
+
+def _by_name(
+    metrics: typ.Mapping[MetricKey, typ.Any]
+) -> typ.List[typ.Tuple[str, typ.List[MetricKey]]]:
+    names = {}  # type: typ.Dict[str, typ.List[MetricKey]]
+    for key in metrics:
+        names.setdefault(key[0], []).append(key)
+    return [(name, sorted(names[name])) for name in sorted(names)]
+
+
+class _Shard:
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self) -> None:
+        self.counters = {}  # type: typ.Dict[MetricKey, int]
+        # Each histogram is its bucket counts followed by the sum.
+        self.histograms = {}  # type: typ.Dict[MetricKey, typ.List[typ.Any]]
+
+    def merge(self, other: "_Shard") -> None:
+        counters = self.counters
+        for key, value in dict(other.counters).items():
+            counters[key] = counters.get(key, 0) + value
+        histograms = self.histograms
+        for key, histogram in dict(other.histograms).items():
+            merged = histograms.get(key)
+            if merged is None:
+                histograms[key] = list(histogram)
+            else:
+                for i, value in enumerate(histogram):
+                    merged[i] += value
+
+
+class _ShardOwner:
+    """
+    Held only by a thread's ``threading.local``; so it is collected when the
+    thread finishes.
+    """
+
+    __slots__ = ("shard", "__weakref__")
+
+    def __init__(self, shard: _Shard) -> None:
+        self.shard = shard
+
+
+def _retire_shard(
+    registry_ref: "weakref.ReferenceType[MetricsRegistry]", shard: _Shard
+) -> None:
+    registry = registry_ref()
+    if registry is not None:
+        registry._retire(shard)
+
+
+class MetricsRegistry:
+    """
+    Counters and fixed-bucket histograms, each identified by a name and labels.
+
+    ``buckets`` are the upper bounds of the histograms' buckets.
+    """
+
+    def __init__(self, buckets: typ.Sequence[float] = METRICS_LATENCY_BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []  # type: typ.List[_Shard]
+        # The totals of the shards of finished threads.
+        self._retired = _Shard()
+
+    def _shard(self) -> _Shard:
+        try:
+            return self._local.owner.shard
+        except AttributeError:
+            shard = _Shard()
+            owner = self._local.owner = _ShardOwner(shard)
+            weakref.finalize(owner, _retire_shard, weakref.ref(self), shard)
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def _retire(self, shard: _Shard) -> None:
+        with self._lock:
+            self._shards.remove(shard)
+            self._retired.merge(shard)
+
+    def increment(self, name: str, labels: Labels = (), value: int = 1) -> None:
+        counters = self._shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: Labels = ()) -> None:
+        histograms = self._shard().histograms
+        key = (name, labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect.bisect_left(self.buckets, value)] += 1
+        histogram[-1] += value
+
+    def snapshot(self) -> MetricsSnapshot:
+        with self._lock:
+            retired = _Shard()
+            retired.merge(self._retired)
+            shards = [retired] + self._shards
+        snapshot = MetricsSnapshot()
+        for shard in shards:
+            # Copying a dict or list can't be interrupted by another thread.
+            for key, value in dict(shard.counters).items():
+                snapshot.counters[key] = snapshot.counters.get(key, 0) + value
+            for key, histogram in dict(shard.histograms).items():
+                histogram = list(histogram)
+                merged = snapshot.histograms.get(key)
+                if merged is None:
+                    merged = snapshot.histograms[key] = HistogramSnapshot(
+                        self.buckets, [0] * (len(self.buckets) + 1), 0.0
+                    )
+                merged.merge(histogram[:-1], histogram[-1])
+        return snapshot
+
+    def exposition(self) -> str:
+        return self.snapshot().exposition()
+
+
+class _MeasuredSpan:
+    __slots__ = ("tracer", "stage", "labels", "start")
+
+    def __init__(self, tracer: "MetricsTracer", stage: str, labels: Labels) -> None:
+        self.tracer = tracer
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self) -> None:
+        self.start = self.tracer.clock()
+
+    def __exit__(
+        self, exc_type: typ.Any, exc_value: typ.Any, traceback: typ.Any
+    ) -> None:
+        tracer = self.tracer
+        tracer.registry.observe(STAGE_SECONDS, tracer.clock() - self.start, self.labels)
+        if exc_value is not None:
+            tracer.record_failure(self.stage, exc_value)
+
+
+class MetricsTracer(Tracer):
+    """
+    Record the managers' spans and events in a ``MetricsRegistry``.
+
+    At most ``max_reasons`` distinct failure reasons are counted for each
+    stage; any others are counted as ``"other"``.
+    """
+
+    def __init__(
+        self,
+        registry: typ.Optional[MetricsRegistry] = None,
+        max_reasons: int = METRICS_MAX_REASONS,
+        clock: typ.Callable[[], float] = time.perf_counter,
+    ) -> None:
+        self.registry = registry if registry is not None else MetricsRegistry()
+        self.max_reasons = max_reasons
+        self.clock = clock
+        self._stage_labels = {}  # type: typ.Dict[str, Labels]
+        self._reasons = {}  # type: typ.Dict[str, typ.Set[str]]
+        self._reasons_lock = threading.Lock()
+
+    def span(self, name: str) -> typ.ContextManager[None]:
+        labels = self._stage_labels.get(name)
+        if labels is None:
+            labels = self._stage_labels[name] = (("stage", name),)
+        return _MeasuredSpan(self, name, labels)
+
+    def event(self, name: str, **attributes: typ.Any) -> None:
+        self.registry.increment(EVENTS, (("event", name),))
+
+    def record_failure(self, stage: str, exception: BaseException) -> None:
+        reason = failure_reason(exception)
+        with self._reasons_lock:
+            reasons = self._reasons.setdefault(stage, set())
+            if reason not in reasons:
+                if len(reasons) < self.max_reasons:
+                    reasons.add(reason)
+                else:
+                    reason = OTHER_REASON
+        self.registry.increment(STAGE_FAILURES, (("reason", reason), ("stage", stage)))
+
+
+def serve_metrics(
+    registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 9464
+) -> http.server.HTTPServer:
+    """
+    Serve the registry's exposition over HTTP, from a background thread.
+
+    Call ``shutdown`` on the returned server to stop it.
+    """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            body = registry.exposition().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args: typ.Any) -> None:
+            pass
+
+    server = http.server.HTTPServer((host, port), Handler)
+    thread = threading.Thread(
+        target=server.serve_forever, name="u2f-metrics", daemon=True
+    )
+    thread.start()
+    return server
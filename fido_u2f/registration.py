@@ -6,28 +6,72 @@ from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import ec
 
+from .app_context import AppContext
+from .attestation import AttestationTrustStore
+from .challenge_store import ChallengeStore
+from .challenge_tokens import ChallengeTokens
 from .constants import U2F_TRANSPORT_EXTENSION_OID, U2F_V2
-from .device import DeviceRegistration, device_as_client_dict, filter_devices_by_app_id
+from .device import DeviceRegistration, device_as_client_dict
 from .enums import RequestType, U2FTransport, U2FTransports
 from .exceptions import U2FInvalidDataException, U2FStateException
+from .key_list import RenderedKeyList
+from .manager import U2FManagerBase
+from .tracing import (
+    ATTESTATION,
+    CERTIFICATE,
+    CLIENT_DATA,
+    DECODE,
+    REGISTRATION,
+    STORE,
+    VERIFY,
+    Tracer,
+    span,
+)
 from .utils import (
+    ClientData,
     fix_invalid_yubico_certs,
-    get_random_challenge,
+    load_response_body,
     parse_tlv_encoded_length,
-    pop_bytes,
     sha_256,
-    validate_client_data,
     websafe_decode,
-    websafe_encode,
 )
 
+from . import _typing as typ  # isort:skip
+
+_UNSET = object()
 
-class U2FRegistrationManager(abc.ABC):
+
+class U2FRegistrationManager(U2FManagerBase):
 
     REGISTRATION_SESSION_KEY = "u2f_registration_challenge"
 
-    def __init__(self, app_id: str) -> None:
-        self.app_id = app_id
+    attestation_trust_store = None  # type: typ.Optional[AttestationTrustStore]
+
+    def __init__(
+        self,
+        app_id: typ.Union[str, AppContext],
+        *,
+        attestation_trust_store: typ.Optional[AttestationTrustStore] = None,
+        challenge_store: typ.Optional[ChallengeStore] = None,
+        challenge_tokens: typ.Optional[ChallengeTokens] = None,
+        tracer: typ.Optional[Tracer] = None
+    ) -> None:
+        """
+        Create a registration manager.
+
+        When ``attestation_trust_store`` is given, only devices whose
+        attestation certificate it trusts can be registered. When
+        ``challenge_store`` is given, challenges are kept there rather than
+        in the session; with ``challenge_tokens`` they aren't kept at all.
+        ``tracer`` is given a span for each stage of processing a response.
+        """
+        super().__init__(
+            app_id,
+            challenge_store=challenge_store,
+            challenge_tokens=challenge_tokens,
+            tracer=tracer,
+        )
+        self.attestation_trust_store = attestation_trust_store
 
     @abc.abstractmethod
     def create_device_registration_model(
@@ -41,11 +85,6 @@ class U2FRegistrationManager(abc.ABC):
     ) -> DeviceRegistration:
         ...
 
-    def filter_devices_by_app_id(
-        self, registered_devices: typ.Collection[DeviceRegistration]
-    ) -> typ.Iterable[DeviceRegistration]:
-        return filter_devices_by_app_id(registered_devices, self.app_id)
-
     def create_registration_challenge(
         self,
         session: typ.MutableMapping[str, typ.Any],
@@ -58,8 +97,7 @@ class U2FRegistrationManager(abc.ABC):
         object, and then return a JSON-safe object for use by the client to
         complete the challenge
         """
-        challenge = websafe_encode(get_random_challenge())
-        session[self.REGISTRATION_SESSION_KEY] = challenge
+        challenge = self.issue_challenge(session, self.REGISTRATION_SESSION_KEY)
         return {
             "appId": self.app_id,
             "registerRequests": [{"version": U2F_V2, "challenge": challenge}],
@@ -69,83 +107,243 @@ class U2FRegistrationManager(abc.ABC):
             ],
         }
 
+    def create_registration_challenge_json(
+        self, session: typ.MutableMapping[str, typ.Any], key_list: RenderedKeyList
+    ) -> str:
+        """
+        As ``create_registration_challenge``; but return the request as JSON.
+
+        ``key_list`` holds the user's pre-rendered ``registeredKeys``; only the
+        new challenge is rendered.
+        """
+        self.check_key_list(key_list)
+        challenge = self.issue_challenge(session, self.REGISTRATION_SESSION_KEY)
+        return key_list.registration_request(challenge)
+
     def process_registration_response(
         self,
         session: typ.MutableMapping[str, typ.Any],
         response_dict: typ.Mapping[str, str],
     ) -> DeviceRegistration:
+        with span(self.tracer, REGISTRATION):
+            registration_data = self.verify_registration_response(
+                session, response_dict
+            )
+            with span(self.tracer, CERTIFICATE):
+                transports = registration_data.get_supported_transports()
+            # We have now verified the registration request.
+            with span(self.tracer, STORE):
+                return self.create_device_registration_model(
+                    version=U2F_V2,
+                    app_id=self.app_id,
+                    key_handle=registration_data.key_handle,
+                    public_key=registration_data.public_key,
+                    transports=transports,
+                )
+
+    def process_registration_body(
+        self, session: typ.MutableMapping[str, typ.Any], body: typ.Union[str, bytes]
+    ) -> DeviceRegistration:
+        """
+        As ``process_registration_response``; but given the raw JSON body the
+        client posted the response in.
+        """
+        with span(self.tracer, DECODE):
+            response_dict = load_response_body(body)
+        return self.process_registration_response(session, response_dict)
+
+    def verify_registration_response(
+        self,
+        session: typ.MutableMapping[str, typ.Any],
+        response_dict: typ.Mapping[str, str],
+    ) -> "RegistrationData":
+        """Verify the response without creating the device registration."""
+        client_data = self.decode_response_client_data(response_dict)
+        challenge = self.take_registration_challenge(
+            session, response_dict, client_data
+        )
+        return self.verify_registration_data(
+            response_dict, challenge, client_data=client_data
+        )
+
+    def take_registration_challenge(
+        self,
+        session: typ.MutableMapping[str, typ.Any],
+        response_dict: typ.Mapping[str, str],
+        client_data: typ.Optional[ClientData] = None,
+    ) -> str:
+        """
+        Take the challenge the response answers, from the session; checking
+        the response's version.
+        """
         version = response_dict.get("version", "")
-        challenge = session.pop(self.REGISTRATION_SESSION_KEY, None)
+        challenge = self.take_response_challenge(
+            session, self.REGISTRATION_SESSION_KEY, response_dict, client_data
+        )
         if not challenge:
             raise U2FStateException("Session missing required key.")
         if version != U2F_V2:
             raise U2FInvalidDataException("Unsupported version given.")
-        registration_data = self.verify_registration_data(response_dict, challenge)
-        # We have now verified the registration request.
-        return self.create_device_registration_model(
-            version=version,
-            app_id=self.app_id,
-            key_handle=registration_data.key_handle,
-            public_key=registration_data.public_key,
-            transports=registration_data.get_supported_transports(),
-        )
+        return challenge
 
     def verify_registration_data(
-        self, response_dict: typ.Mapping[str, str], challenge: str
+        self,
+        response_dict: typ.Mapping[str, str],
+        challenge: str,
+        *,
+        client_data: typ.Optional[ClientData] = None
     ) -> "RegistrationData":
-        try:
-            registration_data = RegistrationData.from_base64(
-                response_dict.get("registrationData", "")
+        """
+        Verify the response's registration data; against ``challenge``.
+
+        ``client_data`` is the response's client data, if it has already been
+        decoded.
+        """
+        tracer = self.tracer
+        with span(tracer, DECODE):
+            try:
+                registration_data = RegistrationData.from_base64(
+                    response_dict.get("registrationData", "")
+                )
+            except (TypeError, ValueError, IndexError) as e:
+                raise U2FInvalidDataException("Invalid registration data.") from e
+        # Client data comes in as base64(usually?); it is decoded once, and
+        #  the challenge parameter is the hash of exactly those bytes.
+        app_context = self.get_app_context()
+        with span(tracer, CLIENT_DATA):
+            if client_data is None:
+                client_data = ClientData(response_dict.get("clientData", ""))
+            client_data.check(
+                RequestType.REGISTER,
+                app_context.app_id,
+                challenge,
+                app_context.trusted_facets,
             )
-        except (ValueError, IndexError) as e:
-            raise U2FInvalidDataException("Invalid registration data.") from e
-        # Client data comes in as base64(usually?), so we standardise it
-        #  into a decoded *string*. We then take the hash of that string
-        #  for the verification step.
-        client_data = validate_client_data(
-            response_dict.get("clientData", ""),
-            RequestType.REGISTER,
-            self.app_id,
-            challenge,
-        )
-        challenge_param = sha_256(client_data.encode("utf-8"))
-        app_param = sha_256(self.app_id.encode("idna"))
-        registration_data.verify(app_param, challenge_param)
+            challenge_param = sha_256(client_data.data)
+        app_param = app_context.app_param
+        with span(tracer, CERTIFICATE):
+            registration_data.get_attestation_public_key()
+        with span(tracer, VERIFY):
+            registration_data.verify(app_param, challenge_param)
+        if self.attestation_trust_store is not None:
+            with span(tracer, ATTESTATION):
+                self.attestation_trust_store.verify(registration_data)
         return registration_data
 
 
 class RegistrationData:
+    """
+    A parsed ``registrationData`` response.
+
+    Parsing only records the offset of each field; the fields are copied out
+    of the original buffer the first time they are accessed. The attestation
+    certificate, and everything derived from it, is also computed at most once.
+    """
+
+    __slots__ = (
+        "_data",
+        "_certificate_start",
+        "_signature_start",
+        "_public_key",
+        "_key_handle",
+        "_certificate",
+        "_signature",
+        "_fingerprint",
+        "_x509_certificate",
+        "_attestation_public_key",
+        "_transports",
+    )
+
     @classmethod
     def from_base64(cls, base64_data: typ.Union[str, bytes]) -> "RegistrationData":
         return cls(websafe_decode(base64_data))  # type: ignore
 
     def __init__(self, data: bytes) -> None:
         # https://fidoalliance.org/specs/fido-u2f-v1.2-ps-20170411/fido-u2f-raw-message-formats-v1.2-ps-20170411.pdf
-        buf = bytearray(data)
-        if buf.pop(0) != 0x05:
+        # 1 byte magic, 65 bytes public key, 1 byte key handle length,
+        #  the key handle, the DER certificate and then the signature.
+        view = memoryview(data)
+        if view[0] != 0x05:
             raise U2FInvalidDataException("Registration data has invalid magic byte")
-        self.public_key = pop_bytes(buf, 65)
-        self.key_handle = pop_bytes(buf, buf.pop(0))
-        cert_len = parse_tlv_encoded_length(buf)
-        self.certificate = fix_invalid_yubico_certs(pop_bytes(buf, cert_len))
-        self.signature = bytes(buf)
+        certificate_start = 67 + view[66]
+        signature_start = certificate_start + parse_tlv_encoded_length(
+            view, certificate_start
+        )
+        if signature_start > len(view):
+            raise U2FInvalidDataException("Registration data is truncated")
+        self._data = view
+        self._certificate_start = certificate_start
+        self._signature_start = signature_start
+        self._public_key = None  # type: typ.Optional[bytes]
+        self._key_handle = None  # type: typ.Optional[bytes]
+        self._certificate = None  # type: typ.Optional[bytes]
+        self._signature = None  # type: typ.Optional[bytes]
+        self._fingerprint = None  # type: typ.Optional[bytes]
+        self._x509_certificate = None  # type: typ.Optional[x509.Certificate]
+        self._attestation_public_key = None  # type: typ.Any
+        self._transports = _UNSET  # type: typ.Any
+
+    @property
+    def public_key(self) -> bytes:
+        if self._public_key is None:
+            self._public_key = bytes(self._data[1:66])
+        return self._public_key
+
+    @property
+    def key_handle(self) -> bytes:
+        if self._key_handle is None:
+            self._key_handle = bytes(self._data[67 : self._certificate_start])
+        return self._key_handle
+
+    @property
+    def certificate(self) -> bytes:
+        if self._certificate is None:
+            der = bytes(self._data[self._certificate_start : self._signature_start])
+            # Hash once; the digest doubles as the fingerprint unless the
+            #  certificate is one of the broken Yubico ones and is rewritten.
+            digest = sha_256(der)
+            certificate = fix_invalid_yubico_certs(der, digest)
+            if certificate is not der:
+                digest = sha_256(certificate)
+            self._certificate = certificate
+            self._fingerprint = digest
+        return self._certificate
+
+    @property
+    def fingerprint(self) -> bytes:
+        """The SHA-256 digest of the (corrected) attestation certificate."""
+        if self._fingerprint is None:
+            self.certificate
+        return self._fingerprint  # type: ignore
+
+    @property
+    def signature(self) -> bytes:
+        if self._signature is None:
+            self._signature = bytes(self._data[self._signature_start :])
+        return self._signature
 
     def get_x509_certificate(self) -> x509.Certificate:
-        return x509.load_der_x509_certificate(self.certificate, default_backend())
+        if self._x509_certificate is None:
+            self._x509_certificate = x509.load_der_x509_certificate(
+                self.certificate, default_backend()
+            )
+        return self._x509_certificate
+
+    def get_attestation_public_key(self) -> ec.EllipticCurvePublicKey:
+        if self._attestation_public_key is None:
+            self._attestation_public_key = self.get_x509_certificate().public_key()
+        return self._attestation_public_key
 
     def verify(self, app_param: bytes, chal_param: bytes) -> None:
         # https://fidoalliance.org/specs/fido-u2f-v1.2-ps-20170411/fido-u2f-raw-message-formats-v1.2-ps-20170411.pdf
-        cert = self.get_x509_certificate()
-        pubkey = cert.public_key()
+        pubkey = self.get_attestation_public_key()
         verifier = pubkey.verifier(self.signature, ec.ECDSA(hashes.SHA256()))
-
-        verifier.update(
-            b"\0"  # control byte
-            + app_param
-            + chal_param
-            + self.key_handle
-            + self.public_key
-        )
+        verifier.update(b"\0")  # control byte
+        verifier.update(app_param)
+        verifier.update(chal_param)
+        # The key handle and public key are read straight out of the response.
+        verifier.update(self._data[67 : self._certificate_start])
+        verifier.update(self._data[1:66])
         try:
             verifier.verify()
         except InvalidSignature as e:
@@ -153,6 +351,11 @@ class RegistrationData:
 
     def get_supported_transports(self,) -> U2FTransports:
         """Extract the transports this token supports from the certificate."""
+        if self._transports is _UNSET:
+            self._transports = self._parse_supported_transports()
+        return self._transports
+
+    def _parse_supported_transports(self) -> U2FTransports:
         cert = self.get_x509_certificate()
         try:
             ext = cert.extensions.get_extension_for_oid(
@@ -0,0 +1,297 @@
+"""
+A read-only, memory-mapped file of device registrations.
+
+``build_device_registry`` writes every device, along with the ID of the user
+that owns it, into a single file. ``MappedDeviceRegistry`` maps that file
+into memory and answers lookups straight from the mapping; so a verifier node
+needs neither a database connection nor a copy of every device on its heap.
+
+The file is laid out as::
+
+    header
+    records       sorted by owner; each a length-prefixed owner ID followed
+                  by a ``DeviceRecord``
+    key table     open-addressed hash table of (app ID, key handle) -> record
+    user table    open-addressed hash table of owner ID -> (first record, count)
+
+Both tables are indexed by the first 8 bytes of a SHA-256 digest, so the
+file can be shared by processes regardless of their hash seed.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+from .device import DeviceRecord, DeviceRegistration, DeviceSource
+from .exceptions import U2FInvalidDataException
+
+from . import _typing as typ  # isort:skip
+
+MAGIC = b"U2FD"
+FORMAT = 1
+# Magic, format, record count, bucket count, key table offset, user table offset
+HEADER = struct.Struct(">4sB3xIIQQ")
+OWNER_LENGTH = struct.Struct(">H")
+# Digest, record offset. An offset of 0 marks an empty bucket.
+KEY_BUCKET = struct.Struct(">QQ")
+# Digest, first record offset, record count.
+USER_BUCKET = struct.Struct(">QQI4x")
+
+
+def _digest(*parts: bytes) -> int:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(struct.pack(">I", len(part)))
+        h.update(part)
+    return int.from_bytes(h.digest()[:8], "big")
+
+
+def _key_digest(app_id: str, key_handle: bytes) -> int:
+    return _digest(app_id.encode("utf-8"), bytes(key_handle))
+
+
+def _user_digest(owner: str) -> int:
+    return _digest(owner.encode("utf-8"))
+
+
+def _bucket_count(entries: int) -> int:
+    # A power of two, at most half full.
+    count = 1
+    while count < entries * 2:
+        count <<= 1
+    return count
+
+
+def _fill_table(
+    table: bytearray,
+    bucket: struct.Struct,
+    bucket_count: int,
+    entries: typ.Iterable[typ.Tuple[int, typ.Tuple[typ.Any, ...]]],
+) -> None:
+    for digest, values in entries:
+        index = digest & (bucket_count - 1)
+        while bucket.unpack_from(table, index * bucket.size)[1] != 0:
+            index = (index + 1) & (bucket_count - 1)
+        bucket.pack_into(table, index * bucket.size, digest, *values)
+
+
+def _default_mode() -> int:
+    # The mode a new file would get; there's no way to read the umask without
+    #  setting it.
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o644 & ~umask
+
+
+def build_device_registry(
+    path: str,
+    devices: typ.Iterable[typ.Tuple[str, DeviceRegistration]],
+    *,
+    mode: typ.Optional[int] = None
+) -> int:
+    """
+    Write ``(owner_id, device)`` pairs to a registry file at ``path``.
+
+    The file is written next to ``path`` and then moved into place, so
+    readers never see a partially written registry. It is given the
+    permissions ``mode``; by default ``0o644``, less the umask, so workers
+    running as other users can read it. Returns the number of devices
+    written.
+    """
+    if mode is None:
+        mode = _default_mode()
+    records = sorted(
+        ((owner, DeviceRecord.from_device(device)) for owner, device in devices),
+        key=lambda item: (item[0], item[1].app_id, item[1].key_handle),
+    )
+    bucket_count = _bucket_count(len(records))
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".u2f-registry-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(b"\0" * HEADER.size)
+            offset = HEADER.size
+            keys = []  # type: typ.List[typ.Tuple[int, typ.Tuple[int]]]
+            users = {}  # type: typ.Dict[str, typ.List[int]]
+            for owner, record in records:
+                owner_bytes = owner.encode("utf-8")
+                data = OWNER_LENGTH.pack(len(owner_bytes)) + owner_bytes
+                data += record.to_bytes()
+                keys.append(
+                    (_key_digest(record.app_id, record.key_handle), (offset,))
+                )
+                users.setdefault(owner, [offset, 0])[1] += 1
+                f.write(data)
+                offset += len(data)
+
+            key_table_offset = offset
+            table = bytearray(KEY_BUCKET.size * bucket_count)
+            _fill_table(table, KEY_BUCKET, bucket_count, keys)
+            f.write(table)
+
+            user_table_offset = key_table_offset + len(table)
+            table = bytearray(USER_BUCKET.size * bucket_count)
+            _fill_table(
+                table,
+                USER_BUCKET,
+                bucket_count,
+                ((_user_digest(owner), tuple(span)) for owner, span in users.items()),
+            )
+            f.write(table)
+
+            f.seek(0)
+            f.write(
+                HEADER.pack(
+                    MAGIC,
+                    FORMAT,
+                    len(records),
+                    bucket_count,
+                    key_table_offset,
+                    user_table_offset,
+                )
+            )
+        # mkstemp creates the file readable only by its owner.
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return len(records)
+
+
+class _Snapshot:
+    """One mapped registry file."""
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            fmt,
+            self.record_count,
+            self.bucket_count,
+            self.key_table_offset,
+            self.user_table_offset,
+        ) = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or fmt != FORMAT:
+            self.map.close()
+            raise U2FInvalidDataException("Not a device registry file")
+
+    def read_record(self, offset: int) -> typ.Tuple[str, DeviceRecord, int]:
+        (owner_length,) = OWNER_LENGTH.unpack_from(self.map, offset)
+        start = offset + OWNER_LENGTH.size
+        owner = str(self.map[start : start + owner_length], "utf-8")
+        record, end = DeviceRecord.unpack_from(self.map, start + owner_length)
+        return owner, record, end
+
+    def _probe(
+        self, table_offset: int, bucket: struct.Struct, digest: int
+    ) -> typ.Iterator[typ.Tuple[typ.Any, ...]]:
+        mask = self.bucket_count - 1
+        index = digest & mask
+        while True:
+            values = bucket.unpack_from(self.map, table_offset + index * bucket.size)
+            if values[1] == 0:
+                return
+            if values[0] == digest:
+                yield values[1:]
+            index = (index + 1) & mask
+
+    def find_device(
+        self, app_id: str, key_handle: bytes
+    ) -> typ.Optional[typ.Tuple[str, DeviceRecord]]:
+        digest = _key_digest(app_id, key_handle)
+        for (offset,) in self._probe(self.key_table_offset, KEY_BUCKET, digest):
+            owner, record, _ = self.read_record(offset)
+            if record.app_id == app_id and record.key_handle == key_handle:
+                return owner, record
+        return None
+
+    def find_user_devices(self, owner: str) -> typ.List[DeviceRecord]:
+        digest = _user_digest(owner)
+        for offset, count in self._probe(self.user_table_offset, USER_BUCKET, digest):
+            devices = []
+            for _ in range(count):
+                record_owner, record, offset = self.read_record(offset)
+                if record_owner != owner:
+                    break
+                devices.append(record)
+            else:
+                return devices
+        return []
+
+
+class MappedDeviceRegistry:
+    """
+    A registry file, mapped into memory.
+
+    ``reload`` atomically switches to a new snapshot of the file; lookups
+    already in progress finish against the old one.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._snapshot = _Snapshot(path)
+
+    def __len__(self) -> int:
+        return self._snapshot.record_count
+
+    def reload(self, path: typ.Optional[str] = None) -> None:
+        """Map the file at ``path``, or the current path, in place of this one."""
+        with self._lock:
+            if path is not None:
+                self.path = path
+            # The old map is closed once the last lookup using it is done.
+            self._snapshot = _Snapshot(self.path)
+
+    def get_device(
+        self, app_id: str, key_handle: bytes
+    ) -> typ.Optional[typ.Tuple[str, DeviceRecord]]:
+        """Return the owner and record of the device; if it exists."""
+        return self._snapshot.find_device(app_id, bytes(key_handle))
+
+    def devices_for_user(self, owner: str) -> typ.List[DeviceRecord]:
+        return self._snapshot.find_user_devices(owner)
+
+    def for_user(self, owner: str) -> "UserDevices":
+        """
+        Return a device source for the user's devices.
+
+        This is what should be given to the managers; it will not return
+        another user's device.
+        """
+        return UserDevices(self, owner)
+
+
+class UserDevices(DeviceSource):
+    """One user's devices in a ``MappedDeviceRegistry``."""
+
+    def __init__(self, registry: MappedDeviceRegistry, owner: str) -> None:
+        self.registry = registry
+        self.owner = owner
+        self._devices = None  # type: typ.Optional[typ.List[DeviceRecord]]
+
+    def _all_devices(self) -> typ.List[DeviceRecord]:
+        if self._devices is None:
+            self._devices = self.registry.devices_for_user(self.owner)
+        return self._devices
+
+    def __len__(self) -> int:
+        return len(self._all_devices())
+
+    def __iter__(self) -> typ.Iterator[DeviceRecord]:
+        return iter(self._all_devices())
+
+    def devices_for_app_id(self, app_id: str) -> typ.Sequence[DeviceRegistration]:
+        return [device for device in self._all_devices() if device.app_id == app_id]
+
+    def get_device(
+        self, app_id: str, key_handle: bytes
+    ) -> typ.Optional[DeviceRegistration]:
+        found = self.registry.get_device(app_id, key_handle)
+        if found is None or found[0] != self.owner:
+            return None
+        return found[1]
@@ -0,0 +1,271 @@
+"""
+Re-verify archived registration and signing responses, offline.
+
+An archive is a JSON lines file with one response per line::
+
+    {"type": "register", "appId": "...", "challenge": "...", "response": {...}}
+    {"type": "sign", "appId": "...", "challenge": "...", "response": {...},
+     "publicKey": "...", "counter": 41}
+
+``response`` is the response as given to the managers; ``challenge`` is the
+challenge that was issued for it. Signing records also need the device's
+``publicKey`` (base64url); when they have the device's last seen ``counter``,
+the response's counter must be greater. Any record may have ``trustedFacets``
+and an ``id``, which is copied into its verdict.
+
+Each record gets a verdict, in the order of the archive::
+
+    {"line": 1, "valid": true, "type": "register", "keyHandle": "...",
+     "transports": ["usb"]}
+    {"line": 2, "valid": false, "type": "sign", "reason": "...", "error": "..."}
+
+The responses are checked exactly as the managers check them; but without a
+session, or storing anything. ``reverify`` spreads the work over an executor,
+a chunk of lines at a time. Run it with ``python -m fido_u2f reverify``.
+"""
+import collections
+import json
+import os
+from concurrent.futures import Executor
+
+from .app_context import AppContext, compile_app_context
+from .attestation import AttestationTrustStore
+from .constants import REVERIFY_CHUNK_SIZE, U2F_V2
+from .counters import check_counter_increased
+from .device import DeviceRecord
+from .enums import U2FTransport
+from .exceptions import U2FException, U2FInvalidDataException
+from .metrics import failure_reason
+from .registration import U2FRegistrationManager
+from .utils import websafe_decode, websafe_encode
+from .verification import U2FSigningManager
+
+from . import _typing as typ  # isort:skip
+
+REGISTER = "register"
+SIGN = "sign"
+
+Verdict = typ.Dict[str, typ.Any]
+
+# The trust stores loaded by this process; keyed by their directory.
+_trust_stores = {}  # type: typ.Dict[str, AttestationTrustStore]
+
+
+class _ArchiveVerifier(U2FRegistrationManager, U2FSigningManager):
+    """
+    A manager that only verifies responses; ``verify_record`` only calls its
+    ``verify_*_data`` methods. It can't store anything.
+    """
+
+    def create_device_registration_model(self, **kwargs: typ.Any) -> typ.Any:
+        raise U2FException("Archive verification does not store devices")
+
+    def update_device_registration_counter(self, **kwargs: typ.Any) -> typ.Any:
+        raise U2FException("Archive verification does not store device counters")
+
+
+def load_trust_store(
+    directory: typ.Optional[str],
+) -> typ.Optional[AttestationTrustStore]:
+    """The trust store of the CAs in ``directory``; loaded once per process."""
+    if directory is None:
+        return None
+    store = _trust_stores.get(directory)
+    if store is None:
+        store = _trust_stores[directory] = AttestationTrustStore.from_directory(
+            directory
+        )
+    return store
+
+
+def _verifier(
+    record: typ.Mapping[str, typ.Any],
+    attestation_trust_store: typ.Optional[AttestationTrustStore],
+) -> _ArchiveVerifier:
+    app_id = record.get("appId")
+    if not isinstance(app_id, str) or not app_id:
+        raise U2FInvalidDataException("Record has no app ID")
+    if record.get("trustedFacets"):
+        app_context = AppContext(app_id, _field(record, "trustedFacets", list))
+    else:
+        app_context = compile_app_context(app_id)
+    return _ArchiveVerifier(
+        app_context, attestation_trust_store=attestation_trust_store
+    )
+
+
+def _field(record: typ.Mapping[str, typ.Any], name: str, kind: type) -> typ.Any:
+    value = record.get(name)
+    if not isinstance(value, kind):
+        raise U2FInvalidDataException("Record has no valid {}".format(name))
+    return value
+
+
+def verify_record(
+    record: typ.Mapping[str, typ.Any],
+    attestation_trust_store: typ.Optional[AttestationTrustStore] = None,
+) -> Verdict:
+    """
+    Verify one archived response; raising if it is invalid.
+
+    Returns the verdict's details for a valid response.
+    """
+    record_type = record.get("type")
+    if record_type not in (REGISTER, SIGN):
+        raise U2FInvalidDataException("Record has an unknown type")
+    verifier = _verifier(record, attestation_trust_store)
+    challenge = _field(record, "challenge", str)
+    response = _field(record, "response", dict)
+    if record_type == REGISTER:
+        if response.get("version", "") != U2F_V2:
+            raise U2FInvalidDataException("Unsupported version given.")
+        registration_data = verifier.verify_registration_data(response, challenge)
+        transports = registration_data.get_supported_transports()
+        return {
+            "keyHandle": websafe_encode(registration_data.key_handle),
+            "transports": None
+            if transports is None
+            else list(U2FTransport.names_from_byte(U2FTransport.to_byte(transports))),
+        }
+    try:
+        key_handle = websafe_decode(response.get("keyHandle", ""))
+        public_key = websafe_decode(_field(record, "publicKey", str))
+    except (TypeError, ValueError) as e:
+        raise U2FInvalidDataException("Record has invalid base64 data") from e
+    counter = record.get("counter")
+    if counter is not None:
+        counter = _field(record, "counter", int)
+    device = DeviceRecord(
+        U2F_V2, verifier.app_id, key_handle, public_key, counter or 0, -1
+    )
+    signature_data = verifier.verify_signature_data(response, challenge, device)
+    if counter is not None:
+        check_counter_increased(device, signature_data.counter)
+    return {
+        "counter": signature_data.counter,
+        "userPresence": signature_data.user_presence,
+    }
+
+
+def verify_line(
+    number: int,
+    line: str,
+    attestation_trust_store: typ.Optional[AttestationTrustStore] = None,
+) -> Verdict:
+    """Verify the archive's line ``number``; returning its verdict."""
+    verdict = {"line": number}  # type: Verdict
+    try:
+        record = _parse_record(line)
+        if "id" in record:
+            verdict["id"] = record["id"]
+        verdict["type"] = record.get("type")
+        details = verify_record(record, attestation_trust_store)
+    except Exception as e:
+        # Whatever is wrong with one record, the rest still get a verdict.
+        verdict.update(valid=False, reason=failure_reason(e), error=str(e))
+    else:
+        verdict["valid"] = True
+        verdict.update(details)
+    return verdict
+
+
+def _parse_record(line: str) -> typ.Dict[str, typ.Any]:
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        raise U2FInvalidDataException("Record is not valid JSON") from e
+    if not isinstance(record, dict):
+        raise U2FInvalidDataException("Record is not a JSON object")
+    return record
+
+
+def verify_chunk(
+    start: int,
+    lines: typ.Sequence[str],
+    attestation_roots: typ.Optional[str] = None,
+) -> typ.List[Verdict]:
+    """
+    Verify consecutive lines, the first of which is line ``start``.
+
+    ``attestation_roots`` is a directory for ``AttestationTrustStore``; it is
+    loaded once per process.
+    """
+    store = load_trust_store(attestation_roots)
+    return [
+        verify_line(number, line, store)
+        for number, line in enumerate(lines, start)
+        if line.strip()
+    ]
+
+
+def _chunks(
+    lines: typ.Iterable[str], chunk_size: int
+) -> typ.Iterator[typ.Tuple[int, typ.List[str]]]:
+    start = 1
+    chunk = []  # type: typ.List[str]
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield start, chunk
+            start += len(chunk)
+            chunk = []
+    if chunk:
+        yield start, chunk
+
+
+def reverify(
+    lines: typ.Iterable[str],
+    *,
+    executor: typ.Optional[Executor] = None,
+    chunk_size: int = REVERIFY_CHUNK_SIZE,
+    max_pending: typ.Optional[int] = None,
+    attestation_roots: typ.Optional[str] = None
+) -> typ.Iterator[Verdict]:
+    """
+    Verify an archive's lines; yielding the verdicts in order.
+
+    The lines are sent to ``executor``, usually a ``ProcessPoolExecutor``,
+    ``chunk_size`` at a time; with no executor they are verified in this
+    process. At most ``max_pending`` chunks (by default, two per CPU) are
+    read ahead; so the archive is streamed, and the first verdicts are ready
+    as soon as their chunk is.
+    """
+    if executor is None:
+        for start, chunk in _chunks(lines, chunk_size):
+            yield from verify_chunk(start, chunk, attestation_roots)
+        return
+    if max_pending is None:
+        max_pending = 2 * (os.cpu_count() or 1)
+    pending = collections.deque()  # type: typ.Deque[typ.Any]
+    try:
+        for start, chunk in _chunks(lines, chunk_size):
+            pending.append(
+                executor.submit(verify_chunk, start, chunk, attestation_roots)
+            )
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class ReverifySummary:
+    """The number of valid and invalid responses; and the invalid by reason."""
+
+    def __init__(self) -> None:
+        self.valid = 0
+        self.invalid = 0
+        self.reasons = collections.Counter()  # type: typ.Counter[str]
+
+    @property
+    def total(self) -> int:
+        return self.valid + self.invalid
+
+    def add(self, verdict: Verdict) -> None:
+        if verdict["valid"]:
+            self.valid += 1
+        else:
+            self.invalid += 1
+            self.reasons[verdict["reason"]] += 1
@@ -1,8 +1,8 @@
-import json
-import pathlib
-
-from fido_u2f import registration, verification
-from flask import Flask, redirect, request, session
+from fido_u2f.exceptions import U2FInvalidDataException
+from fido_u2f.flask_ext import FlaskU2F, U2FDeviceStore
+from fido_u2f.sqlalchemy_repository import SQLAlchemyDeviceRepository
+from flask import Flask, request, session
+from sqlalchemy.orm import selectinload
 
 from .tables import Device, User, db
 
@@ -11,169 +11,146 @@ app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:////tmp/data.db"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.config["SECRET_KEY"] = "WebAuthN would be nice one day."
 app.config["DEBUG"] = True
+app.config["U2F_APP_ID"] = "https://localhost:5000"
 
 db.init_app(app)
 
+USERS_PER_PAGE = 20
+
 
 @app.before_first_request
 def _():
     db.create_all()
 
 
-class U2FManager(registration.U2FRegistrationManager, verification.U2FSigningManager):
-    def __init__(self):
-        self.app_id = "https://localhost:5000"
+class DeviceStore(U2FDeviceStore):
+    _repository = None
+
+    @property
+    def repository(self):
+        # Needs the app context, for the engine.
+        if self._repository is None:
+            self._repository = SQLAlchemyDeviceRepository(
+                db.engine, Device.__table__, owner_column="user_id"
+            )
+        return self._repository
+
+    def current_user(self):
+        return session.get("user_id")
+
+    def load_devices(self, user_id):
+        return Device.query.filter_by(user_id=user_id).all()
+
+    def devices_version(self, user_id):
+        # One query; the rendered devices are cached until it changes.
+        return self.repository.devices_version(user_id)
+
+    def signing_devices(self, user_id):
+        # Only the device that signed is loaded; by its key handle.
+        return self.repository.for_user(user_id)
 
-    def create_device_registration_model(self, *, transports, **kwargs):
-        device = Device()
+    def page_devices(self, user_id, offset, limit):
+        query = Device.query.filter_by(user_id=user_id)
+        devices = query.order_by(Device.id).offset(offset).limit(limit).all()
+        return query.count(), devices
+
+    def add_device(self, user_id, *, transports, **kwargs):
+        device = Device(user_id=user_id, counter=0, **kwargs)
         device.u2f_transports = transports
-        for k, v in kwargs.items():
-            setattr(device, k, v)
         db.session.add(device)
         db.session.commit()
         return device
 
-    def update_device_registration_counter(self, device, counter):
-        device.counter = counter
+    def update_counter(self, device, counter):
+        if not self.repository.update_counter(device, counter):
+            raise U2FInvalidDataException("Device counter did not increase")
         return device
 
 
-u2f_manager = U2FManager()
+u2f = FlaskU2F(app, store=DeviceStore())
+
+# Compiled once; the names are escaped.
+index_template = app.jinja_env.from_string(
+    """
+{% if login_success %}<h1>You logged in successfully!</h1>{% endif %}
+<form method="POST" action="/register">
+<input type="text" name="name" value="admin" />
+<input type="submit" value="Register new Device" />
+</form>
+<form method="POST" action="/login">
+<input type="text" name="name" value="admin" />
+<input type="submit" value="Verify registered device" />
+</form>
+<table>
+<tr><th>Username</th><th>Registered keys</th></tr>
+{% for user in users %}
+<tr><td>{{ user.name }}</td><td><table>
+<tr><th>Index</th><th>Key Handle</th><th>Counter</th></tr>
+{% for key in user.devices %}
+<tr>
+<td>{{ loop.index0 }}</td><td>{{ key.key_handle }}</td><td>{{ key.counter }}</td>
+</tr>
+{% endfor %}
+</table></td></tr>
+{% endfor %}
+</table>
+{% if page > 1 %}<a href="/?page={{ page - 1 }}">Previous</a>{% endif %}
+{% if more %}<a href="/?page={{ page + 1 }}">Next</a>{% endif %}
+"""
+)
+
+flow_template = app.jinja_env.from_string(
+    """
+<span id="u2f_status">Touch your device now.</span><br /><a href="/">Back</a>
+<script src="{{ url_for('fido_u2f.script') }}"></script>
+<script>
+window.fidoU2F.{{ step }}().then(function () {
+    window.location = "{{ done }}";
+}).catch(function (err) {
+    window.u2f_status.innerText = "Failed: " + err.message;
+});
+</script>
+"""
+)
 
 
 @app.route("/")
 def hello():
-    dat = "<table>"
-    dat += "<tr><th>Username</th><th>Registered keys</th></tr>"
-    for user in User.query.all():
-        dat += "<tr><td>" + user.name + "</td><td><table>\n"
-        dat += "<tr><th>Index</th><th>Key Handle</th><th>Counter</th></tr>\n"
-        for idx, key in enumerate(user.devices):
-            dat += "<tr><td>{0}</td><td>{1.key_handle}</td><td>{1.counter}</td></tr>\n".format(
-                idx, key
-            )
-        dat += "</table></td></tr>"
-    dat += "</table>"
-
-    pre = ""
-    if request.args.get("login", None) == "success":
-        pre = "<h1>You logged in successfully!!!!!!!!!!!!!!!</h1>"
-
-    return (
-        pre
-        + """
-    <form method='POST' action='/register' >
-    <input type='text' name='name' value='admin' />
-    <input type='submit' value='Register new Device' />
-    </form>
-    <form method='POST' action='/login' >
-    <input type='text' name='name' value='admin' />
-    <input type='submit' value='Verify registered device' />
-    </form>
-    """
-        + dat
+    page = max(request.args.get("page", 1, type=int), 1)
+    # Every listed user's devices are loaded in a single query.
+    users = (
+        User.query.options(selectinload(User.devices))
+        .order_by(User.id)
+        .offset((page - 1) * USERS_PER_PAGE)
+        .limit(USERS_PER_PAGE + 1)
+        .all()
+    )
+    return index_template.render(
+        users=users[:USERS_PER_PAGE],
+        page=page,
+        more=len(users) > USERS_PER_PAGE,
+        login_success=request.args.get("login", None) == "success",
     )
-
-
-@app.route("/register.js", methods=["GET"])
-def get_register_js():
-    return (pathlib.Path(__file__).parent / "register.js").open("r").read()
 
 
 @app.route("/register", methods=["POST"])
 def do_register_start():
     user_name = request.form["name"]
-    session["user_name"] = user_name
     user = User.query.filter_by(name=user_name).first()
     if not user:
         user = User(name=user_name)
         db.session.add(user)
         db.session.commit()
-    data = u2f_manager.create_registration_challenge(session, user.devices)
-
-    js = """
-    const appId = {appId};
-    const registerRequests = {registerRequests};
-    const registeredKeys = {registeredKeys};
-    """.format(
-        appId=json.dumps(data["appId"]),
-        registerRequests=json.dumps(data["registerRequests"]),
-        registeredKeys=json.dumps(data["registeredKeys"]),
-    )
-    return (
-        "<pre>"
-        + js
-        + "</pre><script>"
-        + js
-        + "</script>"
-        + '<span id="u2f_status">Loading</span><br /><a href="/">Back</a>'
-        + '<form id="u2f_data" method="POST" action="/register2">'
-        + '<input name="data" id="data" />'
-        + "</form>"
-        '<script src="register.js"></script>'
-    )
-
-
-@app.route("/register2", methods=["POST"])
-def do_register_verify():
-    user_name = session["user_name"]
-    user = User.query.filter_by(name=user_name).first()
-    if not user:
-        return 'No user by that name; <a href="/">Back</a>'
-    data = request.json or json.loads(request.form["data"])
-    device = u2f_manager.process_registration_response(session, data)
-    device.user = user
-    db.session.commit()
-    return redirect("/")
-
-
-@app.route("/login.js", methods=["GET"])
-def get_login_js():
-    return (pathlib.Path(__file__).parent / "login.js").open("r").read()
+    session["user_id"] = user.id
+    return flow_template.render(step="register", done="/")
 
 
 @app.route("/login", methods=["POST"])
 def do_login_start():
     user_name = request.form["name"]
-    session.user_name = user_name
     user = User.query.filter_by(name=user_name).first()
     if not user:
         return 'No user by that name; register a device first? <a href="/">Back</a>'
-    if not user.devices:
-        return 'No devices for that user; register a device first? <a href="/">Back</a>'
-
-    devices = user.devices
-    data = u2f_manager.create_signing_challenge(session, devices)
-    js = """
-    const appId = {appId};
-    const challenge = {challenge};
-    const registeredKeys = {registeredKeys};
-    """.format(
-        appId=json.dumps(data["appId"]),
-        challenge=json.dumps(data["challenge"]),
-        registeredKeys=json.dumps(data["registeredKeys"]),
-    )
-    return (
-        "<pre>"
-        + js
-        + "</pre><script>"
-        + js
-        + "</script>"
-        + '<span id="u2f_status">Loading</span><br /><a href="/">Back</a>'
-        + '<form id="u2f_data" method="POST" action="/login2">'
-        + '<input name="data" id="data" />'
-        + "</form>"
-        '<script src="login.js"></script>'
-    )
+    session["user_id"] = user.id
+    return flow_template.render(step="sign", done="/?login=success")
 
-
-@app.route("/login2", methods=["POST"])
-def do_login_verify():
-    user_name = session["user_name"]
-    user = User.query.filter_by(name=user_name).first()
-    if not user:
-        return 'No user by that name; <a href="/">Back</a>'
-    data = request.json or json.loads(request.form["data"])
-    device = u2f_manager.process_signing_response(session, data, user.devices)
-    db.session.commit()
-    return redirect("/?login=success")
@@ -1,5 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, ForeignKey, Integer, LargeBinary, String
+from sqlalchemy import Column, ForeignKey, Index, Integer, LargeBinary, String
 from sqlalchemy.orm import relationship
 
 from ..device import DeviceRegistration
@@ -24,9 +24,13 @@ class User(db.Model):
 
 class Device(db.Model, DeviceRegistration):
     __tablename__ = "Device"
+    # Devices are looked up by their key handle; see SQLAlchemyDeviceRepository.
+    __table_args__ = (
+        Index("ix_Device_app_id_key_handle", "app_id", "key_handle", unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("User.id"))
+    user_id = Column(Integer, ForeignKey("User.id"), index=True)
     user = relationship("User", back_populates="devices")
 
     """The U2F protocol version to use."""
@@ -40,7 +44,7 @@ class Device(db.Model, DeviceRegistration):
     """An integer-encoded `U2FTransport`. Use `u2f_transports` instead."""
     transports = Column(Integer)
     """A 32-bit unsigned integer representing the last seen counter."""
-    counter = Column(Integer)
+    counter = Column(Integer, nullable=False, default=0)
 
     @property
     def u2f_transports(self):
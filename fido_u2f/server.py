@@ -0,0 +1,306 @@
+"""
+A verification server; so the web workers don't spend their time on ECDSA.
+
+``python -m fido_u2f.server --socket PATH`` listens on a Unix socket and
+verifies registration and signing responses on a pool of worker processes.
+Web workers give their managers a ``VerifierClient`` (see
+``fido_u2f.verifier_client``); the web tier and the verifiers can then be
+scaled separately.
+
+Each job and each reply is a frame: a 4 byte big-endian length, then that
+many bytes of JSON. A job is a record, as archived for ``fido_u2f.reverify``,
+with an ``id``; a connection may have many jobs in flight, and their replies
+come back in the order they finish::
+
+    {"id": 1, "type": "sign", "appId": "...", "challenge": "...",
+     "response": {...}, "publicKey": "..."}
+    {"id": 1, "valid": true, "counter": 42, "userPresence": 1}
+    {"id": 2, "valid": false, "exception": "U2FInvalidDataException",
+     "error": "...", "reason": "..."}
+
+A registration job with ``"requireAttestation": true`` fails unless the server
+has ``--attestation-roots``; the client sends it when its manager has an
+attestation trust store, so that is never silently skipped.
+
+The server only checks the responses; the challenge and the device's counter
+are still the managers' to check.
+
+If one of the worker processes dies, the server exits with status 1; run it
+under a supervisor that restarts it.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import stat
+import struct
+import sys
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .aio import get_running_loop
+from .attestation import AttestationTrustStore
+from .constants import VERIFY_SERVER_MAX_FRAME, VERIFY_SERVER_MAX_PENDING
+from .exceptions import U2FException
+from .metrics import failure_reason
+from .reverify import load_trust_store, verify_record
+
+from . import _typing as typ  # isort:skip
+
+FRAME_HEADER = struct.Struct(">I")
+_JSON_SEPARATORS = (",", ":")
+
+Job = typ.Dict[str, typ.Any]
+Reply = typ.Dict[str, typ.Any]
+
+
+def encode_frame(message: typ.Mapping[str, typ.Any]) -> bytes:
+    body = json.dumps(message, separators=_JSON_SEPARATORS).encode("utf-8")
+    return FRAME_HEADER.pack(len(body)) + body
+
+
+def verify_job(job: Job, attestation_roots: typ.Optional[str] = None) -> Reply:
+    """
+    Verify one job; returning its reply.
+
+    ``attestation_roots`` is a directory for ``AttestationTrustStore``; it is
+    loaded once per process. A job with ``requireAttestation`` fails without
+    it.
+    """
+    reply = {"id": job.get("id")}  # type: Reply
+    try:
+        if job.get("requireAttestation") and attestation_roots is None:
+            raise ValueError("The server has no attestation roots to check")
+        store = load_trust_store(attestation_roots)
+        details = verify_record(job, store)
+    except Exception as e:
+        # The exception is named for the client to raise again; only the
+        #  managers' own are.
+        name = type(e).__name__ if isinstance(e, U2FException) else "Exception"
+        reply.update(
+            valid=False, exception=name, error=str(e), reason=failure_reason(e)
+        )
+    else:
+        reply["valid"] = True
+        reply.update(details)
+    return reply
+
+
+class VerificationServer:
+    """
+    Accept jobs on the Unix socket at ``path``; verifying them on ``executor``.
+
+    The socket is created with the permissions ``mode``. Each connection may
+    have ``max_pending`` jobs in flight; no more are read from it until one
+    of them is done. A connection that sends a frame larger than
+    ``max_frame`` is closed.
+
+    A job the executor fails to run is answered with an error. If a worker
+    process dies the pool is broken, and every later job would fail; so the
+    server stops, with ``failed`` set, for its supervisor to restart it.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        executor: Executor,
+        *,
+        attestation_roots: typ.Optional[str] = None,
+        max_pending: int = VERIFY_SERVER_MAX_PENDING,
+        max_frame: int = VERIFY_SERVER_MAX_FRAME,
+        mode: int = 0o600
+    ) -> None:
+        self.path = path
+        self.executor = executor
+        self.attestation_roots = attestation_roots
+        self.max_pending = max_pending
+        self.max_frame = max_frame
+        self.mode = mode
+        self.loop = None  # type: typ.Optional[asyncio.AbstractEventLoop]
+        self.failed = False
+        self._server = None  # type: typ.Any
+        self._stopped = None  # type: typ.Optional[asyncio.Event]
+        # Each open connection's reader; and a future done once it's closed.
+        self._connections = {}  # type: typ.Dict[asyncio.StreamReader, asyncio.Future]
+
+    def run(self, ready: typ.Optional[threading.Event] = None) -> None:
+        """
+        Serve until ``stop`` is called; on a new event loop.
+
+        ``ready`` is set once the socket is accepting connections.
+        """
+        loop = self.loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.start())
+            if ready is not None:
+                ready.set()
+            loop.run_until_complete(self._stopped.wait())  # type: ignore
+            loop.run_until_complete(self.close())
+        finally:
+            self.loop = None
+            loop.close()
+
+    def stop(self) -> None:
+        """Stop ``run``; from any thread. Once it has returned, this does nothing."""
+        loop = self.loop
+        if loop is not None and self._stopped is not None:
+            try:
+                loop.call_soon_threadsafe(self._stopped.set)
+            except RuntimeError:
+                # ``run`` closed the loop in the meantime.
+                pass
+
+    async def start(self) -> None:
+        self._stopped = asyncio.Event()
+        # A socket left behind by a server that was killed.
+        if os.path.exists(self.path) and stat.S_ISSOCK(os.stat(self.path).st_mode):
+            os.unlink(self.path)
+        # Bound with no permissions for others; so no one can connect before
+        #  the socket has its mode.
+        umask = os.umask(0o177)
+        try:
+            self._server = await asyncio.start_unix_server(
+                self.handle, path=self.path
+            )
+        finally:
+            os.umask(umask)
+        os.chmod(self.path, self.mode)
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            os.unlink(self.path)
+        # No more jobs are read; those in flight are still answered.
+        for reader in self._connections:
+            reader.feed_eof()
+        if self._connections:
+            await asyncio.wait(list(self._connections.values()))
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Serve one connection."""
+        pending = asyncio.Semaphore(self.max_pending)
+        tasks = set()  # type: typ.Set[asyncio.Future]
+        closed = self._connections[reader] = get_running_loop().create_future()
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(FRAME_HEADER.size)
+                    (size,) = FRAME_HEADER.unpack(header)
+                    if size > self.max_frame:
+                        break
+                    body = await reader.readexactly(size)
+                except asyncio.IncompleteReadError:
+                    break
+                await pending.acquire()
+                task = asyncio.ensure_future(self._verify(body, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(lambda _: pending.release())
+            if tasks:
+                await asyncio.wait(tasks)
+        finally:
+            writer.close()
+            del self._connections[reader]
+            closed.set_result(None)
+
+    async def _verify(self, body: bytes, writer: asyncio.StreamWriter) -> None:
+        try:
+            job = json.loads(body.decode("utf-8"))
+            if not isinstance(job, dict):
+                raise ValueError("A job must be a JSON object")
+        except ValueError as e:
+            reply = {
+                "id": None,
+                "valid": False,
+                "exception": "Exception",
+                "error": str(e),
+                "reason": "job_is_not_valid_json",
+            }  # type: Reply
+        else:
+            try:
+                reply = await get_running_loop().run_in_executor(
+                    self.executor, verify_job, job, self.attestation_roots
+                )
+            except Exception as e:
+                reply = {
+                    "id": job.get("id"),
+                    "valid": False,
+                    "exception": "Exception",
+                    "error": "The job could not be run: {}".format(e),
+                    "reason": "verifier_failed",
+                }
+                if isinstance(e, BrokenProcessPool) and not self.failed:
+                    self.failed = True
+                    self.stop()
+        writer.write(encode_frame(reply))
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+
+def main(argv: typ.Optional[typ.Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m fido_u2f.server",
+        description=(
+            "Verify registration and signing responses, for the managers' "
+            "VerifierClient, on a pool of worker processes."
+        ),
+    )
+    parser.add_argument(
+        "--socket", required=True, help="the Unix socket to listen on"
+    )
+    parser.add_argument(
+        "--mode",
+        type=lambda mode: int(mode, 8),
+        default=0o600,
+        help="the socket's permissions, in octal; 600 by default",
+    )
+    parser.add_argument(
+        "-j",
+        "--processes",
+        type=int,
+        default=0,
+        help="worker processes; 0 (the default) for one per CPU",
+    )
+    parser.add_argument(
+        "--attestation-roots",
+        metavar="DIRECTORY",
+        help="only trust attestation certificates issued by the CAs in DIRECTORY",
+    )
+    parser.add_argument(
+        "--max-pending",
+        type=int,
+        default=VERIFY_SERVER_MAX_PENDING,
+        help="the jobs each connection may have in flight",
+    )
+    args = parser.parse_args(argv)
+
+    if args.attestation_roots is not None:
+        # Fail now, rather than on every registration.
+        AttestationTrustStore.from_directory(args.attestation_roots)
+    executor = ProcessPoolExecutor(args.processes or None)
+    server = VerificationServer(
+        args.socket,
+        executor,
+        attestation_roots=args.attestation_roots,
+        max_pending=args.max_pending,
+        mode=args.mode,
+    )
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: server.stop())
+    try:
+        server.run()
+    finally:
+        executor.shutdown()
+    return 1 if server.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
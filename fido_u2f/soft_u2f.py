@@ -0,0 +1,253 @@
+"""
+A software U2F token.
+
+``SoftU2FToken`` produces valid registration and signing responses from
+locally generated keys and attestation certificates; for tests, and for
+driving the managers under load without any hardware.
+"""
+import datetime
+import json
+import os
+import random
+import struct
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from .constants import U2F_TRANSPORT_EXTENSION_OID, U2F_V2
+from .device import DeviceRegistration
+from .enums import RequestType, U2FTransport, U2FTransports
+from .utils import sha_256, websafe_decode, websafe_encode
+
+from . import _typing as typ  # isort:skip
+
+KeyAndCertificate = typ.Tuple[ec.EllipticCurvePrivateKey, x509.Certificate]
+
+# The app ID the key was registered for, and the key.
+_Key = typ.Tuple[str, ec.EllipticCurvePrivateKey]
+
+_COUNTER = struct.Struct(">I")
+
+
+def _raw_public_key(private_key: ec.EllipticCurvePrivateKey) -> bytes:
+    return private_key.public_key().public_bytes(
+        serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+    )
+
+
+def _certificate_builder(
+    common_name: str,
+    public_key: ec.EllipticCurvePublicKey,
+    issuer: typ.Optional[KeyAndCertificate],
+    serial_number: typ.Optional[int] = None,
+) -> x509.CertificateBuilder:
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    issuer_name = name if issuer is None else issuer[1].subject
+    now = datetime.datetime(2018, 1, 1)
+    if serial_number is None:
+        serial_number = x509.random_serial_number()
+    return (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(issuer_name)
+        .public_key(public_key)
+        .serial_number(serial_number)
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=365 * 30))
+    )
+
+
+def create_ca_certificate(
+    common_name: str, issuer: typ.Optional[KeyAndCertificate] = None
+) -> KeyAndCertificate:
+    """
+    Create a CA key and certificate; signed by ``issuer`` if given.
+
+    ``issuer`` is a ``(private_key, certificate)`` tuple.
+    """
+    key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    builder = _certificate_builder(common_name, key.public_key(), issuer).add_extension(
+        x509.BasicConstraints(ca=True, path_length=None), critical=True
+    )
+    signing_key = key if issuer is None else issuer[0]
+    return key, builder.sign(signing_key, hashes.SHA256(), default_backend())
+
+
+def create_attestation_certificate(
+    transports: typ.Optional[typ.Collection[U2FTransport]] = (U2FTransport.USB,),
+    issuer: typ.Optional[KeyAndCertificate] = None,
+    key: typ.Optional[ec.EllipticCurvePrivateKey] = None,
+    serial_number: typ.Optional[int] = None,
+) -> KeyAndCertificate:
+    """
+    Create an attestation key and certificate; signed by ``issuer`` if given.
+
+    A new key is generated unless ``key`` is given; and a random serial
+    number unless ``serial_number`` is.
+    """
+    if key is None:
+        key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    builder = _certificate_builder(
+        "Soft U2F Token", key.public_key(), issuer, serial_number
+    )
+    if transports is not None:
+        flags = U2FTransport.to_byte(transports)
+        builder = builder.add_extension(
+            x509.UnrecognizedExtension(
+                U2F_TRANSPORT_EXTENSION_OID, bytes([0x03, 0x02, 0x03, flags])
+            ),
+            critical=False,
+        )
+    signing_key = key if issuer is None else issuer[0]
+    return key, builder.sign(signing_key, hashes.SHA256(), default_backend())
+
+
+class SoftDevice(DeviceRegistration):
+    """A plain, in-memory ``DeviceRegistration``."""
+
+    def __init__(
+        self,
+        *,
+        version: str,
+        app_id: str,
+        key_handle: bytes,
+        public_key: bytes,
+        transports: U2FTransports,
+        counter: int = 0
+    ) -> None:
+        self.version = version
+        self.app_id = app_id
+        self.key_handle = key_handle
+        self.public_key = public_key
+        self.u2f_transports = transports
+        self.counter = counter
+
+
+class SoftU2FToken:
+    """
+    A software U2F token.
+
+    Given a ``seed``, the token's attestation key and certificate serial
+    number, and every key and key handle it registers, are derived from it;
+    so the same seed always gives the same keys. ECDSA signatures are still
+    randomised; so the bytes of the attestation certificate, and of each
+    response, differ from run to run.
+
+    A token is not thread-safe; give each thread its own.
+    """
+
+    def __init__(
+        self,
+        attestation: typ.Optional[KeyAndCertificate] = None,
+        transports: typ.Optional[typ.Collection[U2FTransport]] = (U2FTransport.USB,),
+        seed: typ.Optional[int] = None,
+    ) -> None:
+        self._random = None if seed is None else random.Random(seed)
+        if attestation is None:
+            attestation = create_attestation_certificate(
+                transports, key=self._new_key(), serial_number=self._new_serial()
+            )
+        self.attestation_key, self.attestation_cert = attestation
+        self._certificate = self.attestation_cert.public_bytes(
+            serialization.Encoding.DER
+        )
+        self.keys = {}  # type: typ.Dict[bytes, _Key]
+        self.counter = 0
+
+    def _new_key(self) -> ec.EllipticCurvePrivateKey:
+        if self._random is None:
+            return ec.generate_private_key(ec.SECP256R1(), default_backend())
+        # Any integer in [1, n) is a valid P-256 private key; 2 ** 255 < n.
+        value = self._random.randrange(1, 2 ** 255)
+        return ec.derive_private_key(value, ec.SECP256R1(), default_backend())
+
+    def _new_serial(self) -> typ.Optional[int]:
+        if self._random is None:
+            return None
+        # As x509.random_serial_number; a positive integer of at most 159 bits.
+        return self._random.randrange(1, 2 ** 159)
+
+    def _new_key_handle(self) -> bytes:
+        if self._random is None:
+            return os.urandom(64)
+        return self._random.getrandbits(64 * 8).to_bytes(64, "big")
+
+    @staticmethod
+    def client_data(request_type: RequestType, challenge: str, origin: str) -> bytes:
+        data = {"typ": request_type.value, "challenge": challenge, "origin": origin}
+        return json.dumps(data).encode("utf-8")
+
+    def register(
+        self, app_id: str, challenge: str, origin: typ.Optional[str] = None
+    ) -> typ.Dict[str, str]:
+        """Create a response to a registration challenge."""
+        key = self._new_key()
+        key_handle = self._new_key_handle()
+        self.keys[key_handle] = (app_id, key)
+        public_key = _raw_public_key(key)
+        client_data = self.client_data(
+            RequestType.REGISTER, challenge, origin or app_id
+        )
+        signature = self.attestation_key.sign(
+            b"\0"
+            + sha_256(app_id.encode("idna"))
+            + sha_256(client_data)
+            + key_handle
+            + public_key,
+            ec.ECDSA(hashes.SHA256()),
+        )
+        registration_data = (
+            b"\x05"
+            + public_key
+            + bytes([len(key_handle)])
+            + key_handle
+            + self._certificate
+            + signature
+        )
+        return {
+            "version": U2F_V2,
+            "registrationData": websafe_encode(registration_data),
+            "clientData": websafe_encode(client_data),
+        }
+
+    def sign(
+        self,
+        app_id: str,
+        challenge: str,
+        key_handle: typ.Union[str, bytes],
+        origin: typ.Optional[str] = None,
+        user_presence: int = 1,
+    ) -> typ.Dict[str, str]:
+        """Create a response to a signing challenge for the given key."""
+        if isinstance(key_handle, str):
+            key_handle = websafe_decode(key_handle)
+        key_app_id, key = self.keys[key_handle]
+        if key_app_id != app_id:
+            raise ValueError("The key was registered for {!r}".format(key_app_id))
+        self.counter += 1
+        client_data = self.client_data(RequestType.SIGN, challenge, origin or app_id)
+        signed = bytes([user_presence]) + _COUNTER.pack(self.counter)
+        signature = key.sign(
+            sha_256(app_id.encode("idna")) + signed + sha_256(client_data),
+            ec.ECDSA(hashes.SHA256()),
+        )
+        return {
+            "keyHandle": websafe_encode(key_handle),
+            "signatureData": websafe_encode(signed + signature),
+            "clientData": websafe_encode(client_data),
+        }
+
+    def device(self, key_handle: bytes, counter: int = 0) -> SoftDevice:
+        """Return the server-side record for one of this token's keys."""
+        app_id, key = self.keys[key_handle]
+        return SoftDevice(
+            version=U2F_V2,
+            app_id=app_id,
+            key_handle=key_handle,
+            public_key=_raw_public_key(key),
+            transports=[U2FTransport.USB],
+            counter=counter,
+        )
@@ -0,0 +1,312 @@
+"""
+Device registrations in an SQL database, through SQLAlchemy.
+
+``device_table`` defines the table; its unique index on ``(app_id,
+key_handle)`` lets a ``SQLAlchemyDeviceRepository`` find the device that
+signed a response with a single-row query, rather than loading all of the
+user's devices::
+
+    repository = SQLAlchemyDeviceRepository(engine)
+    manager.process_signing_response(session, response, repository.for_user(uid))
+
+An existing table can be used instead; it needs the columns of
+``device_table``, with the owner in ``owner_column``, and its unique index.
+Its counter and transports may be nullable; ``NULL`` is read as no counter
+yet (``0``) and unknown transports (``-1``).
+
+Counter updates are a single compare-and-set ``UPDATE``; the repository is
+also a ``CounterStore`` for a ``WriteBehindCounterSink``, and a
+``DeviceSink`` for ``bulk.import_devices``.
+"""
+import sqlalchemy
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Index,
+    Integer,
+    LargeBinary,
+    MetaData,
+    SmallInteger,
+    String,
+    Table,
+    and_,
+    bindparam,
+    func,
+    or_,
+    select,
+)
+
+from .bulk import DeviceSink, OwnedDevice, OwnedRecord, import_devices
+from .constants import BULK_BATCH_SIZE
+from .counters import CounterStore, DeviceKey
+from .device import DeviceRecord, DeviceRegistration, DeviceSource
+
+from . import _typing as typ  # isort:skip
+
+
+# SQLAlchemy 1.3 takes a select's columns as a list; 2.0 only as arguments.
+_SELECT_TAKES_LIST = tuple(
+    int(part) for part in sqlalchemy.__version__.split(".")[:2]
+) < (1, 4)
+
+
+def _select(*columns: typ.Any) -> typ.Any:
+    if _SELECT_TAKES_LIST:
+        return select(list(columns))  # type: ignore
+    return select(*columns)
+
+
+def _record(row: typ.Any) -> DeviceRecord:
+    return DeviceRecord(
+        row.version,
+        row.app_id,
+        bytes(row.key_handle),
+        bytes(row.public_key),
+        0 if row.counter is None else row.counter,
+        -1 if row.transports is None else row.transports,
+    )
+
+
+def device_table(
+    metadata: MetaData, name: str = "u2f_devices", owner_type: typ.Any = None
+) -> Table:
+    """
+    Define the devices table in ``metadata``.
+
+    The owner is a string, unless another column type is given as
+    ``owner_type``; such as ``Integer`` to hold user IDs.
+    """
+    return Table(
+        name,
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("owner", owner_type or String(255), nullable=False),
+        Column("version", String(16), nullable=False),
+        Column("app_id", String(512), nullable=False),
+        Column("key_handle", LargeBinary(255), nullable=False),
+        Column("public_key", LargeBinary(255), nullable=False),
+        Column("transports", SmallInteger, nullable=False, default=-1),
+        Column("counter", BigInteger, nullable=False, default=0),
+        Index(
+            "ix_{}_app_id_key_handle".format(name), "app_id", "key_handle", unique=True
+        ),
+        Index("ix_{}_owner".format(name), "owner"),
+    )
+
+
+class SQLAlchemyDeviceRepository(CounterStore, DeviceSink):
+    """
+    The devices in ``table``; by default a new ``device_table``.
+
+    ``engine`` is an SQLAlchemy ``Engine``; each method runs in a transaction
+    of its own. The devices are returned as ``DeviceRecord`` s.
+    """
+
+    def __init__(
+        self,
+        engine: typ.Any,
+        table: typ.Optional[Table] = None,
+        *,
+        owner_column: str = "owner"
+    ) -> None:
+        self.engine = engine
+        self.table = device_table(MetaData()) if table is None else table
+        self._owner = self.table.c[owner_column]
+        self._owner_column = owner_column
+        columns = self.table.c
+        self._by_key = and_(
+            columns.app_id == bindparam("b_app_id"),
+            columns.key_handle == bindparam("b_key_handle"),
+        )
+        # Compare-and-set; the counter can only increase. A NULL counter has
+        #  never been set; any counter is an increase.
+        increases = or_(
+            columns.counter.is_(None), columns.counter < bindparam("b_counter")
+        )
+        self._update_counter = (
+            self.table.update()
+            .where(and_(self._by_key, increases))
+            .values(counter=bindparam("b_counter"))
+        )
+
+    def create_table(self) -> None:
+        self.table.create(self.engine, checkfirst=True)
+
+    def _row(self, owner: typ.Hashable, device: DeviceRegistration) -> typ.Dict:
+        record = device
+        if not isinstance(record, DeviceRecord):
+            record = DeviceRecord.from_device(device)
+        return {
+            self._owner_column: owner,
+            "version": record.version,
+            "app_id": record.app_id,
+            "key_handle": record.key_handle,
+            "public_key": record.public_key,
+            "counter": record.counter,
+            "transports": record.transports,
+        }
+
+    def add_device(
+        self, owner: typ.Hashable, device: DeviceRegistration
+    ) -> DeviceRecord:
+        """
+        Store a newly registered device for the owner; with a single ``INSERT``.
+
+        Raises the database's ``IntegrityError`` if the key handle is already
+        registered for the app ID.
+        """
+        row = self._row(owner, device)
+        with self.engine.begin() as connection:
+            connection.execute(self.table.insert(), row)
+        return DeviceRecord.from_device(device)
+
+    def add_devices(
+        self, devices: typ.Iterable[OwnedDevice], *, batch_size: int = BULK_BATCH_SIZE
+    ) -> int:
+        """
+        Store many ``(owner, device)`` pairs; ``batch_size`` at a time, each
+        batch in a single ``executemany`` of one ``INSERT``.
+
+        Returns the number of devices stored.
+        """
+        return import_devices(devices, self, batch_size=batch_size)  # type: ignore
+
+    def write_batch(self, devices: typ.Sequence[OwnedRecord]) -> None:
+        rows = [self._row(owner, device) for owner, device in devices]
+        with self.engine.begin() as connection:
+            connection.execute(self.table.insert(), rows)
+
+    def get_device(
+        self, app_id: str, key_handle: bytes, owner: typ.Hashable = None
+    ) -> typ.Optional[DeviceRecord]:
+        """
+        The device with the key handle; if it is the owner's, when one is given.
+
+        A single query, on the unique ``(app_id, key_handle)`` index.
+        """
+        query = self.table.select().where(self._by_key)
+        if owner is not None:
+            query = query.where(self._owner == owner)
+        with self.engine.connect() as connection:
+            row = connection.execute(
+                query, {"b_app_id": app_id, "b_key_handle": bytes(key_handle)}
+            ).first()
+        return None if row is None else _record(row)
+
+    def devices_for_owner(
+        self, owner: typ.Hashable, app_id: typ.Optional[str] = None
+    ) -> typ.List[DeviceRecord]:
+        """The owner's devices, in the order they were added; in a single query."""
+        query = self.table.select().where(self._owner == owner)
+        if app_id is not None:
+            query = query.where(self.table.c.app_id == app_id)
+        query = query.order_by(self.table.c.id)
+        with self.engine.connect() as connection:
+            return [_record(row) for row in connection.execute(query)]
+
+    def devices_version(self, owner: typ.Hashable) -> typ.Tuple[int, typ.Any]:
+        """
+        The number of devices the owner has, and their highest ID; in a single
+        query. It changes whenever one of their devices is added or removed;
+        such as for a ``U2FDeviceStore.devices_version``.
+        """
+        ids = self.table.c.id
+        query = _select(func.count(ids), func.max(ids)).where(self._owner == owner)
+        with self.engine.connect() as connection:
+            count, highest = connection.execute(query).first()
+        return count, highest
+
+    def for_user(self, owner: typ.Hashable) -> "UserDevices":
+        """
+        The owner's devices; to give to the managers.
+
+        Looking up the device that signed a response doesn't load the others.
+        """
+        return UserDevices(self, owner)
+
+    def update_counter(self, device: DeviceRegistration, counter: int) -> bool:
+        """
+        Store the device's new counter with a single ``UPDATE``.
+
+        Returns ``False``, without storing it, if the stored counter is not
+        lower; such as when another worker has stored a later one.
+        """
+        with self.engine.begin() as connection:
+            updated = connection.execute(
+                self._update_counter,
+                {
+                    "b_app_id": device.app_id,
+                    "b_key_handle": bytes(device.key_handle),
+                    "b_counter": counter,
+                },
+            ).rowcount
+        if updated != 1:
+            return False
+        device.counter = counter
+        return True
+
+    def compare_and_set(
+        self, counters: typ.Mapping[DeviceKey, int]
+    ) -> typ.Collection[DeviceKey]:
+        rejected = []
+        with self.engine.begin() as connection:
+            for (app_id, key_handle), counter in counters.items():
+                result = connection.execute(
+                    self._update_counter,
+                    {
+                        "b_app_id": app_id,
+                        "b_key_handle": bytes(key_handle),
+                        "b_counter": counter,
+                    },
+                )
+                if result.rowcount != 1:
+                    rejected.append((app_id, key_handle))
+        return rejected
+
+    def get(self, app_id: str, key_handle: bytes) -> typ.Optional[int]:
+        """The device's stored counter; for a ``WriteBehindCounterSink``."""
+        device = self.get_device(app_id, key_handle)
+        return None if device is None else device.counter
+
+    def delete_device(
+        self, owner: typ.Hashable, app_id: str, key_handle: bytes
+    ) -> bool:
+        """Remove the owner's device; returning whether they had it."""
+        query = self.table.delete().where(and_(self._by_key, self._owner == owner))
+        with self.engine.begin() as connection:
+            deleted = connection.execute(
+                query, {"b_app_id": app_id, "b_key_handle": bytes(key_handle)}
+            ).rowcount
+        return deleted == 1
+
+
+class UserDevices(DeviceSource):
+    """One owner's devices in a ``SQLAlchemyDeviceRepository``."""
+
+    def __init__(
+        self, repository: SQLAlchemyDeviceRepository, owner: typ.Hashable
+    ) -> None:
+        self.repository = repository
+        self.owner = owner
+        self._devices = None  # type: typ.Optional[typ.List[DeviceRecord]]
+
+    def _all_devices(self) -> typ.List[DeviceRecord]:
+        if self._devices is None:
+            self._devices = self.repository.devices_for_owner(self.owner)
+        return self._devices
+
+    def __len__(self) -> int:
+        return len(self._all_devices())
+
+    def __iter__(self) -> typ.Iterator[DeviceRecord]:
+        return iter(self._all_devices())
+
+    def devices_for_app_id(self, app_id: str) -> typ.Sequence[DeviceRegistration]:
+        if self._devices is None:
+            return self.repository.devices_for_owner(self.owner, app_id)
+        return [device for device in self._devices if device.app_id == app_id]
+
+    def get_device(
+        self, app_id: str, key_handle: bytes
+    ) -> typ.Optional[DeviceRegistration]:
+        return self.repository.get_device(app_id, key_handle, self.owner)
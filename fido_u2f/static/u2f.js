@@ -0,0 +1,64 @@
+// The client side of fido_u2f.flask_ext; needs the U2F JavaScript API.
+//
+//   fidoU2F.register().then(function (device) { ... })
+//   fidoU2F.sign().then(function (result) { ... })
+//
+// The endpoints are found relative to this script's URL.
+(function () {
+    'use strict';
+
+    var script = document.currentScript;
+    var base = script.src.slice(0, script.src.lastIndexOf('/') + 1);
+
+    function request(method, path, body) {
+        var options = {method: method, credentials: 'same-origin', headers: {}};
+        if (body !== undefined) {
+            options.body = JSON.stringify(body);
+            options.headers['Content-Type'] = 'application/json';
+        }
+        return window.fetch(base + path, options).then(function (resp) {
+            return resp.json().then(function (data) {
+                if (!resp.ok) {
+                    throw new Error(data.error || resp.statusText);
+                }
+                return data;
+            });
+        });
+    }
+
+    function respond(path) {
+        return function (response) {
+            if (response.errorCode) {
+                throw new Error('The device failed with error ' + response.errorCode);
+            }
+            return request('POST', path, response);
+        };
+    }
+
+    function call(method, args) {
+        return new Promise(function (resolve) {
+            if (!window.u2f) {
+                throw new Error('The U2F API is not available.');
+            }
+            window.u2f[method].apply(window.u2f, args.concat([resolve]));
+        });
+    }
+
+    window.fidoU2F = {
+        register: function () {
+            return request('GET', 'register').then(function (req) {
+                return call('register', [
+                    req.appId, req.registerRequests, req.registeredKeys
+                ]);
+            }).then(respond('register'));
+        },
+        sign: function () {
+            return request('GET', 'sign').then(function (req) {
+                return call('sign', [req.appId, req.challenge, req.registeredKeys]);
+            }).then(respond('sign'));
+        },
+        devices: function (page) {
+            return request('GET', 'devices?page=' + (page || 1));
+        }
+    };
+})();
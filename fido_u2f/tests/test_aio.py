@@ -0,0 +1,165 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from .. import aio
+from ..counters import MemoryCounterStore, WriteBehindCounterSink, device_key
+from ..exceptions import U2FInvalidDataException, U2FStateException
+from ..soft_u2f import SoftU2FToken
+
+APP_ID = "https://example.com"
+
+
+class RegistrationManager(aio.AsyncU2FRegistrationManager):
+    async def create_device_registration_model(self, **kwargs):
+        await asyncio.sleep(0)
+        return kwargs
+
+
+class SigningManager(aio.AsyncU2FSigningManager):
+    async def update_device_registration_counter(self, *, device, counter):
+        await asyncio.sleep(0)
+        device.counter = counter
+        return device
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@pytest.fixture
+def token():
+    return SoftU2FToken()
+
+
+def test_process_registration_response(token):
+    manager = RegistrationManager(APP_ID)
+    session = {}
+    challenge = manager.create_registration_challenge(session)["registerRequests"][0]
+    response = token.register(APP_ID, challenge["challenge"])
+    device = run(manager.process_registration_response(session, response))
+    (key_handle,) = token.keys
+    assert device["key_handle"] == key_handle
+
+
+def test_process_bodies(token):
+    registration_manager = RegistrationManager(APP_ID)
+    session = {}
+    request = registration_manager.create_registration_challenge(session)
+    response = token.register(APP_ID, request["registerRequests"][0]["challenge"])
+    body = json.dumps(response).encode("utf-8")
+    run(registration_manager.process_registration_body(session, body))
+    (key_handle,) = token.keys
+    device = token.device(key_handle)
+    signing_manager = SigningManager(APP_ID)
+    challenge = signing_manager.create_signing_challenge(session, [device])["challenge"]
+    body = json.dumps(token.sign(APP_ID, challenge, key_handle))
+    device = run(signing_manager.process_signing_body(session, body, [device]))
+    assert device.counter == 1
+
+
+def test_process_signing_responses():
+    manager = SigningManager(APP_ID)
+    requests = []
+    devices = []
+    for _ in range(3):
+        token = SoftU2FToken()
+        token.register(APP_ID, "challenge")
+        (key_handle,) = token.keys
+        device = token.device(key_handle)
+        session = {}
+        challenge = manager.create_signing_challenge(session, [device])["challenge"]
+        requests.append((session, token.sign(APP_ID, challenge, key_handle), [device]))
+        devices.append(device)
+    requests[0][0].clear()
+    results = run(manager.process_signing_responses(requests))
+    assert isinstance(results[0], U2FStateException)
+    assert results[1:] == devices[1:]
+
+
+def test_timeout(token):
+    class SlowSigningManager(SigningManager):
+        async def update_device_registration_counter(self, *, device, counter):
+            await asyncio.sleep(10)
+
+    token.register(APP_ID, "challenge")
+    (key_handle,) = token.keys
+    device = token.device(key_handle)
+    manager = SlowSigningManager(APP_ID)
+    session = {}
+    challenge = manager.create_signing_challenge(session, [device])["challenge"]
+    response = token.sign(APP_ID, challenge, key_handle)
+    with pytest.raises(asyncio.TimeoutError):
+        run(manager.process_signing_response(session, response, [device], timeout=0.1))
+
+
+class ThreadCheckingSession(dict):
+    """A session that records the threads it's used from."""
+
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+
+    def pop(self, *args):
+        self.threads.add(threading.get_ident())
+        return super().pop(*args)
+
+
+def test_session_used_on_loop(token):
+    registration_manager = RegistrationManager(APP_ID)
+    session = ThreadCheckingSession()
+    request = registration_manager.create_registration_challenge(session)
+    response = token.register(APP_ID, request["registerRequests"][0]["challenge"])
+    run(registration_manager.process_registration_response(session, response))
+    (key_handle,) = token.keys
+    device = token.device(key_handle)
+    signing_manager = SigningManager(APP_ID)
+    challenge = signing_manager.create_signing_challenge(session, [device])["challenge"]
+    response = token.sign(APP_ID, challenge, key_handle)
+    run(signing_manager.process_signing_response(session, response, [device]))
+    assert session.threads == {threading.get_ident()}
+
+
+class ThreadCheckingStore(MemoryCounterStore):
+    """A counter store that records the threads it's used from."""
+
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+
+    def compare_and_set(self, counters):
+        self.threads.add(threading.get_ident())
+        return super().compare_and_set(counters)
+
+    def get(self, app_id, key_handle):
+        self.threads.add(threading.get_ident())
+        return super().get(app_id, key_handle)
+
+
+def test_counter_sink(token):
+    token.register(APP_ID, "challenge")
+    (key_handle,) = token.keys
+    device = token.device(key_handle)
+    store = ThreadCheckingStore()
+    manager = SigningManager(
+        APP_ID, counter_sink=WriteBehindCounterSink(store, max_batch=1)
+    )
+    session = {}
+    challenge = manager.create_signing_challenge(session, [device])["challenge"]
+    response = token.sign(APP_ID, challenge, key_handle)
+    assert run(manager.process_signing_response(session, response, [device])) is device
+    assert store.counters == {device_key(device): token.counter}
+    # The store was only used off the event loop.
+    assert store.threads
+    assert threading.get_ident() not in store.threads
+    challenge = manager.create_signing_challenge(session, [device])["challenge"]
+    token.counter -= 1
+    response = token.sign(APP_ID, challenge, key_handle)
+    with pytest.raises(U2FInvalidDataException):
+        run(manager.process_signing_response(session, response, [device]))
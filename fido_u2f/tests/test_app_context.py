@@ -0,0 +1,38 @@
+from ..app_context import AppContext, ManagerPool, compile_app_context
+from ..utils import sha_256
+
+
+def test_app_context():
+    context = AppContext("https://example.com", ["https://login.example.com"])
+    assert context.app_param == sha_256(b"https://example.com")
+    assert context.is_trusted_origin("https://example.com")
+    assert context.is_trusted_origin("https://login.example.com")
+    assert not context.is_trusted_origin("https://evil.example.com")
+
+
+def test_compile_app_context_is_cached():
+    context = compile_app_context("https://example.com")
+    assert compile_app_context("https://example.com") is context
+    assert compile_app_context(context) is context
+
+
+def test_manager_pool():
+    created = []
+
+    def factory(context):
+        created.append(context)
+        return object()
+
+    pool = ManagerPool(factory, maxsize=2)
+    first = pool.get("https://a.example.com")
+    assert pool.get("https://a.example.com") is first
+    pool.get("https://b.example.com")
+    pool.get("https://c.example.com")
+    assert len(pool) == 2
+    assert pool.get("https://a.example.com") is not first
+    assert [c.app_id for c in created] == [
+        "https://a.example.com",
+        "https://b.example.com",
+        "https://c.example.com",
+        "https://a.example.com",
+    ]
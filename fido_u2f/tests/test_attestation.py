@@ -0,0 +1,95 @@
+import pytest
+from cryptography.hazmat.primitives import serialization
+
+from ..attestation import AttestationTrustStore, is_ca, load_pem_certificates
+from ..exceptions import U2FInvalidDataException
+from ..registration import RegistrationData
+from ..utils import websafe_decode
+from ..soft_u2f import (
+    SoftU2FToken,
+    create_attestation_certificate,
+    create_ca_certificate,
+)
+
+APP_ID = "https://example.com"
+
+
+@pytest.fixture(scope="module")
+def root():
+    return create_ca_certificate("Root CA")
+
+
+@pytest.fixture(scope="module")
+def intermediate(root):
+    return create_ca_certificate("Intermediate CA", issuer=root)
+
+
+def registration_data(attestation):
+    token = SoftU2FToken(attestation=attestation)
+    response = token.register(APP_ID, "challenge")
+    return RegistrationData(websafe_decode(response["registrationData"]))
+
+
+def pem(*certificates):
+    return b"".join(
+        cert.public_bytes(serialization.Encoding.PEM) for _, cert in certificates
+    )
+
+
+def test_load_pem_certificates(root, intermediate):
+    certificates = load_pem_certificates(b"# A bundle\n" + pem(root, intermediate))
+    assert certificates == [root[1], intermediate[1]]
+
+
+def test_trusted_through_intermediate(root, intermediate):
+    store = AttestationTrustStore([root[1]], [intermediate[1]])
+    data = registration_data(create_attestation_certificate(issuer=intermediate))
+    store.verify(data)
+    assert store.verdicts.stats().misses == 1
+    store.verify(data)
+    assert store.verdicts.stats().hits == 1
+
+
+def test_untrusted(root, intermediate):
+    store = AttestationTrustStore([root[1]])
+    # The intermediate isn't known; so the chain can't be completed.
+    data = registration_data(create_attestation_certificate(issuer=intermediate))
+    with pytest.raises(U2FInvalidDataException):
+        store.verify(data)
+    with pytest.raises(U2FInvalidDataException):
+        store.verify(registration_data(create_attestation_certificate()))
+
+
+def test_forged_issuer_name(root):
+    # Same subject name as the root, but a different key.
+    forged_root = create_ca_certificate("Root CA")
+    store = AttestationTrustStore([root[1]])
+    data = registration_data(create_attestation_certificate(issuer=forged_root))
+    assert not store.is_trusted(data.get_x509_certificate())
+
+
+def test_from_directory(tmp_path, root, intermediate):
+    (tmp_path / "root.pem").write_bytes(pem(root))
+    (tmp_path / "intermediate.crt").write_bytes(pem(intermediate))
+    (tmp_path / "README").write_bytes(b"Not a certificate")
+    store = AttestationTrustStore.from_directory(tmp_path)
+    data = registration_data(create_attestation_certificate(issuer=intermediate))
+    store.verify(data)
+    store = AttestationTrustStore.from_pem_files([tmp_path / "root.pem"])
+    with pytest.raises(U2FInvalidDataException):
+        store.verify(data)
+
+
+def test_issuers_must_be_cas(tmp_path, root):
+    # A leaf certificate, signed by the root, can't issue certificates.
+    leaf = create_attestation_certificate(issuer=root)
+    assert is_ca(root[1]) and not is_ca(leaf[1])
+    data = registration_data(create_attestation_certificate(issuer=leaf))
+    store = AttestationTrustStore([root[1]], [leaf[1]])
+    assert not store.is_trusted(data.get_x509_certificate())
+    # Nor can a self-signed one, in a directory.
+    self_signed = create_attestation_certificate()
+    (tmp_path / "leaf.pem").write_bytes(pem(self_signed))
+    store = AttestationTrustStore.from_directory(tmp_path)
+    data = registration_data(create_attestation_certificate(issuer=self_signed))
+    assert not store.is_trusted(data.get_x509_certificate())
@@ -0,0 +1,156 @@
+import io
+import json
+import tracemalloc
+
+import pytest
+
+from .. import bulk
+from ..device import DeviceRecord
+from ..enums import U2FTransport
+from ..exceptions import U2FInvalidDataException
+from ..soft_u2f import SoftU2FToken
+
+APP_ID = "https://example.com"
+
+
+def make_record(index, transports=U2FTransport.USB.value):
+    return DeviceRecord(
+        "U2F_V2",
+        APP_ID,
+        index.to_bytes(4, "big") * 16,
+        b"\x04" + index.to_bytes(4, "big") * 16,
+        index,
+        transports,
+    )
+
+
+def generate(count):
+    for i in range(count):
+        yield "user{}".format(i // 3), make_record(i)
+
+
+class ListSink(bulk.DeviceSink):
+    def __init__(self):
+        self.batches = []
+
+    def write_batch(self, devices):
+        self.batches.append(list(devices))
+
+
+class CountingFile:
+    """Discards everything written to it."""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+
+def test_jsonl_round_trip():
+    token = SoftU2FToken()
+    token.register(APP_ID, "challenge")
+    (key_handle,) = token.keys
+    devices = [("alice", token.device(key_handle, counter=5))] + list(generate(10))
+    devices.append(("bob", make_record(99, transports=-1)))
+    f = io.StringIO()
+    assert bulk.write_jsonl(devices, f) == 12
+    lines = f.getvalue().splitlines()
+    assert json.loads(lines[0])["transports"] == ["usb"]
+    assert json.loads(lines[-1])["transports"] is None
+    f.seek(0)
+    assert list(bulk.read_jsonl(f)) == [
+        (owner, DeviceRecord.from_device(device)) for owner, device in devices
+    ]
+
+
+def test_binary_round_trip():
+    devices = list(generate(10))
+    f = io.BytesIO()
+    assert bulk.write_binary(devices, f) == 10
+    f.seek(0)
+    assert list(bulk.read_binary(f)) == devices
+
+
+def test_jsonl_invalid_devices():
+    f = io.StringIO()
+    bulk.write_jsonl(generate(3), f)
+    lines = f.getvalue().splitlines()
+    bad_key = json.loads(lines[1])
+    bad_key["publicKey"] = "AAAA"
+    lines[1] = json.dumps(bad_key)
+    lines.insert(2, "not json")
+    text = "\n".join(lines) + "\n"
+
+    with pytest.raises(U2FInvalidDataException, match="Device 1: "):
+        list(bulk.read_jsonl(io.StringIO(text)))
+    errors = []
+    devices = list(
+        bulk.read_jsonl(
+            io.StringIO(text), on_invalid=lambda i, e: errors.append((i, e.args[0]))
+        )
+    )
+    assert devices == [("user0", make_record(0)), ("user0", make_record(2))]
+    assert errors == [
+        (1, "Device public key is not a P-256 point"),
+        (2, "Device is not valid JSON"),
+    ]
+
+
+def test_binary_invalid_and_truncated():
+    f = io.BytesIO()
+    bulk.write_binary(
+        [("a", make_record(0)), ("b", DeviceRecord("U2F_V1", APP_ID, b"k", b"p"))], f
+    )
+    data = f.getvalue()
+    errors = []
+    devices = list(
+        bulk.read_binary(io.BytesIO(data), on_invalid=lambda i, e: errors.append(i))
+    )
+    assert devices == [("a", make_record(0))]
+    assert errors == [1]
+    with pytest.raises(U2FInvalidDataException, match="truncated"):
+        list(bulk.read_binary(io.BytesIO(data[:-1]), on_invalid=lambda i, e: None))
+    with pytest.raises(U2FInvalidDataException):
+        bulk.read_binary(io.BytesIO(b"U2FD\x01\0\0\0"))
+
+
+def test_import_devices_in_batches():
+    sink = ListSink()
+    assert bulk.import_devices(generate(25), sink, batch_size=10) == 25
+    assert [len(batch) for batch in sink.batches] == [10, 10, 5]
+    assert sink.batches[2][-1] == ("user8", make_record(24))
+
+
+def test_export_runs_in_constant_memory():
+    def peak_memory(count):
+        tracemalloc.start()
+        try:
+            out = CountingFile()
+            bulk.write_jsonl(generate(count), out)
+            return tracemalloc.get_traced_memory()[1], out.size
+        finally:
+            tracemalloc.stop()
+
+    small, _ = peak_memory(500)
+    large, size = peak_memory(10000)
+    assert size > 10000 * 200
+    # Far less than the output, and barely more than a twentieth as many devices.
+    assert large < small * 2
+
+
+@pytest.mark.parametrize("field", ["appId", "version"])
+def test_jsonl_fields_must_be_strings(field):
+    f = io.StringIO()
+    bulk.write_jsonl(generate(1), f)
+    data = json.loads(f.getvalue())
+    data[field] = 5
+    errors = []
+    devices = list(
+        bulk.read_jsonl(
+            io.StringIO(json.dumps(data)),
+            on_invalid=lambda i, e: errors.append((i, e.args[0])),
+        )
+    )
+    assert devices == []
+    assert errors == [(0, "Device is missing or has invalid fields")]
@@ -0,0 +1,53 @@
+import pytest
+
+from ..cache import LRUCache
+
+
+def test_get_put():
+    cache = LRUCache(2)
+    assert cache.get("a") is None
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    assert cache.stats() == (1, 1, 0, 1, 2)
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert "a" in cache
+    assert "b" not in cache
+    assert cache.stats().evictions == 1
+
+
+def test_get_or_create():
+    cache = LRUCache(2)
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return "value"
+
+    assert cache.get_or_create("a", factory) == "value"
+    assert cache.get_or_create("a", factory) == "value"
+    assert len(calls) == 1
+
+
+def test_disabled():
+    cache = LRUCache(0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_resize_evicts():
+    cache = LRUCache(3)
+    for key in "abc":
+        cache.put(key, key)
+    cache.resize(1)
+    assert len(cache) == 1
+    assert "c" in cache
+    with pytest.raises(ValueError):
+        cache.resize(-1)
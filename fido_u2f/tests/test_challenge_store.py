@@ -0,0 +1,59 @@
+import pytest
+
+from ..challenge_store import MemoryChallengeStore, SQLiteChallengeStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, clock, tmp_path):
+    if request.param == "memory":
+        return MemoryChallengeStore(ttl=60, clock=clock)
+    return SQLiteChallengeStore(str(tmp_path / "challenges.db"), ttl=60, clock=clock)
+
+
+def test_put_pop(store):
+    ticket = store.put("challenge")
+    assert len(ticket) < len("challenge" * 3)
+    assert store.pop(ticket) == "challenge"
+    assert store.pop(ticket) is None
+
+
+def test_unknown_ticket(store):
+    assert store.pop("unknown") is None
+
+
+def test_expiry(store, clock):
+    old = store.put("old")
+    clock.now += 30
+    new = store.put("new")
+    clock.now += 31
+    assert store.pop(old) is None
+    assert store.pop(new) == "new"
+
+
+def test_memory_store_is_bounded(clock):
+    store = MemoryChallengeStore(ttl=60, maxsize=4, shards=2, clock=clock)
+    tickets = [store.put(str(i)) for i in range(20)]
+    assert len(store) <= 4
+    assert store.pop(tickets[0]) is None
+
+
+def test_memory_store_expires_without_lookups(clock):
+    store = MemoryChallengeStore(ttl=60, shards=1, clock=clock)
+    for i in range(10):
+        store.put(str(i))
+    clock.now += 61
+    store.put("new")
+    assert len(store) == 1
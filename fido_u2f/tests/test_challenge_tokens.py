@@ -0,0 +1,198 @@
+import pytest
+
+from .. import utils
+from ..challenge_tokens import ChallengeTokens, MemoryReplayGuard
+from ..exceptions import U2FInvalidDataException, U2FStateException
+from ..registration import U2FRegistrationManager
+from ..soft_u2f import SoftU2FToken
+from ..utils import websafe_decode, websafe_encode
+from ..verification import U2FSigningManager
+
+APP_ID = "https://example.com"
+KEY_1 = b"1" * 32
+KEY_2 = b"2" * 32
+
+
+class Clock:
+    def __init__(self, now=1000000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class Manager(U2FRegistrationManager, U2FSigningManager):
+    def create_device_registration_model(self, **kwargs):
+        raise NotImplementedError
+
+    def update_device_registration_counter(self, *, device, counter):
+        device.counter = counter
+        return device
+
+
+def test_issue_and_verify():
+    tokens = ChallengeTokens({1: KEY_1})
+    token = tokens.issue(APP_ID, "signing", "alice")
+    assert len(websafe_decode(token)) == 42
+    tokens.verify(token, APP_ID, "signing", "alice")
+    # Without a replay guard, tokens can be reused until they expire.
+    tokens.verify(token, APP_ID, "signing", "alice")
+    for args in [
+        ("https://other.example.com", "signing", "alice"),
+        (APP_ID, "registration", "alice"),
+        (APP_ID, "signing", "bob"),
+    ]:
+        with pytest.raises(U2FInvalidDataException):
+            tokens.verify(token, *args)
+
+
+@pytest.mark.parametrize(
+    "token",
+    ["", "not base64!", websafe_encode(b"\x01" * 42), websafe_encode(b"\x01" * 10)],
+)
+def test_invalid(token):
+    with pytest.raises(U2FInvalidDataException):
+        ChallengeTokens({1: KEY_1}).verify(token, APP_ID, "signing")
+
+
+def test_tampered():
+    tokens = ChallengeTokens({1: KEY_1})
+    data = bytearray(websafe_decode(tokens.issue(APP_ID, "signing")))
+    data[5] ^= 1
+    with pytest.raises(U2FInvalidDataException):
+        tokens.verify(websafe_encode(bytes(data)), APP_ID, "signing")
+
+
+def test_expiry():
+    clock = Clock()
+    tokens = ChallengeTokens({1: KEY_1}, ttl=60, clock=clock)
+    token = tokens.issue(APP_ID, "signing")
+    clock.now += 59
+    tokens.verify(token, APP_ID, "signing")
+    clock.now += 1
+    with pytest.raises(U2FInvalidDataException, match="expired"):
+        tokens.verify(token, APP_ID, "signing")
+    # Issued too far in the future.
+    clock.now -= 3600
+    with pytest.raises(U2FInvalidDataException, match="expired"):
+        tokens.verify(token, APP_ID, "signing")
+
+
+def test_key_rotation():
+    old = ChallengeTokens({1: KEY_1})
+    token = old.issue(APP_ID, "signing")
+    # The new key is added, then made current; the old key still verifies.
+    rotated = ChallengeTokens({1: KEY_1, 2: KEY_2})
+    assert rotated.current_key_id == 2
+    rotated.verify(token, APP_ID, "signing")
+    ChallengeTokens({1: KEY_1, 2: KEY_2}, 1).verify(
+        rotated.issue(APP_ID, "signing"), APP_ID, "signing"
+    )
+    # Once it is removed, its tokens are invalid.
+    with pytest.raises(U2FInvalidDataException):
+        ChallengeTokens({2: KEY_2}).verify(token, APP_ID, "signing")
+
+
+def test_invalid_keys():
+    for keys, current in [({}, None), ({256: KEY_1}, None), ({1: b"short"}, None)]:
+        with pytest.raises(ValueError):
+            ChallengeTokens(keys, current)
+    with pytest.raises(ValueError):
+        ChallengeTokens({1: KEY_1}, 2)
+
+
+def test_replay_guard():
+    clock = Clock()
+    guard = MemoryReplayGuard(maxsize=2, clock=clock)
+    tokens = ChallengeTokens({1: KEY_1}, ttl=60, replay_guard=guard, clock=clock)
+    token = tokens.issue(APP_ID, "signing")
+    tokens.verify(token, APP_ID, "signing")
+    with pytest.raises(U2FInvalidDataException, match="already used"):
+        tokens.verify(token, APP_ID, "signing")
+    for _ in range(3):
+        tokens.verify(tokens.issue(APP_ID, "signing"), APP_ID, "signing")
+    assert len(guard) == 2
+    # Expired nonces are forgotten.
+    clock.now += 60
+    assert guard.first_use(b"nonce", clock.now + 60)
+    assert len(guard) == 1
+
+
+def test_managers_share_tokens():
+    # Two processes with the same key; and no shared session.
+    token = SoftU2FToken()
+    token.register(APP_ID, "challenge")
+    (key_handle,) = token.keys
+    device = token.device(key_handle)
+    guard = MemoryReplayGuard()
+    issuer = Manager(APP_ID, challenge_tokens=ChallengeTokens({1: KEY_1}))
+    verifier = Manager(
+        APP_ID, challenge_tokens=ChallengeTokens({1: KEY_1}, replay_guard=guard)
+    )
+    session = {Manager.CHALLENGE_BINDING_KEY: "alice"}
+    challenge = issuer.create_signing_challenge(session, [device])["challenge"]
+    assert session == {Manager.CHALLENGE_BINDING_KEY: "alice"}
+    response = token.sign(APP_ID, challenge, key_handle)
+    with pytest.raises(U2FInvalidDataException):
+        verifier.process_signing_response(
+            {Manager.CHALLENGE_BINDING_KEY: "bob"}, response, [device]
+        )
+    assert verifier.process_signing_response(dict(session), response, [device])
+    with pytest.raises(U2FInvalidDataException, match="already used"):
+        verifier.process_signing_response(dict(session), response, [device])
+
+
+def test_manager_token_for_another_step():
+    token = SoftU2FToken()
+    manager = Manager(APP_ID, challenge_tokens=ChallengeTokens({1: KEY_1}))
+    session = {Manager.CHALLENGE_BINDING_KEY: "alice"}
+    request = manager.create_registration_challenge(session)
+    challenge = request["registerRequests"][0]["challenge"]
+    response = token.register(APP_ID, challenge)
+    assert manager.verify_registration_response(session, response)
+    (key_handle,) = token.keys
+    device = token.device(key_handle)
+    response = token.sign(APP_ID, challenge, key_handle)
+    with pytest.raises(U2FInvalidDataException):
+        manager.process_signing_response(session, response, [device])
+    response["clientData"] = websafe_encode(b'{"typ": "navigator.id.getAssertion"}')
+    with pytest.raises(U2FStateException):
+        manager.process_signing_response(session, response, [device])
+
+
+def test_manager_needs_binding():
+    token = SoftU2FToken()
+    manager = Manager(APP_ID, challenge_tokens=ChallengeTokens({1: KEY_1}))
+    with pytest.raises(U2FStateException, match="binding"):
+        manager.create_registration_challenge({})
+    with pytest.raises(U2FStateException, match="binding"):
+        manager.create_registration_challenge({Manager.CHALLENGE_BINDING_KEY: ""})
+    session = {Manager.CHALLENGE_BINDING_KEY: "alice"}
+    request = manager.create_registration_challenge(session)
+    response = token.register(APP_ID, request["registerRequests"][0]["challenge"])
+    with pytest.raises(U2FStateException, match="binding"):
+        manager.verify_registration_response({}, response)
+    assert manager.verify_registration_response(session, response)
+
+
+def test_client_data_decoded_once(monkeypatch):
+    decoded = []
+
+    def decode_client_data(raw_client_data):
+        decoded.append(raw_client_data)
+        return decode(raw_client_data)
+
+    decode = utils.decode_client_data
+    monkeypatch.setattr(utils, "decode_client_data", decode_client_data)
+    token = SoftU2FToken()
+    manager = Manager(APP_ID, challenge_tokens=ChallengeTokens({1: KEY_1}))
+    session = {Manager.CHALLENGE_BINDING_KEY: "alice"}
+    request = manager.create_registration_challenge(session)
+    response = token.register(APP_ID, request["registerRequests"][0]["challenge"])
+    manager.verify_registration_response(session, response)
+    (key_handle,) = token.keys
+    device = token.device(key_handle)
+    challenge = manager.create_signing_challenge(session, [device])["challenge"]
+    response = token.sign(APP_ID, challenge, key_handle)
+    manager.process_signing_response(session, response, [device])
+    assert len(decoded) == 2
@@ -0,0 +1,152 @@
+import time
+
+import pytest
+
+from ..counters import (
+    MemoryCounterStore,
+    SQLiteCounterStore,
+    WriteBehindCounterSink,
+    device_key,
+)
+from ..enums import U2FTransport
+from ..exceptions import U2FInvalidDataException
+from ..soft_u2f import SoftDevice
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_device(key_handle, counter=0):
+    return SoftDevice(
+        version="U2F_V2",
+        app_id="https://example.com",
+        key_handle=key_handle,
+        public_key=b"",
+        transports=[U2FTransport.USB],
+        counter=counter,
+    )
+
+
+def test_coalesces_and_flushes_on_size():
+    store = MemoryCounterStore()
+    sink = WriteBehindCounterSink(store, max_batch=2, max_delay=60, clock=Clock())
+    first = make_device(b"1")
+    sink.record(first, 1)
+    sink.record(first, 2)
+    assert len(sink) == 1
+    assert store.counters == {}
+    sink.record(make_device(b"2"), 1)
+    assert store.counters == {device_key(first): 2, (first.app_id, b"2"): 1}
+    assert sink.flushes == 1
+
+
+def test_flushes_on_time():
+    clock = Clock()
+    store = MemoryCounterStore()
+    sink = WriteBehindCounterSink(store, max_batch=100, max_delay=1, clock=clock)
+    sink.record(make_device(b"1"), 1)
+    assert not store.counters
+    clock.now += 1
+    sink.record(make_device(b"2"), 1)
+    assert len(store.counters) == 2
+
+
+def test_rejects_counter_that_did_not_increase():
+    sink = WriteBehindCounterSink(MemoryCounterStore())
+    device = make_device(b"1", counter=5)
+    with pytest.raises(U2FInvalidDataException):
+        sink.record(device, 5)
+    sink.record(device, 6)
+    with pytest.raises(U2FInvalidDataException):
+        sink.record(device, 6)
+
+
+def test_conflicts_between_workers(tmp_path):
+    conflicts = []
+    path = str(tmp_path / "counters.db")
+    device = make_device(b"1")
+    first = WriteBehindCounterSink(SQLiteCounterStore(path))
+    second = WriteBehindCounterSink(
+        SQLiteCounterStore(path), on_conflict=conflicts.extend
+    )
+    first.record(device, 10)
+    second.record(device, 4)
+    first.flush()
+    second.flush()
+    assert conflicts == [device_key(device)]
+    assert SQLiteCounterStore(path).get(device.app_id, device.key_handle) == 10
+
+
+def test_background_flush():
+    store = MemoryCounterStore()
+    sink = WriteBehindCounterSink(store, max_delay=0.01)
+    sink.start()
+    sink.record(make_device(b"1"), 1)
+    sink.close()
+    assert store.counters
+
+
+class FailingStore(MemoryCounterStore):
+    def __init__(self):
+        super().__init__()
+        self.failing = True
+        self.failures = 0
+
+    def compare_and_set(self, counters):
+        if self.failing:
+            self.failures += 1
+            raise ConnectionError("The store is down")
+        return super().compare_and_set(counters)
+
+
+def test_store_errors_keep_counters(caplog):
+    store = FailingStore()
+    sink = WriteBehindCounterSink(store, max_batch=1)
+    device = make_device(b"1")
+    # The failed flush doesn't fail the update; nor lose its counter.
+    sink.record(device, 1)
+    assert "Flushing device counters failed" in caplog.text
+    with pytest.raises(ConnectionError):
+        sink.flush()
+    store.failing = False
+    sink.flush()
+    assert store.counters == {device_key(device): 1}
+
+
+def test_background_flush_survives_store_errors():
+    store = FailingStore()
+    sink = WriteBehindCounterSink(store, max_delay=0.01)
+    sink.start()
+    sink.record(make_device(b"1"), 1)
+    deadline = time.monotonic() + 5
+    while not store.failures and time.monotonic() < deadline:
+        time.sleep(0.01)
+    store.failing = False
+    while not store.counters and time.monotonic() < deadline:
+        time.sleep(0.01)
+    sink.close()
+    assert store.failures
+    assert store.counters
+
+
+def test_checks_store_on_cache_miss(tmp_path, caplog):
+    path = str(tmp_path / "counters.db")
+    device = make_device(b"1")
+    first = WriteBehindCounterSink(SQLiteCounterStore(path))
+    first.record(device, 10)
+    first.flush()
+    # Another worker, or this one after a restart; the device's counter is 0.
+    second = WriteBehindCounterSink(SQLiteCounterStore(path))
+    with pytest.raises(U2FInvalidDataException):
+        second.record(device, 4)
+    second.record(device, 11)
+    # Conflicts are logged by default.
+    first.record(device, 11)
+    first.flush()
+    second.flush()
+    assert "may be cloned" in caplog.text
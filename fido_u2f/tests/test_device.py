@@ -0,0 +1,131 @@
+import pytest
+
+from ..device import (
+    DeviceIndex,
+    DeviceRecord,
+    client_dict_cache,
+    device_as_client_dict,
+    filter_devices_by_app_id,
+)
+from ..enums import U2FTransport
+from ..exceptions import U2FInvalidDataException
+from ..soft_u2f import SoftDevice
+
+
+def make_device(app_id, key_handle):
+    return SoftDevice(
+        version="U2F_V2",
+        app_id=app_id,
+        key_handle=key_handle,
+        public_key=b"\x04" + b"\0" * 64,
+        transports=[U2FTransport.USB],
+    )
+
+
+def test_filter_devices_by_app_id_is_reusable():
+    devices = [make_device("a", b"1"), make_device("b", b"2")]
+    filtered = filter_devices_by_app_id(devices, "c")
+    assert not filtered
+    filtered = filter_devices_by_app_id(devices, "a")
+    assert list(filtered) == list(filtered) == devices[:1]
+
+
+def test_transports_from_byte():
+    for byte in range(256):
+        transports = U2FTransport.from_byte(byte)
+        assert transports == [t for t in U2FTransport if t.value & byte]
+        assert U2FTransport.set_from_byte(byte) == set(transports)
+        assert U2FTransport.to_byte(transports) == byte & 0xF8
+        assert U2FTransport.names_from_byte(byte) == tuple(
+            sorted(t.internal_name for t in transports)
+        )
+    assert U2FTransport.from_byte(0x30) is not U2FTransport.from_byte(0x30)
+    assert U2FTransport.set_from_byte(0x30) is U2FTransport.set_from_byte(0x30)
+    assert U2FTransport.USB.internal_name == "usb"
+
+
+def test_device_as_client_dict():
+    client_dict_cache.clear()
+    device = make_device("a", b"\x01\x02")
+    device.u2f_transports = [U2FTransport.USB, U2FTransport.NFC]
+    expected = {
+        "version": "U2F_V2",
+        "appId": "a",
+        "keyHandle": "AQI",
+        "transports": ["nfc", "usb"],
+    }
+    hits = client_dict_cache.stats().hits
+    first = device_as_client_dict(device)
+    assert first == expected
+    first["extra"] = True
+    first["transports"].append("ble")
+    assert device_as_client_dict(device) == expected
+    assert client_dict_cache.stats().hits == hits + 1
+    # The same device; as a record.
+    assert device_as_client_dict(DeviceRecord.from_device(device)) == expected
+    assert client_dict_cache.stats().hits == hits + 2
+    device.u2f_transports = None
+    assert device_as_client_dict(device)["transports"] is None
+    assert len(client_dict_cache) == 2
+    assert device_as_client_dict(make_device("b", b"1"), cache=False)
+    assert len(client_dict_cache) == 2
+
+
+class TestDeviceIndex:
+    def test_collection(self):
+        devices = [make_device("a", b"1"), make_device("b", b"2")]
+        index = DeviceIndex(devices)
+        assert len(index) == 2
+        assert list(index) == devices
+        assert devices[0] in index
+
+    def test_lookup(self):
+        devices = [
+            make_device("a", b"1"),
+            make_device("a", b"2"),
+            make_device("b", b"1"),
+        ]
+        index = DeviceIndex(devices)
+        assert index.get_device("a", b"2") is devices[1]
+        assert index.get_device("b", bytearray(b"1")) is devices[2]
+        assert index.get_device("b", b"2") is None
+        assert list(index.devices_for_app_id("a")) == devices[:2]
+        assert filter_devices_by_app_id(index, "c") == ()
+
+
+class TestDeviceRecord:
+    def test_from_device(self):
+        record = DeviceRecord.from_device(make_device("a", b"1"))
+        assert record.transports == U2FTransport.USB.value
+        assert record.u2f_transports == [U2FTransport.USB]
+        assert not hasattr(record, "__dict__")
+
+    def test_transports(self):
+        record = DeviceRecord("U2F_V2", "a", b"1", b"2")
+        assert record.u2f_transports is None
+        record.u2f_transports = [U2FTransport.NFC, U2FTransport.USB]
+        assert record.transports == 0x30
+
+    @pytest.mark.parametrize("transports", [-1, 0, 0xF8])
+    def test_round_trip(self, transports):
+        record = DeviceRecord(
+            "U2F_V2", "https://ex\u00e4mple.com", b"k" * 64, b"p" * 65, 2 ** 32 - 1
+        )
+        record.transports = transports
+        assert DeviceRecord.from_bytes(record.to_bytes()) == record
+
+    def test_unpack_from(self):
+        first = DeviceRecord("U2F_V2", "a", b"1", b"2", 1)
+        second = DeviceRecord("U2F_V2", "b", b"3", b"4", 2)
+        data = memoryview(first.to_bytes() + second.to_bytes())
+        record, offset = DeviceRecord.unpack_from(data)
+        assert record == first
+        record, offset = DeviceRecord.unpack_from(data, offset)
+        assert record == second
+        assert offset == len(data)
+
+    def test_invalid(self):
+        data = DeviceRecord("U2F_V2", "a", b"1", b"2", 1).to_bytes()
+        for invalid in [data[:5], data[:-1], data + b"\0", b"\2" + data[1:]]:
+            with pytest.raises(U2FInvalidDataException):
+                DeviceRecord.from_bytes(invalid)
@@ -0,0 +1,194 @@
+import pytest
+
+from ..soft_u2f import SoftDevice, SoftU2FToken
+from ..utils import websafe_encode
+
+flask = pytest.importorskip("flask")
+flask_ext = pytest.importorskip("fido_u2f.flask_ext")
+
+APP_ID = "https://example.com"
+
+
+class DeviceStore(flask_ext.U2FDeviceStore):
+    def __init__(self):
+        self.devices = {}
+        self.loads = 0
+        self.verified = []
+
+    def current_user(self):
+        return flask.session.get("user_id")
+
+    def load_devices(self, user_id):
+        self.loads += 1
+        return list(self.devices.get(user_id, []))
+
+    def devices_version(self, user_id):
+        return len(self.devices.get(user_id, []))
+
+    def page_devices(self, user_id, offset, limit):
+        devices = self.devices.get(user_id, [])
+        return len(devices), devices[offset : offset + limit]
+
+    def add_device(self, user_id, **kwargs):
+        device = SoftDevice(**kwargs)
+        self.devices.setdefault(user_id, []).append(device)
+        return device
+
+    def update_counter(self, device, counter):
+        device.counter = counter
+        return device
+
+    def device_verified(self, user_id, device):
+        self.verified.append((user_id, device.key_handle))
+
+
+@pytest.fixture
+def store():
+    return DeviceStore()
+
+
+def create_app(store):
+    app = flask.Flask(__name__)
+    app.config["SECRET_KEY"] = "test"
+    app.config["U2F_APP_ID"] = APP_ID
+    flask_ext.FlaskU2F(app, store=store)
+    return app
+
+
+@pytest.fixture
+def client(store):
+    with create_app(store).test_client() as client:
+        with client.session_transaction() as session:
+            session["user_id"] = "alice"
+        yield client
+
+
+def register(client, token):
+    request = client.get("/u2f/register").get_json()
+    response = token.register(APP_ID, request["registerRequests"][0]["challenge"])
+    return client.post("/u2f/register", json=response)
+
+
+def test_register_and_sign(client, store):
+    token = SoftU2FToken()
+    resp = register(client, token)
+    assert resp.status_code == 201
+    (key_handle,) = token.keys
+    assert resp.get_json()["keyHandle"] == websafe_encode(key_handle)
+    assert len(store.devices["alice"]) == 1
+
+    resp = client.get("/u2f/sign")
+    assert resp.headers["Cache-Control"] == "no-store"
+    request = resp.get_json()
+    assert [key["keyHandle"] for key in request["registeredKeys"]] == [
+        websafe_encode(key_handle)
+    ]
+    response = token.sign(APP_ID, request["challenge"], key_handle)
+    resp = client.post("/u2f/sign", json=response)
+    assert resp.get_json() == {"keyHandle": websafe_encode(key_handle), "counter": 1}
+    assert store.verified == [("alice", key_handle)]
+    # The challenge was used.
+    resp = client.post("/u2f/sign", json=response)
+    assert resp.status_code == 400
+    assert "error" in resp.get_json()
+
+
+def test_key_list_cached(client, store):
+    token = SoftU2FToken()
+    client.get("/u2f/register")
+    client.get("/u2f/register")
+    assert store.loads == 1
+    register(client, token)
+    # The new device invalidated the list.
+    assert len(client.get("/u2f/sign").get_json()["registeredKeys"]) == 1
+    assert store.loads == 2
+
+
+def test_key_list_other_worker(client, store):
+    # Another process; with a cache of its own.
+    other = create_app(store).test_client()
+    with other.session_transaction() as session:
+        session["user_id"] = "alice"
+    register(other, SoftU2FToken())
+    assert len(other.get("/u2f/sign").get_json()["registeredKeys"]) == 1
+    register(client, SoftU2FToken())
+    assert len(other.get("/u2f/sign").get_json()["registeredKeys"]) == 2
+
+
+def test_key_list_not_cached_without_version(client, store):
+    store.devices_version = lambda user_id: None
+    client.get("/u2f/register")
+    client.get("/u2f/register")
+    assert store.loads == 2
+
+
+def test_errors(client):
+    resp = client.get("/u2f/sign")
+    assert resp.status_code == 404
+    assert resp.get_json() == {"error": "No devices are registered."}
+    resp = client.post("/u2f/register", data="{not json")
+    assert resp.status_code == 400
+    with client.session_transaction() as session:
+        del session["user_id"]
+    assert client.get("/u2f/register").status_code == 401
+
+
+@pytest.mark.parametrize(
+    "path, field, value",
+    [
+        ("/u2f/sign", "keyHandle", "!!!"),
+        ("/u2f/sign", "keyHandle", 5),
+        ("/u2f/sign", "signatureData", "!!!"),
+        ("/u2f/register", "registrationData", 5),
+        ("/u2f/register", "registrationData", "!!!"),
+    ],
+)
+def test_malformed_bodies(client, path, field, value):
+    token = SoftU2FToken()
+    register(client, token)
+    (key_handle,) = token.keys
+    if path == "/u2f/sign":
+        challenge = client.get(path).get_json()["challenge"]
+        response = token.sign(APP_ID, challenge, key_handle)
+    else:
+        request = client.get(path).get_json()
+        response = token.register(APP_ID, request["registerRequests"][0]["challenge"])
+    response[field] = value
+    resp = client.post(path, json=response)
+    assert resp.status_code == 400
+    assert "error" in resp.get_json()
+
+
+def test_devices_paginated(client, store):
+    store.devices["alice"] = [
+        SoftDevice(
+            version="U2F_V2",
+            app_id=APP_ID,
+            key_handle=bytes([i]) * 64,
+            public_key=b"",
+            transports=None,
+            counter=i,
+        )
+        for i in range(5)
+    ]
+    resp = client.get("/u2f/devices?page=2&per_page=2")
+    data = resp.get_json()
+    assert (data["page"], data["perPage"], data["total"]) == (2, 2, 5)
+    assert [device["counter"] for device in data["devices"]] == [2, 3]
+    resp = client.get(
+        "/u2f/devices?page=2&per_page=2",
+        headers={"If-None-Match": resp.headers["ETag"]},
+    )
+    assert resp.status_code == 304
+    data = client.get("/u2f/devices?per_page=1000").get_json()
+    assert data["perPage"] == flask_ext.FlaskU2F.MAX_DEVICES_PER_PAGE
+
+
+def test_script(client):
+    resp = client.get("/u2f/u2f.js")
+    assert resp.status_code == 200
+    assert b"fidoU2F" in resp.data
+    assert "max-age" in resp.headers["Cache-Control"]
+    resp = client.get("/u2f/u2f.js", headers={"If-None-Match": resp.headers["ETag"]})
+    assert resp.status_code == 304
+    assert resp.data == b""
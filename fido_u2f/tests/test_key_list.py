@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+from ..key_list import KeyListCache, RenderedKeyList
+from ..registration import U2FRegistrationManager
+from ..soft_u2f import SoftU2FToken
+from ..verification import U2FSigningManager
+
+APP_ID = "https://example.com"
+
+
+class Manager(U2FRegistrationManager, U2FSigningManager):
+    def create_device_registration_model(self, **kwargs):
+        raise NotImplementedError
+
+    def update_device_registration_counter(self, **kwargs):
+        raise NotImplementedError
+
+
+@pytest.fixture
+def devices():
+    token = SoftU2FToken(seed=1)
+    for _ in range(3):
+        token.register(APP_ID, "challenge")
+    token.register("https://other.example.com", "challenge")
+    return [token.device(key_handle) for key_handle in token.keys]
+
+
+def without_challenge(data):
+    if "challenge" in data:
+        data["challenge"] = None
+    else:
+        data["registerRequests"][0]["challenge"] = None
+    return data
+
+
+def test_signing_challenge_json(devices):
+    manager = Manager(APP_ID)
+    session = {}
+    key_list = RenderedKeyList(APP_ID, devices)
+    assert len(key_list) == 3
+    data = json.loads(manager.create_signing_challenge_json(session, key_list))
+    assert data["challenge"] == session[manager.SIGNING_SESSION_KEY]
+    expected = manager.create_signing_challenge({}, devices)
+    assert without_challenge(data) == without_challenge(dict(expected))
+
+
+def test_registration_challenge_json(devices):
+    manager = Manager(APP_ID)
+    session = {}
+    key_list = RenderedKeyList(APP_ID, devices)
+    data = json.loads(manager.create_registration_challenge_json(session, key_list))
+    challenge = data["registerRequests"][0]["challenge"]
+    assert challenge == session[manager.REGISTRATION_SESSION_KEY]
+    expected = manager.create_registration_challenge({}, devices)
+    assert without_challenge(data) == without_challenge(dict(expected))
+
+
+def test_challenge_json_checks_key_list(devices):
+    manager = Manager(APP_ID)
+    with pytest.raises(ValueError):
+        manager.create_signing_challenge_json({}, RenderedKeyList(APP_ID, []))
+    other = RenderedKeyList("https://other.example.com", devices)
+    with pytest.raises(ValueError):
+        manager.create_registration_challenge_json({}, other)
+    # Registering the first device is fine.
+    manager.create_registration_challenge_json({}, RenderedKeyList(APP_ID, []))
+
+
+def test_etag(devices):
+    key_list = RenderedKeyList(APP_ID, devices)
+    assert RenderedKeyList(APP_ID, list(devices)).etag == key_list.etag
+    # Counters aren't part of the keys.
+    devices[0].counter += 1
+    assert RenderedKeyList(APP_ID, devices).etag == key_list.etag
+    assert RenderedKeyList(APP_ID, devices[1:]).etag != key_list.etag
+
+
+def test_key_list_cache(devices):
+    cache = KeyListCache()
+    loads = []
+
+    def load_devices():
+        loads.append(1)
+        return devices
+
+    key_list = cache.get("alice", APP_ID, load_devices)
+    assert cache.get("alice", APP_ID, load_devices) is key_list
+    assert len(loads) == 1
+    cache.invalidate("alice", APP_ID)
+    assert cache.get("alice", APP_ID, load_devices) is not key_list
+    assert len(loads) == 2
+    # A new version replaces the cached list.
+    versioned = cache.get("alice", APP_ID, load_devices, version=2)
+    assert versioned.version == 2
+    assert cache.get("alice", APP_ID, load_devices, version=2) is versioned
+    assert len(loads) == 3
@@ -0,0 +1,163 @@
+import gc
+import threading
+import urllib.request
+
+import pytest
+
+from .. import metrics, tracing
+from ..exceptions import U2FInvalidDataException, U2FStateException
+from ..soft_u2f import SoftU2FToken
+from .test_verification import SigningManager
+
+APP_ID = "https://example.com"
+
+
+class FakeClock:
+    def __init__(self, step):
+        self.now = 0.0
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+
+@pytest.fixture
+def registry():
+    return metrics.MetricsRegistry(buckets=(0.001, 0.01, 0.1))
+
+
+def test_failure_reason():
+    assert (
+        metrics.failure_reason(U2FInvalidDataException("Invalid or missing origin"))
+        == "invalid_or_missing_origin"
+    )
+    assert (
+        metrics.failure_reason(U2FStateException("Session missing required key."))
+        == "session_missing_required_key"
+    )
+    assert metrics.failure_reason(KeyError("keyHandle")) == "KeyError"
+
+
+def test_histogram_buckets(registry):
+    for value in (0.0005, 0.001, 0.005, 0.05, 5):
+        registry.observe("latency", value)
+    histogram = registry.snapshot().histogram("latency")
+    assert histogram.counts == [2, 1, 1, 1]
+    assert histogram.cumulative_counts() == [2, 3, 4, 5]
+    assert histogram.count == 5
+    assert histogram.sum == pytest.approx(5.0565)
+
+
+def test_shards_are_combined(registry):
+    def record():
+        for _ in range(1000):
+            registry.increment("requests", (("app", "a"),))
+            registry.observe("latency", 0.002)
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    snapshot = registry.snapshot()
+    assert snapshot.counter("requests", app="a") == 4000
+    assert snapshot.histogram("latency").counts == [0, 4000, 0, 0]
+
+
+def test_tracer_records_stages_and_failures(registry):
+    tracer = metrics.MetricsTracer(registry, clock=FakeClock(0.002))
+    manager = SigningManager(APP_ID, tracer=tracer)
+    token = SoftU2FToken()
+    token.register(APP_ID, "challenge")
+    (key_handle,) = token.keys
+    devices = [token.device(key_handle)]
+
+    session = {}
+    request = manager.create_signing_challenge(session, devices)
+    manager.process_signing_response(
+        session, token.sign(APP_ID, request["challenge"], key_handle), devices
+    )
+    with pytest.raises(U2FStateException):
+        manager.process_signing_response(
+            {}, token.sign(APP_ID, "challenge", key_handle), devices
+        )
+
+    snapshot = registry.snapshot()
+    for stage in (tracing.CLIENT_DATA, tracing.VERIFY, tracing.STORE):
+        histogram = snapshot.histogram(metrics.STAGE_SECONDS, stage=stage)
+        assert histogram.counts == [0, 1, 0, 0]
+    # The key handle and the signature data of the first response; the second
+    #  has no challenge, so it isn't decoded.
+    assert snapshot.histogram(metrics.STAGE_SECONDS, stage=tracing.DECODE).count == 2
+    assert snapshot.histogram(metrics.STAGE_SECONDS, stage=tracing.SIGNING).count == 2
+    assert (
+        snapshot.counter(
+            metrics.STAGE_FAILURES,
+            stage=tracing.SIGNING,
+            reason="session_missing_required_key",
+        )
+        == 1
+    )
+    assert snapshot.counter(metrics.EVENTS, event=tracing.CHALLENGE_ISSUED) == 1
+    assert snapshot.counter(metrics.EVENTS, event=tracing.CHALLENGE_MISSING) == 1
+
+
+def test_failure_reasons_are_capped(registry):
+    tracer = metrics.MetricsTracer(registry, max_reasons=2)
+    for message in ("first", "second", "third", "first"):
+        with pytest.raises(U2FInvalidDataException):
+            with tracer.span(tracing.VERIFY):
+                raise U2FInvalidDataException(message)
+    snapshot = registry.snapshot()
+    counts = {
+        dict(labels)["reason"]: value
+        for (name, labels), value in snapshot.counters.items()
+        if name == metrics.STAGE_FAILURES
+    }
+    assert counts == {"first": 2, "second": 1, metrics.OTHER_REASON: 1}
+
+
+def test_exposition(registry):
+    registry.increment(metrics.EVENTS, (("event", 'say "hi"'),), 3)
+    registry.observe(metrics.STAGE_SECONDS, 0.005, (("stage", "verify"),))
+    assert registry.exposition() == (
+        "# TYPE u2f_events_total counter\n"
+        'u2f_events_total{event="say \\"hi\\""} 3\n'
+        "# TYPE u2f_stage_seconds histogram\n"
+        'u2f_stage_seconds_bucket{stage="verify",le="0.001"} 0\n'
+        'u2f_stage_seconds_bucket{stage="verify",le="0.01"} 1\n'
+        'u2f_stage_seconds_bucket{stage="verify",le="0.1"} 1\n'
+        'u2f_stage_seconds_bucket{stage="verify",le="+Inf"} 1\n'
+        'u2f_stage_seconds_sum{stage="verify"} 0.005\n'
+        'u2f_stage_seconds_count{stage="verify"} 1\n'
+    )
+
+
+def test_serve_metrics(registry):
+    registry.increment("requests")
+    server = metrics.serve_metrics(registry, port=0)
+    try:
+        url = "http://127.0.0.1:{}/metrics".format(server.server_address[1])
+        with urllib.request.urlopen(url) as response:
+            assert response.read().decode("utf-8") == registry.exposition()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_finished_threads_are_retired(registry):
+    def record():
+        registry.increment("requests")
+        registry.observe("latency", 0.002)
+
+    for _ in range(20):
+        thread = threading.Thread(target=record)
+        thread.start()
+        thread.join()
+    gc.collect()
+    assert len(registry._shards) == 0
+    record()
+    snapshot = registry.snapshot()
+    assert snapshot.counter("requests") == 21
+    assert snapshot.histogram("latency").counts == [0, 21, 0, 0]
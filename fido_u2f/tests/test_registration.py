@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+from .. import registration
+from ..attestation import AttestationTrustStore
+from ..enums import U2FTransport
+from ..exceptions import U2FInvalidDataException, U2FStateException
+from ..utils import sha_256, websafe_decode
+from ..soft_u2f import SoftU2FToken
+
+APP_ID = "https://example.com"
+
+
+class RegistrationManager(registration.U2FRegistrationManager):
+    def create_device_registration_model(self, **kwargs):
+        return kwargs
+
+
+@pytest.fixture
+def token():
+    return SoftU2FToken()
+
+
+def test_parse_registration_data(token):
+    response = token.register(APP_ID, "challenge")
+    data = websafe_decode(response["registrationData"])
+    parsed = registration.RegistrationData(data)
+    (key_handle,) = token.keys
+    assert parsed.key_handle == key_handle
+    assert parsed.public_key == data[1:66]
+    assert len(parsed.certificate) + len(parsed.signature) == len(data) - 67 - 64
+
+
+def test_parse_truncated_registration_data(token):
+    data = websafe_decode(token.register(APP_ID, "challenge")["registrationData"])
+    with pytest.raises(U2FInvalidDataException):
+        registration.RegistrationData(data[:200])
+    with pytest.raises(U2FInvalidDataException):
+        registration.RegistrationData(b"\x04" + data[1:])
+
+
+def test_process_registration_response(token):
+    manager = RegistrationManager(APP_ID)
+    session = {}
+    challenge = manager.create_registration_challenge(session)["registerRequests"][0]
+    response = token.register(APP_ID, challenge["challenge"])
+    device = manager.process_registration_response(session, response)
+    (key_handle,) = token.keys
+    assert device["key_handle"] == key_handle
+    assert device["app_id"] == APP_ID
+    assert device["transports"] == [U2FTransport.USB]
+
+
+def test_process_registration_body(token):
+    manager = RegistrationManager(APP_ID)
+    session = {}
+    challenge = manager.create_registration_challenge(session)["registerRequests"][0]
+    response = token.register(APP_ID, challenge["challenge"])
+    body = json.dumps(response).encode("utf-8")
+    device = manager.process_registration_body(session, body)
+    assert device["key_handle"] == next(iter(token.keys))
+    with pytest.raises(U2FInvalidDataException):
+        manager.process_registration_body({}, b"[]")
+
+
+def test_process_registration_response_without_challenge(token):
+    manager = RegistrationManager(APP_ID)
+    response = token.register(APP_ID, "challenge")
+    with pytest.raises(U2FStateException):
+        manager.process_registration_response({}, response)
+
+
+def test_process_registration_response_wrong_challenge(token):
+    manager = RegistrationManager(APP_ID)
+    session = {}
+    manager.create_registration_challenge(session)
+    response = token.register(APP_ID, "challenge")
+    with pytest.raises(U2FInvalidDataException):
+        manager.process_registration_response(session, response)
+
+
+def test_registration_data_memoizes_certificate(token):
+    data = websafe_decode(token.register(APP_ID, "challenge")["registrationData"])
+    parsed = registration.RegistrationData(data)
+    cert = parsed.get_x509_certificate()
+    assert parsed.get_x509_certificate() is cert
+    assert parsed.get_attestation_public_key() is parsed.get_attestation_public_key()
+    assert parsed.fingerprint == sha_256(parsed.certificate)
+    assert parsed.get_supported_transports() is parsed.get_supported_transports()
+    assert parsed.get_supported_transports() == [U2FTransport.USB]
+
+
+def test_registration_data_without_transports():
+    token = SoftU2FToken(transports=None)
+    data = websafe_decode(token.register(APP_ID, "challenge")["registrationData"])
+    parsed = registration.RegistrationData(data)
+    assert parsed.get_supported_transports() is None
+    assert parsed.get_supported_transports() is None
+
+
+def test_process_registration_response_untrusted_attestation(token):
+    manager = RegistrationManager(
+        APP_ID, attestation_trust_store=AttestationTrustStore()
+    )
+    session = {}
+    challenge = manager.create_registration_challenge(session)["registerRequests"][0]
+    response = token.register(APP_ID, challenge["challenge"])
+    with pytest.raises(U2FInvalidDataException):
+        manager.process_registration_response(session, response)
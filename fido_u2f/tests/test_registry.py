@@ -0,0 +1,94 @@
+import os
+import stat
+
+import pytest
+
+from ..device import DeviceRecord
+from ..exceptions import U2FInvalidDataException
+from ..registry import MappedDeviceRegistry, build_device_registry
+from ..soft_u2f import SoftU2FToken
+from .test_verification import SigningManager
+
+APP_ID = "https://example.com"
+
+
+def make_record(app_id, key_handle, counter=0):
+    return DeviceRecord("U2F_V2", app_id, key_handle, b"\x04" * 65, counter, 0x20)
+
+
+@pytest.fixture
+def devices():
+    return [
+        ("alice", make_record(APP_ID, b"a1")),
+        ("alice", make_record(APP_ID, b"a2")),
+        ("alice", make_record("https://other.example.com", b"a1")),
+        ("bob", make_record(APP_ID, b"b1", counter=7)),
+    ] + [("user{}".format(i), make_record(APP_ID, bytes([i]) * 8)) for i in range(100)]
+
+
+@pytest.fixture
+def registry(tmp_path, devices):
+    path = str(tmp_path / "devices.u2fd")
+    assert build_device_registry(path, devices) == len(devices)
+    return MappedDeviceRegistry(path)
+
+
+def test_lookup(registry, devices):
+    assert len(registry) == len(devices)
+    for owner, device in devices:
+        assert registry.get_device(device.app_id, device.key_handle) == (owner, device)
+    assert registry.get_device(APP_ID, b"missing") is None
+    assert registry.get_device("https://missing.example.com", b"a1") is None
+
+
+def test_user_devices(registry):
+    alice = registry.for_user("alice")
+    assert len(alice) == 3
+    assert [d.key_handle for d in alice.devices_for_app_id(APP_ID)] == [b"a1", b"a2"]
+    assert alice.get_device(APP_ID, b"a2").key_handle == b"a2"
+    # Bob's device is in the registry; but not Alice's.
+    assert alice.get_device(APP_ID, b"b1") is None
+    assert len(registry.for_user("nobody")) == 0
+
+
+def test_reload(tmp_path, registry):
+    path = str(tmp_path / "devices.u2fd")
+    build_device_registry(path, [("carol", make_record(APP_ID, b"c1"))])
+    assert registry.get_device(APP_ID, b"c1") is None
+    registry.reload()
+    assert len(registry) == 1
+    assert registry.get_device(APP_ID, b"c1")[0] == "carol"
+
+
+def test_invalid_file(tmp_path):
+    path = tmp_path / "invalid"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(U2FInvalidDataException):
+        MappedDeviceRegistry(str(path))
+
+
+def test_signing_manager(tmp_path):
+    token = SoftU2FToken()
+    token.register(APP_ID, "challenge")
+    (key_handle,) = token.keys
+    path = str(tmp_path / "devices.u2fd")
+    build_device_registry(path, [("alice", token.device(key_handle))])
+    devices = MappedDeviceRegistry(path).for_user("alice")
+    manager = SigningManager(APP_ID)
+    session = {}
+    challenge = manager.create_signing_challenge(session, devices)["challenge"]
+    response = token.sign(APP_ID, challenge, key_handle)
+    device = manager.process_signing_response(session, response, devices)
+    assert device.key_handle == key_handle
+
+
+def test_file_mode(tmp_path):
+    path = str(tmp_path / "devices.u2fd")
+    umask = os.umask(0o022)
+    try:
+        build_device_registry(path, [("carol", make_record(APP_ID, b"c1"))])
+    finally:
+        os.umask(umask)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+    build_device_registry(path, [], mode=0o640)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
@@ -0,0 +1,134 @@
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+
+from .. import reverify
+from ..__main__ import main
+from ..soft_u2f import SoftU2FToken, create_ca_certificate
+from ..utils import websafe_encode
+
+APP_ID = "https://example.com"
+
+
+@pytest.fixture(scope="module")
+def archive():
+    token = SoftU2FToken(seed=1)
+    registration = token.register(APP_ID, "register-challenge")
+    (key_handle,) = token.keys
+    public_key = websafe_encode(token.device(key_handle).public_key)
+    signing = token.sign(APP_ID, "sign-challenge", key_handle)
+    records = [
+        {
+            "type": "register",
+            "appId": APP_ID,
+            "challenge": "register-challenge",
+            "response": registration,
+            "id": "r1",
+        },
+        {
+            "type": "sign",
+            "appId": APP_ID,
+            "challenge": "sign-challenge",
+            "response": signing,
+            "publicKey": public_key,
+        },
+        # Replayed; the device had already seen a later counter.
+        {
+            "type": "sign",
+            "appId": APP_ID,
+            "challenge": "sign-challenge",
+            "response": signing,
+            "publicKey": public_key,
+            "counter": 1,
+        },
+        # Answering a different challenge.
+        {
+            "type": "register",
+            "appId": APP_ID,
+            "challenge": "another-challenge",
+            "response": registration,
+        },
+        {"type": "sign", "appId": APP_ID, "response": signing},
+    ]
+    lines = [json.dumps(record) for record in records]
+    lines.insert(3, "")
+    lines.append("{not json")
+    return [line + "\n" for line in lines]
+
+
+def check_verdicts(verdicts):
+    assert [v["line"] for v in verdicts] == [1, 2, 3, 5, 6, 7]
+    assert [v["valid"] for v in verdicts] == [True, True, False, False, False, False]
+    assert verdicts[0]["id"] == "r1"
+    assert verdicts[0]["type"] == "register"
+    assert verdicts[1]["counter"] == 1
+    assert verdicts[1]["userPresence"] == 1
+    assert [v["reason"] for v in verdicts[2:]] == [
+        "device_counter_did_not_increase",
+        "invalid_or_missing_challenge",
+        "record_has_no_valid_challenge",
+        "record_is_not_valid_json",
+    ]
+
+
+def test_reverify_in_process(archive):
+    check_verdicts(list(reverify.reverify(archive, chunk_size=2)))
+
+
+def test_reverify_with_executor(archive):
+    with ThreadPoolExecutor(2) as executor:
+        verdicts = reverify.reverify(
+            archive, executor=executor, chunk_size=1, max_pending=2
+        )
+        check_verdicts(list(verdicts))
+
+
+def test_reverify_attestation_roots(archive, tmp_path):
+    _, root = create_ca_certificate("Root CA")
+    (tmp_path / "root.pem").write_bytes(root.public_bytes(serialization.Encoding.PEM))
+    verdicts = list(reverify.reverify(archive[:1], attestation_roots=str(tmp_path)))
+    assert verdicts[0]["reason"] == "attestation_certificate_is_not_trusted"
+
+
+def test_trusted_facets(archive):
+    record = json.loads(archive[0])
+    record["response"] = SoftU2FToken().register(
+        APP_ID, "register-challenge", origin="https://login.example.com"
+    )
+    (verdict,) = reverify.reverify([json.dumps(record)])
+    assert verdict["reason"] == "invalid_or_missing_origin"
+    record["trustedFacets"] = ["https://login.example.com"]
+    (verdict,) = reverify.reverify([json.dumps(record)])
+    assert verdict["valid"]
+
+
+def test_main(archive, tmp_path, capsys):
+    path = tmp_path / "archive.jsonl"
+    path.write_text("".join(archive))
+    output = tmp_path / "verdicts.jsonl"
+    argv = ["reverify", str(path), "-o", str(output), "-j", "2", "--chunk-size", "2"]
+    assert main(argv) == 1
+    check_verdicts([json.loads(line) for line in output.read_text().splitlines()])
+    err = capsys.readouterr().err
+    assert "6 responses (2 valid, 4 invalid)" in err
+    assert "invalid_or_missing_challenge" in err
+
+
+def test_summary():
+    summary = reverify.ReverifySummary()
+    summary.add({"valid": True})
+    summary.add({"valid": False, "reason": "a"})
+    summary.add({"valid": False, "reason": "a"})
+    assert (summary.total, summary.valid, summary.invalid) == (3, 1, 2)
+    assert summary.reasons == {"a": 2}
+
+
+def test_streams_lines():
+    # Only the pending chunks are read ahead of the verdicts.
+    lines = io.StringIO("{}\n" * 100)
+    verdicts = reverify.reverify(lines, chunk_size=10)
+    next(verdicts)
+    assert lines.tell() == 30
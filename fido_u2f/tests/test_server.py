@@ -0,0 +1,223 @@
+import os
+import signal
+import socket
+import stat
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+
+from ..attestation import AttestationTrustStore
+from ..exceptions import U2FInvalidDataException, U2FVerifierException
+from ..registration import U2FRegistrationManager
+from ..server import FRAME_HEADER, VerificationServer, verify_job
+from ..soft_u2f import SoftDevice, SoftU2FToken, create_ca_certificate
+from ..utils import websafe_encode
+from ..verification import U2FSigningManager
+from ..verifier_client import RemoteVerificationMixin, VerifierClient
+
+APP_ID = "https://example.com"
+
+
+class Manager(RemoteVerificationMixin, U2FRegistrationManager, U2FSigningManager):
+    def create_device_registration_model(self, **kwargs):
+        return SoftDevice(**kwargs)
+
+    def update_device_registration_counter(self, *, device, counter):
+        device.counter = counter
+        return device
+
+
+class Server:
+    def __init__(self, path, executor=None, attestation_roots=None):
+        self.path = path
+        self.executor = executor or ThreadPoolExecutor(2)
+        self.attestation_roots = attestation_roots
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        self.server = VerificationServer(
+            self.path, self.executor, attestation_roots=self.attestation_roots
+        )
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self.server.run, args=(ready,))
+        self.thread.start()
+        assert ready.wait(5)
+
+    def stop(self):
+        self.server.stop()
+        self.thread.join(5)
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = Server(str(tmp_path / "v.sock"))
+    server.start()
+    yield server
+    server.stop()
+    server.executor.shutdown()
+
+
+@pytest.fixture
+def client(server):
+    client = VerifierClient(server.path, timeout=5)
+    yield client
+    client.close()
+
+
+def sign_job(token, key_handle, device, challenge="challenge"):
+    return {
+        "type": "sign",
+        "appId": APP_ID,
+        "challenge": challenge,
+        "response": token.sign(APP_ID, challenge, key_handle),
+        "publicKey": websafe_encode(device.public_key),
+    }
+
+
+def test_register_and_sign(client):
+    manager = Manager(APP_ID, verifier_client=client)
+    token = SoftU2FToken()
+    session = {}
+    request = manager.create_registration_challenge(session, [])
+    challenge = request["registerRequests"][0]["challenge"]
+    device = manager.process_registration_response(
+        session, token.register(APP_ID, challenge)
+    )
+    (key_handle,) = token.keys
+    assert device.key_handle == key_handle
+    challenge = manager.create_signing_challenge(session, [device])["challenge"]
+    device = manager.process_signing_response(
+        session, token.sign(APP_ID, challenge, key_handle), [device]
+    )
+    assert device.counter == 1
+
+
+def test_invalid_response(client):
+    manager = Manager(APP_ID, verifier_client=client)
+    token = SoftU2FToken()
+    session = {}
+    request = manager.create_registration_challenge(session, [])
+    response = token.register(APP_ID, "another challenge")
+    with pytest.raises(U2FInvalidDataException):
+        manager.verify_registration_data(
+            response, request["registerRequests"][0]["challenge"]
+        )
+    # The connection is still usable.
+    challenge = request["registerRequests"][0]["challenge"]
+    manager.verify_registration_data(token.register(APP_ID, challenge), challenge)
+
+
+def test_attestation_required(client, tmp_path):
+    # The manager trusts no one; a server without roots can't check that.
+    manager = Manager(
+        APP_ID, verifier_client=client, attestation_trust_store=AttestationTrustStore()
+    )
+    token = SoftU2FToken()
+    session = {}
+    request = manager.create_registration_challenge(session, [])
+    response = token.register(APP_ID, request["registerRequests"][0]["challenge"])
+    with pytest.raises(U2FVerifierException, match="no attestation roots"):
+        manager.process_registration_response(session, response)
+    # With roots, the token's certificate isn't trusted by them.
+    _, root = create_ca_certificate("Root CA")
+    roots = tmp_path / "roots"
+    roots.mkdir()
+    (roots / "root.pem").write_bytes(root.public_bytes(serialization.Encoding.PEM))
+    server = Server(str(tmp_path / "roots.sock"), attestation_roots=str(roots))
+    server.start()
+    manager.verifier_client = VerifierClient(server.path, timeout=5)
+    try:
+        request = manager.create_registration_challenge(session, [])
+        response = token.register(APP_ID, request["registerRequests"][0]["challenge"])
+        with pytest.raises(U2FInvalidDataException):
+            manager.process_registration_response(session, response)
+    finally:
+        manager.verifier_client.close()
+        server.stop()
+        server.executor.shutdown()
+
+
+def test_verify_job():
+    token = SoftU2FToken()
+    response = token.register(APP_ID, "challenge")
+    (key_handle,) = token.keys
+    reply = verify_job(
+        {
+            "id": 3,
+            "type": "register",
+            "appId": APP_ID,
+            "challenge": "challenge",
+            "response": response,
+        }
+    )
+    assert reply["id"] == 3
+    assert reply["valid"]
+    assert reply["keyHandle"] == websafe_encode(key_handle)
+    device = token.device(key_handle)
+    reply = verify_job(dict(sign_job(token, key_handle, device), counter=5))
+    assert not reply["valid"]
+    assert reply["exception"] == U2FInvalidDataException.__name__
+    assert reply["reason"] == "device_counter_did_not_increase"
+    reply = verify_job({"id": 4, "type": "unknown"})
+    assert (reply["id"], reply["valid"]) == (4, False)
+    assert reply["exception"] == U2FInvalidDataException.__name__
+
+
+def test_bad_frames(server, client):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(5)
+        connection.connect(server.path)
+        body = b"{not json"
+        connection.sendall(FRAME_HEADER.pack(len(body)) + body)
+        (size,) = FRAME_HEADER.unpack(connection.recv(FRAME_HEADER.size))
+        assert b"job_is_not_valid_json" in connection.recv(size)
+        # A frame that is too large closes the connection.
+        connection.sendall(FRAME_HEADER.pack(server.server.max_frame + 1))
+        assert connection.recv(1) == b""
+    with pytest.raises(U2FInvalidDataException):
+        client.verify({"type": "unknown"})
+
+
+def test_reconnects(server, client):
+    token = SoftU2FToken()
+    token.register(APP_ID, "challenge")
+    (key_handle,) = token.keys
+    device = token.device(key_handle)
+    assert client.verify(sign_job(token, key_handle, device))["counter"] == 1
+    server.stop()
+    with pytest.raises(U2FVerifierException):
+        client.verify(sign_job(token, key_handle, device))
+    server.start()
+    assert client.verify(sign_job(token, key_handle, device))["counter"] == 3
+
+
+def test_socket_mode(server):
+    assert stat.S_IMODE(os.stat(server.path).st_mode) == 0o600
+
+
+def test_worker_killed(tmp_path):
+    token = SoftU2FToken()
+    token.register(APP_ID, "challenge")
+    (key_handle,) = token.keys
+    device = token.device(key_handle)
+    server = Server(str(tmp_path / "v.sock"), ProcessPoolExecutor(1))
+    server.start()
+    client = VerifierClient(server.path, timeout=5)
+    try:
+        assert client.verify(sign_job(token, key_handle, device))["counter"] == 1
+        for process in list(server.executor._processes.values()):
+            os.kill(process.pid, signal.SIGKILL)
+        # Answered, rather than left to time out; and the server stops.
+        with pytest.raises(U2FVerifierException, match="could not be run"):
+            client.verify(sign_job(token, key_handle, device))
+        server.thread.join(5)
+        assert not server.thread.is_alive()
+        assert server.server.failed
+    finally:
+        client.close()
+        server.stop()
+        server.thread.join(5)
+        server.executor.shutdown()
@@ -0,0 +1,45 @@
+import pytest
+
+from ..soft_u2f import SoftU2FToken
+from .test_verification import SigningManager
+
+APP_ID = "https://example.com"
+
+
+def test_seeded_tokens_derive_the_same_keys():
+    first, second = SoftU2FToken(seed=1), SoftU2FToken(seed=1)
+    first.register(APP_ID, "challenge")
+    second.register(APP_ID, "challenge")
+    (key_handle,) = first.keys
+    assert list(second.keys) == [key_handle]
+    assert first.device(key_handle).public_key == second.device(key_handle).public_key
+    assert first.attestation_cert.public_key().public_numbers() == (
+        second.attestation_cert.public_key().public_numbers()
+    )
+    assert first.attestation_cert.serial_number == (
+        second.attestation_cert.serial_number
+    )
+    other = SoftU2FToken(seed=2)
+    other.register(APP_ID, "challenge")
+    assert key_handle not in other.keys
+
+
+def test_seeded_token_responses_verify():
+    token = SoftU2FToken(seed=1)
+    manager = SigningManager(APP_ID)
+    token.register(APP_ID, "challenge")
+    (key_handle,) = token.keys
+    device = token.device(key_handle)
+    session = {}
+    request = manager.create_signing_challenge(session, [device])
+    response = token.sign(APP_ID, request["challenge"], key_handle)
+    assert manager.process_signing_response(session, response, [device]) is device
+    assert device.counter == 1
+
+
+def test_sign_rejects_another_app_id():
+    token = SoftU2FToken()
+    token.register(APP_ID, "challenge")
+    (key_handle,) = token.keys
+    with pytest.raises(ValueError):
+        token.sign("https://other.example.com", "challenge", key_handle)
@@ -0,0 +1,247 @@
+import pytest
+
+from ..bulk import import_devices
+from ..counters import WriteBehindCounterSink
+from ..device import DeviceRecord
+from ..enums import U2FTransport
+from ..registration import U2FRegistrationManager
+from ..soft_u2f import SoftU2FToken
+from ..verification import U2FSigningManager
+
+sqlalchemy = pytest.importorskip("sqlalchemy")
+repository_module = pytest.importorskip("fido_u2f.sqlalchemy_repository")
+
+APP_ID = "https://example.com"
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.statements = []
+        sqlalchemy.event.listen(engine, "before_cursor_execute", self.executed)
+
+    def executed(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def __len__(self):
+        return len(self.statements)
+
+    def reset(self):
+        self.statements = []
+
+
+class Manager(U2FRegistrationManager, U2FSigningManager):
+    def __init__(self, app_id, repository, **kwargs):
+        super().__init__(app_id, **kwargs)
+        self.repository = repository
+
+    def create_device_registration_model(self, **kwargs):
+        raise NotImplementedError
+
+    def update_device_registration_counter(self, *, device, counter):
+        self.repository.update_counter(device, counter)
+        return device
+
+
+def make_record(i, counter=0):
+    return DeviceRecord(
+        "U2F_V2", APP_ID, bytes([i]) * 64, b"\x04" * 65, counter, U2FTransport.USB.value
+    )
+
+
+@pytest.fixture
+def engine():
+    return sqlalchemy.create_engine("sqlite://")
+
+
+@pytest.fixture
+def repository(engine):
+    repository = repository_module.SQLAlchemyDeviceRepository(engine)
+    repository.create_table()
+    return repository
+
+
+@pytest.fixture
+def queries(engine):
+    return QueryCounter(engine)
+
+
+def test_unique_index(repository):
+    indexes = {
+        index.name: ([column.name for column in index.columns], index.unique)
+        for index in repository.table.indexes
+    }
+    assert indexes["ix_u2f_devices_app_id_key_handle"] == (
+        ["app_id", "key_handle"],
+        True,
+    )
+    repository.add_device("alice", make_record(1))
+    with pytest.raises(sqlalchemy.exc.IntegrityError):
+        repository.add_device("bob", make_record(1))
+
+
+def test_lookup_is_one_query(repository, queries):
+    repository.add_devices(("alice", make_record(i)) for i in range(10))
+    repository.add_device("bob", make_record(10))
+    queries.reset()
+    assert repository.get_device(APP_ID, bytes([3]) * 64) == make_record(3)
+    devices = repository.for_user("alice")
+    assert devices.get_device(APP_ID, bytes([4]) * 64) == make_record(4)
+    # Another user's device isn't found.
+    assert devices.get_device(APP_ID, bytes([10]) * 64) is None
+    assert repository.get_device("https://other.example.com", bytes([3]) * 64) is None
+    assert len(queries) == 4
+    queries.reset()
+    assert len(devices) == 10
+    assert list(devices) == [make_record(i) for i in range(10)]
+    assert len(devices.devices_for_app_id(APP_ID)) == 10
+    assert len(queries) == 1
+
+
+def test_counter_update_is_one_statement(repository, queries):
+    device = repository.add_device("alice", make_record(1, counter=5))
+    queries.reset()
+    assert repository.update_counter(device, 6)
+    assert device.counter == 6
+    assert len(queries) == 1
+    assert queries.statements[0].startswith("UPDATE")
+    # The counter can only increase.
+    assert not repository.update_counter(make_record(1, counter=0), 6)
+    assert repository.get_device(APP_ID, device.key_handle).counter == 6
+
+
+def test_bulk_insert(repository, queries):
+    queries.reset()
+    count = repository.add_devices(
+        (("user{}".format(i % 3), make_record(i)) for i in range(25)), batch_size=10
+    )
+    assert count == 25
+    assert [statement.split()[0] for statement in queries.statements] == ["INSERT"] * 3
+    assert len(repository.devices_for_owner("user1")) == 8
+    queries.reset()
+    import_devices([("carol", make_record(100))], repository)
+    assert len(queries) == 1
+
+
+def test_counter_store(repository):
+    repository.add_devices(("alice", make_record(i)) for i in range(3))
+    sink = WriteBehindCounterSink(repository, max_batch=100)
+    sink.record(make_record(0), 3)
+    sink.record(make_record(1), 4)
+    sink.record(make_record(2), 5)
+    repository.update_counter(make_record(2), 9)
+    conflicts = []
+    sink.on_conflict = conflicts.extend
+    sink.flush()
+    assert conflicts == [(APP_ID, bytes([2]) * 64)]
+    assert [device.counter for device in repository.devices_for_owner("alice")] == [
+        3,
+        4,
+        9,
+    ]
+
+
+def test_devices_version(repository, queries):
+    assert repository.devices_version("alice") == (0, None)
+    repository.add_device("alice", make_record(1))
+    version = repository.devices_version("alice")
+    repository.add_device("alice", make_record(2))
+    repository.add_device("bob", make_record(3))
+    assert repository.devices_version("alice") != version
+    version = repository.devices_version("alice")
+    repository.delete_device("alice", APP_ID, make_record(2).key_handle)
+    assert repository.devices_version("alice") != version
+    queries.reset()
+    repository.devices_version("alice")
+    assert len(queries) == 1
+
+
+def test_delete(repository):
+    repository.add_device("alice", make_record(1))
+    assert not repository.delete_device("bob", APP_ID, make_record(1).key_handle)
+    assert repository.delete_device("alice", APP_ID, make_record(1).key_handle)
+    assert repository.devices_for_owner("alice") == []
+
+
+def existing_repository(engine):
+    # Shaped like the sample's table; every column but the key is nullable.
+    sa = sqlalchemy
+    table = sa.Table(
+        "Device",
+        sa.MetaData(),
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("user_id", sa.Integer),
+        sa.Column("version", sa.String),
+        sa.Column("app_id", sa.String),
+        sa.Column("key_handle", sa.LargeBinary),
+        sa.Column("public_key", sa.LargeBinary),
+        sa.Column("transports", sa.Integer),
+        sa.Column("counter", sa.Integer),
+        sa.Index("ix_Device_app_id_key_handle", "app_id", "key_handle", unique=True),
+    )
+    repository = repository_module.SQLAlchemyDeviceRepository(
+        engine, table, owner_column="user_id"
+    )
+    repository.create_table()
+    return repository
+
+
+def test_existing_table(engine):
+    repository = existing_repository(engine)
+    repository.add_device(7, make_record(1))
+    assert repository.devices_for_owner(7) == [make_record(1)]
+    assert repository.for_user(7).get_device(APP_ID, bytes([1]) * 64)
+
+
+def test_existing_table_null_counter(engine):
+    token = SoftU2FToken()
+    token.register(APP_ID, "challenge")
+    (key_handle,) = token.keys
+    device = token.device(key_handle)
+    repository = existing_repository(engine)
+    # Registered without a counter, or transports.
+    with engine.begin() as connection:
+        connection.execute(
+            repository.table.insert(),
+            {
+                "user_id": 7,
+                "version": device.version,
+                "app_id": APP_ID,
+                "key_handle": key_handle,
+                "public_key": device.public_key,
+            },
+        )
+    stored = repository.get_device(APP_ID, key_handle)
+    assert (stored.counter, stored.transports) == (0, -1)
+    assert repository.get(APP_ID, key_handle) == 0
+    manager = Manager(APP_ID, repository)
+    session = {}
+    challenge = manager.create_signing_challenge(session, [stored])["challenge"]
+    response = token.sign(APP_ID, challenge, key_handle)
+    signed = manager.process_signing_response(session, response, repository.for_user(7))
+    assert signed.counter == 1
+    assert repository.get(APP_ID, key_handle) == 1
+    assert not repository.update_counter(signed, 1)
+
+
+def test_signing_with_repository(repository, queries):
+    token = SoftU2FToken()
+    token.register(APP_ID, "challenge")
+    (key_handle,) = token.keys
+    repository.add_devices(("alice", make_record(i)) for i in range(20))
+    repository.add_device("alice", token.device(key_handle))
+    manager = Manager(APP_ID, repository)
+    session = {}
+    challenge = manager.create_signing_challenge(session, [make_record(0)])[
+        "challenge"
+    ]
+    response = token.sign(APP_ID, challenge, key_handle)
+    queries.reset()
+    device = manager.process_signing_response(
+        session, response, repository.for_user("alice")
+    )
+    assert device.counter == 1
+    # One lookup by key handle, and one counter update.
+    assert [statement.split()[0] for statement in queries.statements] == [
+        "SELECT",
+        "UPDATE",
+    ]
@@ -0,0 +1,97 @@
+import pytest
+
+from .. import tracing
+from ..challenge_store import MemoryChallengeStore
+from ..enums import RequestType
+from ..exceptions import U2FInvalidDataException, U2FStateException
+from ..soft_u2f import SoftU2FToken
+from ..utils import validate_client_data, websafe_encode
+from .test_registration import RegistrationManager
+from .test_verification import SigningManager
+
+APP_ID = "https://example.com"
+
+
+def span_names(timings):
+    return [name for name, _, _ in timings.spans]
+
+
+def test_validate_client_data_prints_nothing(capsys):
+    client_data = SoftU2FToken.client_data(RequestType.SIGN, "challenge", APP_ID)
+    validate_client_data(
+        websafe_encode(client_data), RequestType.SIGN, APP_ID, "challenge"
+    )
+    assert capsys.readouterr() == ("", "")
+
+
+def test_registration_spans():
+    tracer = tracing.TimingTracer()
+    manager = RegistrationManager(
+        APP_ID, tracer=tracer, challenge_store=MemoryChallengeStore()
+    )
+    token = SoftU2FToken()
+    session = {}
+    with tracer.request() as timings:
+        request = manager.create_registration_challenge(session)
+        response = token.register(APP_ID, request["registerRequests"][0]["challenge"])
+        manager.process_registration_response(session, response)
+    assert span_names(timings) == [
+        tracing.CHALLENGE_STORE,
+        tracing.CHALLENGE_STORE,
+        tracing.DECODE,
+        tracing.CLIENT_DATA,
+        tracing.CERTIFICATE,
+        tracing.VERIFY,
+        tracing.CERTIFICATE,
+        tracing.STORE,
+        tracing.REGISTRATION,
+    ]
+    assert not any(failed for _, _, failed in timings.spans)
+    assert set(timings.durations()) == set(span_names(timings))
+    assert timings.events == [
+        (tracing.CHALLENGE_ISSUED, {"session_key": manager.REGISTRATION_SESSION_KEY})
+    ]
+
+
+def test_signing_spans_record_failures():
+    tracer = tracing.TimingTracer()
+    manager = SigningManager(APP_ID, tracer=tracer)
+    token = SoftU2FToken()
+    token.register(APP_ID, "challenge")
+    (key_handle,) = token.keys
+    devices = [token.device(key_handle)]
+    session = {}
+    manager.create_signing_challenge(session, devices)
+    response = token.sign(APP_ID, "wrong challenge", key_handle)
+    with tracer.request() as timings:
+        with pytest.raises(U2FInvalidDataException):
+            manager.process_signing_response(session, response, devices)
+    assert [(name, failed) for name, _, failed in timings.spans[-2:]] == [
+        (tracing.CLIENT_DATA, True),
+        (tracing.SIGNING, True),
+    ]
+
+
+def test_challenge_missing_event():
+    tracer = tracing.TimingTracer()
+    manager = SigningManager(APP_ID, tracer=tracer)
+    with tracer.request() as timings:
+        with pytest.raises(U2FStateException):
+            manager.process_signing_response({}, {"keyHandle": ""}, [])
+    assert timings.events == [
+        (tracing.CHALLENGE_MISSING, {"session_key": manager.SIGNING_SESSION_KEY})
+    ]
+
+
+def test_spans_outside_a_request_are_ignored():
+    tracer = tracing.TimingTracer()
+    assert tracer.span(tracing.VERIFY) is tracing.NULL_SPAN
+    with tracer.request() as outer:
+        with tracer.request() as inner:
+            with tracer.span(tracing.VERIFY):
+                pass
+        with tracer.span(tracing.DECODE):
+            pass
+    assert tracer.current() is None
+    assert span_names(inner) == [tracing.VERIFY]
+    assert span_names(outer) == [tracing.DECODE]
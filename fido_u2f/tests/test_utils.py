@@ -1,4 +1,10 @@
+import json
+
+import pytest
+
 from .. import utils
+from ..enums import RequestType
+from ..exceptions import U2FInvalidDataException
 
 
 def test_sha_256():
@@ -16,6 +22,50 @@ def test_sha_256():
     )
 
 
+def test_decode_client_data():
+    client_data = json.dumps({"origin": "https://\u00e9xample.com"}).encode("utf-8")
+    assert utils.decode_client_data(client_data) is client_data
+    assert utils.decode_client_data(client_data.decode("ascii")) == client_data
+    assert utils.decode_client_data(utils.websafe_encode(client_data)) == client_data
+    with pytest.raises(U2FInvalidDataException):
+        utils.decode_client_data("not base64!")
+    with pytest.raises(U2FInvalidDataException):
+        utils.decode_client_data(None)
+
+
+def test_check_client_data():
+    client_data = json.dumps(
+        {"typ": RequestType.SIGN.value, "challenge": "c", "origin": "https://a"}
+    ).encode("utf-8")
+    parsed = utils.check_client_data(client_data, RequestType.SIGN, "https://a", "c")
+    assert parsed["challenge"] == "c"
+    for args in [
+        (RequestType.REGISTER, "https://a", "c"),
+        (RequestType.SIGN, "https://b", "c"),
+        (RequestType.SIGN, "https://a", "d"),
+    ]:
+        with pytest.raises(U2FInvalidDataException):
+            utils.check_client_data(client_data, *args)
+    with pytest.raises(U2FInvalidDataException):
+        utils.check_client_data(b"[]", RequestType.SIGN, "https://a", "c")
+
+
+def test_load_response_body():
+    assert utils.load_response_body(b'{"a": "b"}') == {"a": "b"}
+    assert utils.load_response_body(memoryview(b'{"a": "b"}')) == {"a": "b"}
+    for body in [b"\xff", "[]", "{"]:
+        with pytest.raises(U2FInvalidDataException):
+            utils.load_response_body(body)
+    for field in ["keyHandle", "registrationData", "signatureData", "clientData"]:
+        for value in [5, None, ["a"], {"a": "b"}]:
+            body = json.dumps({field: value})
+            if value is None:
+                assert utils.load_response_body(body) == {field: None}
+                continue
+            with pytest.raises(U2FInvalidDataException, match=field):
+                utils.load_response_body(body)
+
+
 def test_pop_bytes():
     arr = bytearray(b"0123456789")
     assert utils.pop_bytes(arr, 1) == b"0"
@@ -46,3 +96,7 @@ class Test_parse_tlv_encoded_length:
         # 0x7f => length of bytes representing message length
         arr = bytearray(b"f\xff" + (b"\0" * 0x7E) + b"\x05")
         assert utils.parse_tlv_encoded_length(arr) == (2 + 0x7F + 5)
+
+    def test_offset(self):
+        arr = memoryview(b"xyzf\x81\x05")
+        assert utils.parse_tlv_encoded_length(arr, 3) == (2 + 1 + 5)
@@ -0,0 +1,207 @@
+import json
+import threading
+
+import pytest
+
+from .. import verification
+from ..app_context import AppContext
+from ..challenge_store import MemoryChallengeStore
+from ..counters import MemoryCounterStore, WriteBehindCounterSink, device_key
+from ..device import DeviceIndex
+from ..exceptions import U2FInvalidDataException, U2FStateException
+from ..utils import websafe_decode
+from ..soft_u2f import SoftU2FToken
+
+APP_ID = "https://example.com"
+
+
+class SigningManager(verification.U2FSigningManager):
+    def update_device_registration_counter(self, *, device, counter):
+        device.counter = counter
+        return device
+
+
+@pytest.fixture
+def token():
+    return SoftU2FToken()
+
+
+@pytest.fixture
+def device(token):
+    token.register(APP_ID, "registration-challenge")
+    return token.device(next(iter(token.keys)))
+
+
+def sign(manager, token, device, session):
+    challenge = manager.create_signing_challenge(session, [device])["challenge"]
+    return token.sign(APP_ID, challenge, device.key_handle)
+
+
+def test_process_signing_response(token, device):
+    manager = SigningManager(APP_ID)
+    session = {}
+    response = sign(manager, token, device, session)
+    assert manager.process_signing_response(session, response, [device]) is device
+    assert device.counter == token.counter
+    assert not session
+
+
+def test_process_signing_body(token, device):
+    manager = SigningManager(APP_ID)
+    session = {}
+    response = sign(manager, token, device, session)
+    body = json.dumps(response).encode("utf-8")
+    assert manager.process_signing_body(session, body, [device]).counter == 1
+    with pytest.raises(U2FInvalidDataException):
+        manager.process_signing_body({}, b"{not json", [device])
+
+
+def test_process_signing_response_without_challenge(token, device):
+    manager = SigningManager(APP_ID)
+    response = sign(manager, token, device, {})
+    with pytest.raises(U2FStateException):
+        manager.process_signing_response({}, response, [device])
+
+
+def test_process_signing_response_bad_signature(token, device):
+    manager = SigningManager(APP_ID)
+    session = {}
+    manager.create_signing_challenge(session, [device])
+    response = token.sign(APP_ID, "not-the-challenge", device.key_handle)
+    with pytest.raises(U2FInvalidDataException):
+        manager.process_signing_response(session, response, [device])
+
+
+@pytest.mark.parametrize(
+    "field, value",
+    [("keyHandle", "!!!"), ("keyHandle", 5), ("signatureData", 5)],
+)
+def test_process_signing_response_malformed(token, device, field, value):
+    manager = SigningManager(APP_ID)
+    session = {}
+    response = sign(manager, token, device, session)
+    response[field] = value
+    with pytest.raises(U2FInvalidDataException):
+        manager.process_signing_response(session, response, [device])
+
+
+def test_public_key_cache(token, device):
+    verification.public_key_cache.clear()
+    before = verification.public_key_cache.stats()
+    first = verification.load_public_key(device.public_key)
+    assert verification.load_public_key(device.public_key) is first
+    after = verification.public_key_cache.stats()
+    assert after.misses == before.misses + 1
+    assert after.hits == before.hits + 1
+
+
+def test_process_signing_responses(token, device):
+    manager = SigningManager(APP_ID)
+    requests = []
+    for _ in range(4):
+        session = {}
+        requests.append((session, sign(manager, token, device, session), [device]))
+    # Break the second request.
+    requests[1][0].clear()
+    results = manager.process_signing_responses(requests)
+    assert results[0] is device
+    assert isinstance(results[1], U2FStateException)
+    assert results[2] is device
+    assert results[3] is device
+
+
+def test_executor_created_once():
+    manager = SigningManager(APP_ID)
+    barrier = threading.Barrier(8)
+    executors = []
+
+    def get_executor():
+        barrier.wait()
+        executors.append(manager.get_executor())
+
+    threads = [threading.Thread(target=get_executor) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(executors) == 8
+    assert all(executor is manager.executor for executor in executors)
+    manager.executor.shutdown()
+
+
+def test_process_signing_response_with_index(token, device):
+    manager = SigningManager(APP_ID)
+    index = DeviceIndex([device])
+    session = {}
+    response = sign(manager, token, device, session)
+    assert manager.process_signing_response(session, response, index) is device
+
+
+def test_create_signing_challenge_without_devices():
+    manager = SigningManager(APP_ID)
+    with pytest.raises(ValueError):
+        manager.create_signing_challenge({}, [])
+
+
+def test_trusted_facet(token, device):
+    manager = SigningManager(AppContext(APP_ID, ["https://login.example.com"]))
+    session = {}
+    challenge = manager.create_signing_challenge(session, [device])["challenge"]
+    response = token.sign(
+        APP_ID, challenge, device.key_handle, origin="https://login.example.com"
+    )
+    assert manager.process_signing_response(session, response, [device]) is device
+
+
+def test_untrusted_facet(token, device):
+    manager = SigningManager(APP_ID)
+    session = {}
+    challenge = manager.create_signing_challenge(session, [device])["challenge"]
+    response = token.sign(
+        APP_ID, challenge, device.key_handle, origin="https://login.example.com"
+    )
+    with pytest.raises(U2FInvalidDataException):
+        manager.process_signing_response(session, response, [device])
+
+
+def test_parse_signature_data(token, device):
+    response = token.sign(APP_ID, "challenge", device.key_handle)
+    data = websafe_decode(response["signatureData"])
+    parsed = verification.SignatureData(data)
+    assert parsed.user_presence == 1
+    assert parsed.counter == token.counter
+    assert parsed.signature == data[5:]
+    with pytest.raises(U2FInvalidDataException):
+        verification.SignatureData(data[:4])
+
+
+def test_challenge_store(token, device):
+    store = MemoryChallengeStore()
+    manager = SigningManager(APP_ID, challenge_store=store)
+    session = {}
+    challenge = manager.create_signing_challenge(session, [device])["challenge"]
+    assert challenge not in session.values()
+    response = token.sign(APP_ID, challenge, device.key_handle)
+    assert manager.process_signing_response(session, response, [device]) is device
+    assert len(store) == 0
+
+
+def test_counter_must_increase(token, device):
+    manager = SigningManager(APP_ID)
+    session = {}
+    response = sign(manager, token, device, session)
+    device.counter = token.counter
+    with pytest.raises(U2FInvalidDataException):
+        manager.process_signing_response(session, response, [device])
+
+
+def test_counter_sink(token, device):
+    store = MemoryCounterStore()
+    manager = SigningManager(
+        APP_ID, counter_sink=WriteBehindCounterSink(store, max_batch=1)
+    )
+    session = {}
+    response = sign(manager, token, device, session)
+    assert manager.process_signing_response(session, response, [device]) is device
+    assert device.counter == 0
+    assert store.counters == {device_key(device): token.counter}
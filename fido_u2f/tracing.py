@@ -0,0 +1,174 @@
+"""
+Hooks for tracing the stages of the registration and signing flows.
+
+Give a manager a ``Tracer`` to have it report a span around each stage of
+processing a response, and an event for anything of note in between. With
+no tracer the managers skip the hooks entirely.
+
+``TimingTracer`` records the spans of each request into a ``RequestTimings``.
+"""
+import threading
+import time
+
+from . import _typing as typ  # isort:skip
+
+# Span names.
+#: Processing a registration response, from start to finish.
+REGISTRATION = "registration"
+#: Processing a signing response, from start to finish.
+SIGNING = "signing"
+#: Decoding and parsing the response.
+DECODE = "decode"
+#: Validating the client data.
+CLIENT_DATA = "client_data"
+#: Parsing the attestation certificate.
+CERTIFICATE = "certificate"
+#: Checking the attestation certificate against the trust store.
+ATTESTATION = "attestation"
+#: Verifying the response's signature.
+VERIFY = "verify"
+#: Storing or retrieving a challenge in the challenge store.
+CHALLENGE_STORE = "challenge_store"
+#: Storing the device or its new counter.
+STORE = "store"
+
+# Event names.
+#: A challenge was issued.
+CHALLENGE_ISSUED = "challenge_issued"
+#: A response was given without a (current) challenge for it.
+CHALLENGE_MISSING = "challenge_missing"
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc_info: typ.Any) -> None:
+        return None
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    The base tracer; ignores everything.
+
+    Subclasses override ``span`` and ``event``. Both are called on the
+    thread processing the response.
+    """
+
+    def span(self, name: str) -> typ.ContextManager[None]:
+        """Return a context manager wrapping the stage ``name``."""
+        return NULL_SPAN
+
+    def event(self, name: str, **attributes: typ.Any) -> None:
+        pass
+
+
+def span(tracer: typ.Optional[Tracer], name: str) -> typ.ContextManager[None]:
+    """The tracer's span for ``name``; or a shared no-op span, with no tracer."""
+    if tracer is None:
+        return NULL_SPAN
+    return tracer.span(name)
+
+
+class RequestTimings:
+    """
+    The spans and events of one request.
+
+    ``spans`` holds ``(name, seconds, failed)`` tuples in the order the
+    spans finished; ``events`` holds ``(name, attributes)`` tuples.
+    """
+
+    __slots__ = ("spans", "events")
+
+    def __init__(self) -> None:
+        self.spans = []  # type: typ.List[typ.Tuple[str, float, bool]]
+        self.events = []  # type: typ.List[typ.Tuple[str, typ.Dict[str, typ.Any]]]
+
+    def durations(self) -> typ.Dict[str, float]:
+        """The total seconds spent in each stage."""
+        durations = {}  # type: typ.Dict[str, float]
+        for name, seconds, _ in self.spans:
+            durations[name] = durations.get(name, 0.0) + seconds
+        return durations
+
+
+class _TimedSpan:
+    __slots__ = ("timings", "name", "clock", "start")
+
+    def __init__(
+        self, timings: RequestTimings, name: str, clock: typ.Callable[[], float]
+    ) -> None:
+        self.timings = timings
+        self.name = name
+        self.clock = clock
+
+    def __enter__(self) -> None:
+        self.start = self.clock()
+
+    def __exit__(self, exc_type: typ.Any, *exc_info: typ.Any) -> None:
+        self.timings.spans.append(
+            (self.name, self.clock() - self.start, exc_type is not None)
+        )
+
+
+class TimingTracer(Tracer):
+    """
+    Record the spans of each request into a ``RequestTimings``::
+
+        tracer = TimingTracer()
+        manager = MyManager(app_id, tracer=tracer)
+        with tracer.request() as timings:
+            manager.process_signing_response(session, response, devices)
+        timings.durations()
+
+    The current request is tracked per thread; spans outside of ``request``
+    are ignored. So it doesn't suit the asyncio managers, which interleave
+    requests on one thread and run stages on an executor.
+    """
+
+    def __init__(self, clock: typ.Callable[[], float] = time.perf_counter) -> None:
+        self.clock = clock
+        self._local = threading.local()
+
+    def current(self) -> typ.Optional[RequestTimings]:
+        return getattr(self._local, "timings", None)
+
+    def request(
+        self, timings: typ.Optional[RequestTimings] = None
+    ) -> "_RequestScope":
+        """Record the spans made on this thread, until exit, into ``timings``."""
+        if timings is None:
+            timings = RequestTimings()
+        return _RequestScope(self, timings)
+
+    def span(self, name: str) -> typ.ContextManager[None]:
+        timings = self.current()
+        if timings is None:
+            return NULL_SPAN
+        return _TimedSpan(timings, name, self.clock)
+
+    def event(self, name: str, **attributes: typ.Any) -> None:
+        timings = self.current()
+        if timings is not None:
+            timings.events.append((name, attributes))
+
+
+class _RequestScope:
+    __slots__ = ("tracer", "timings", "previous")
+
+    def __init__(self, tracer: TimingTracer, timings: RequestTimings) -> None:
+        self.tracer = tracer
+        self.timings = timings
+
+    def __enter__(self) -> RequestTimings:
+        self.previous = self.tracer.current()
+        self.tracer._local.timings = self.timings
+        return self.timings
+
+    def __exit__(self, *exc_info: typ.Any) -> None:
+        self.tracer._local.timings = self.previous
@@ -6,7 +6,7 @@ from base64 import urlsafe_b64decode, urlsafe_b64encode
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 
-from .constants import INVALID_YUBICO_CERT_SHASUMS
+from .constants import INVALID_YUBICO_CERT_SHASUMS, RESPONSE_STRING_FIELDS
 from .enums import RequestType
 from .exceptions import U2FInvalidDataException
 
@@ -48,18 +48,177 @@ def validate_client_data(
     request_type: RequestType,
     app_id: str,
     expected_challenge: str,
+    trusted_origins: typ.Optional[typ.Container[str]] = None,
 ) -> str:
-    standardised_client_data = standardise_client_data(raw_client_data)
-    client_data = load_client_data(standardised_client_data)
-    print(client_data)
-    if client_data.get("typ", None) != request_type.value:
+    """
+    Validate the client data; returning it as a decoded JSON string.
+
+    The client data's origin must be ``app_id``, or one of
+    ``trusted_origins`` when given.
+    """
+    client_data = _client_data_text(decode_client_data(raw_client_data))
+    _check_client_data_text(
+        client_data, request_type, app_id, expected_challenge, trusted_origins
+    )
+    # Valid client data falls through.
+    return client_data
+
+
+def decode_client_data(raw_client_data: typ.Union[str, bytes]) -> bytes:
+    """
+    Return the client data's JSON as bytes; decoding it from base64 if needed.
+
+    These are the bytes the challenge parameter is the digest of.
+    """
+    if isinstance(raw_client_data, str):
+        if "{" in raw_client_data:
+            return raw_client_data.encode("utf-8")
+    elif isinstance(raw_client_data, bytes):
+        if b"{" in raw_client_data:
+            return raw_client_data
+    else:
+        raise U2FInvalidDataException(
+            "Client data is an unsupported type{!r}.".format(type(raw_client_data))
+        )
+    try:
+        return websafe_decode(raw_client_data)
+    except ValueError:
+        raise U2FInvalidDataException("Client data was an invalid string")
+
+
+def check_client_data(
+    client_data: bytes,
+    request_type: RequestType,
+    app_id: str,
+    expected_challenge: str,
+    trusted_origins: typ.Optional[typ.Container[str]] = None,
+) -> typ.Mapping[str, typ.Any]:
+    """
+    Parse and check client data decoded by ``decode_client_data``.
+
+    Returns the parsed client data. See ``validate_client_data``.
+    """
+    return _check_client_data_text(
+        _client_data_text(client_data),
+        request_type,
+        app_id,
+        expected_challenge,
+        trusted_origins,
+    )
+
+
+def _client_data_text(client_data: bytes) -> str:
+    # ``json.loads`` only takes bytes from Python 3.6.
+    try:
+        return client_data.decode("utf-8")
+    except ValueError:
+        raise U2FInvalidDataException("Client data was an invalid string")
+
+
+def _check_client_data_text(
+    client_data: str,
+    request_type: RequestType,
+    app_id: str,
+    expected_challenge: str,
+    trusted_origins: typ.Optional[typ.Container[str]],
+) -> typ.Mapping[str, typ.Any]:
+    parsed = _parse_client_data(client_data)
+    _check_parsed_client_data(
+        parsed, request_type, app_id, expected_challenge, trusted_origins
+    )
+    return parsed
+
+
+def _check_parsed_client_data(
+    parsed: typ.Mapping[str, typ.Any],
+    request_type: RequestType,
+    app_id: str,
+    expected_challenge: str,
+    trusted_origins: typ.Optional[typ.Container[str]],
+) -> None:
+    if parsed.get("typ", None) != request_type.value:
         raise U2FInvalidDataException("Invalid or missing request type")
-    if client_data.get("origin", None) != app_id:
+    origin = parsed.get("origin", None)
+    if trusted_origins is None:
+        trusted = origin == app_id
+    else:
+        trusted = isinstance(origin, str) and origin in trusted_origins
+    if not trusted:
         raise U2FInvalidDataException("Invalid or missing origin")
-    if client_data.get("challenge", None) != expected_challenge:
+    if parsed.get("challenge", None) != expected_challenge:
         raise U2FInvalidDataException("Invalid or missing challenge")
-    # Valid client data falls through.
-    return standardised_client_data
+
+
+class ClientData:
+    """
+    A response's client data; decoded and parsed once.
+
+    ``data`` are the bytes the challenge parameter is the digest of; and
+    ``parsed`` their JSON.
+    """
+
+    __slots__ = ("data", "parsed")
+
+    def __init__(self, raw_client_data: typ.Union[str, bytes]) -> None:
+        self.data = decode_client_data(raw_client_data)
+        self.parsed = _parse_client_data(_client_data_text(self.data))
+
+    @property
+    def challenge(self) -> typ.Any:
+        """The challenge the client data claims to answer; without checking it."""
+        return self.parsed.get("challenge")
+
+    def check(
+        self,
+        request_type: RequestType,
+        app_id: str,
+        expected_challenge: str,
+        trusted_origins: typ.Optional[typ.Container[str]] = None,
+    ) -> None:
+        """Check the client data; see ``validate_client_data``."""
+        _check_parsed_client_data(
+            self.parsed, request_type, app_id, expected_challenge, trusted_origins
+        )
+
+
+def client_data_challenge(raw_client_data: typ.Union[str, bytes]) -> typ.Any:
+    """The challenge the client data claims to answer; without checking it."""
+    return ClientData(raw_client_data).challenge
+
+
+def _parse_client_data(client_data: str) -> typ.Dict[str, typ.Any]:
+    try:
+        parsed = json.loads(client_data)
+    except ValueError:
+        raise U2FInvalidDataException("Client data was an invalid string")
+    if not isinstance(parsed, dict):
+        raise U2FInvalidDataException("Client data was an invalid string")
+    return parsed
+
+
+def load_response_body(body: typ.Union[str, bytes]) -> typ.Dict[str, typ.Any]:
+    """Parse a response, as posted by the client in a JSON request body."""
+    try:
+        if not isinstance(body, str):
+            body = bytes(body).decode("utf-8")
+        response = json.loads(body)
+    except ValueError:
+        raise U2FInvalidDataException("Response was not valid JSON")
+    if not isinstance(response, dict):
+        raise U2FInvalidDataException("Response was not a JSON object")
+    check_response_fields(response)
+    return response
+
+
+def check_response_fields(response: typ.Mapping[str, typ.Any]) -> None:
+    """
+    Raise ``U2FInvalidDataException`` unless each of the response's fields
+    the managers read is a string.
+    """
+    for name in RESPONSE_STRING_FIELDS:
+        value = response.get(name)
+        if value is not None and not isinstance(value, str):
+            raise U2FInvalidDataException("Response has an invalid {}".format(name))
 
 
 def sha_256(data: bytes) -> bytes:
@@ -74,26 +233,31 @@ def pop_bytes(data: bytearray, l: int) -> bytes:
     return x
 
 
-def fix_invalid_yubico_certs(der: bytes):
+def fix_invalid_yubico_certs(der: bytes, der_digest: typ.Optional[bytes] = None):
     # Some early certs have UNUSED BITS incorrectly set.
     # Fix only if they are one of the known bad
-    if sha_256(der) in INVALID_YUBICO_CERT_SHASUMS:
+    if der_digest is None:
+        der_digest = sha_256(der)
+    if der_digest in INVALID_YUBICO_CERT_SHASUMS:
         der = der[:-257] + b"\0" + der[-256:]
     return der
 
 
-def parse_tlv_encoded_length(data: bytearray) -> int:
+def parse_tlv_encoded_length(
+    data: typ.Union[bytes, bytearray, memoryview], offset: int = 0
+) -> int:
+    """Return the total length of the TLV encoded value at ``offset``."""
     # https://msdn.microsoft.com/en-us/library/windows/desktop/bb648641(v=vs.85).aspx
     # Starting at 1 because byte 0 is the 'tag'
-    length = data[1] & 0x7F
-    extended_length_flag = data[1] & 0x80
+    length = data[offset + 1] & 0x7F
+    extended_length_flag = data[offset + 1] & 0x80
     if extended_length_flag:
         # The 7 low-bits of `length` indicate the number of bytes to read to
         #  determine the length
         true_length = 0
         # Offset at 2 because we started at 1; and we've already read the
         #  first byte.
-        for byte in data[2 : (2 + length)]:
+        for byte in data[(offset + 2) : (offset + 2 + length)]:
             true_length = (true_length << 8) | byte
         # Return the length; plus the bytes we've already read.
         return 2 + length + true_length
@@ -1,5 +1,7 @@
 import abc
 import struct
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
 
 from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.backends import default_backend
@@ -7,21 +9,49 @@ from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.primitives.serialization import load_der_public_key
 
-from .constants import PUB_KEY_DER_PREFIX
-from .device import DeviceRegistration, device_as_client_dict, filter_devices_by_app_id
+from .app_context import AppContext
+from .cache import LRUCache
+from .challenge_store import ChallengeStore
+from .challenge_tokens import ChallengeTokens
+from .constants import PUB_KEY_DER_PREFIX, PUBLIC_KEY_CACHE_SIZE
+from .counters import WriteBehindCounterSink, check_counter_increased
+from .device import DeviceRegistration, DeviceSource, device_as_client_dict
 from .enums import RequestType
 from .exceptions import U2FInvalidDataException, U2FStateException
+from .key_list import RenderedKeyList
+from .manager import U2FManagerBase
+from .tracing import CLIENT_DATA, DECODE, SIGNING, STORE, VERIFY, Tracer, span
 from .utils import (
-    get_random_challenge,
-    pop_bytes,
+    ClientData,
+    load_response_body,
     sha_256,
-    validate_client_data,
     websafe_decode,
-    websafe_encode,
 )
 
+from . import _typing as typ  # isort:skip
 
-class U2FSigningManager(abc.ABC):
+#: Loaded public keys; keyed by the raw ``DeviceRegistration.public_key`` bytes.
+#: Use ``public_key_cache.resize(0)`` to disable caching.
+public_key_cache = LRUCache(PUBLIC_KEY_CACHE_SIZE)
+
+_COUNTER = struct.Struct(">I")
+# Guards the creation of the managers' default executors.
+_executor_lock = threading.Lock()
+
+
+def load_public_key(der_pubkey: bytes) -> ec.EllipticCurvePublicKey:
+    """
+    Load the device's raw public key; reusing an already loaded key if possible.
+    """
+    der_pubkey = bytes(der_pubkey)
+    pubkey = public_key_cache.get(der_pubkey)
+    if pubkey is None:
+        pubkey = load_der_public_key(PUB_KEY_DER_PREFIX + der_pubkey, default_backend())
+        public_key_cache.put(der_pubkey, pubkey)
+    return pubkey
+
+
+class U2FSigningManager(U2FManagerBase):
     """
     An abstract class that handles verifying a user's U2F token.
 
@@ -32,17 +62,48 @@ class U2FSigningManager(abc.ABC):
     This class has 2 externally useable API methods
     ``create_signing_challenge`` and ``process_signing_response`` which
     should be used to provide the U2F verification/signing flow for a user.
+    ``process_signing_responses`` processes many responses at once.
     """
 
     SIGNING_SESSION_KEY = "u2f_signing_challenge"
+    # The number of threads used by ``process_signing_responses`` when no
+    #  executor is given. ``None`` uses the ``ThreadPoolExecutor`` default.
+    BATCH_MAX_WORKERS = None  # type: typ.Optional[int]
 
-    def __init__(self, app_id: str) -> None:
+    executor = None  # type: typ.Optional[Executor]
+    counter_sink = None  # type: typ.Optional[WriteBehindCounterSink]
+
+    def __init__(
+        self,
+        app_id: typ.Union[str, AppContext],
+        *,
+        executor: typ.Optional[Executor] = None,
+        challenge_store: typ.Optional[ChallengeStore] = None,
+        challenge_tokens: typ.Optional[ChallengeTokens] = None,
+        counter_sink: typ.Optional[WriteBehindCounterSink] = None,
+        tracer: typ.Optional[Tracer] = None
+    ) -> None:
         """
         Create a signing manager.
 
-
+        ``app_id`` may be an ``AppContext`` to accept its trusted facets.
+        ``executor`` is used to verify the responses given to
+        ``process_signing_responses``; by default a thread pool of
+        ``BATCH_MAX_WORKERS`` threads is created when first needed.
+        When ``challenge_store`` is given, challenges are kept there rather
+        than in the session; with ``challenge_tokens`` they aren't kept at
+        all. When ``counter_sink`` is given, it stores the
+        device counters instead of ``update_device_registration_counter``.
+        ``tracer`` is given a span for each stage of processing a response.
         """
-        self.app_id = app_id
+        super().__init__(
+            app_id,
+            challenge_store=challenge_store,
+            challenge_tokens=challenge_tokens,
+            tracer=tracer,
+        )
+        self.executor = executor
+        self.counter_sink = counter_sink
 
     @abc.abstractmethod
     def update_device_registration_counter(
@@ -50,11 +111,6 @@ class U2FSigningManager(abc.ABC):
     ) -> DeviceRegistration:
         ...
 
-    def filter_devices_by_app_id(
-        self, registered_devices: typ.Collection[DeviceRegistration]
-    ) -> typ.Iterable[DeviceRegistration]:
-        return filter_devices_by_app_id(registered_devices, self.app_id)
-
     def create_signing_challenge(
         self,
         session: typ.MutableMapping[str, typ.Any],
@@ -63,34 +119,181 @@ class U2FSigningManager(abc.ABC):
         registered_devices = self.filter_devices_by_app_id(registered_devices)
         if not registered_devices:
             raise ValueError("Cannot issue a signing request with no keys.")
-        challenge = websafe_encode(get_random_challenge())
-        session[self.SIGNING_SESSION_KEY] = challenge
+        challenge = self.issue_challenge(session, self.SIGNING_SESSION_KEY)
         keys = [device_as_client_dict(key) for key in registered_devices]
         return {"appId": self.app_id, "challenge": challenge, "registeredKeys": keys}
 
+    def create_signing_challenge_json(
+        self, session: typ.MutableMapping[str, typ.Any], key_list: RenderedKeyList
+    ) -> str:
+        """
+        As ``create_signing_challenge``; but return the request as JSON.
+
+        ``key_list`` holds the user's pre-rendered ``registeredKeys``; only the
+        new challenge is rendered.
+        """
+        self.check_key_list(key_list)
+        if not key_list:
+            raise ValueError("Cannot issue a signing request with no keys.")
+        challenge = self.issue_challenge(session, self.SIGNING_SESSION_KEY)
+        return key_list.signing_request(challenge)
+
     def process_signing_response(
         self,
         session: typ.MutableMapping[str, typ.Any],
         response_dict: typ.Mapping[str, str],
         registered_devices: typ.Collection[DeviceRegistration] = (),
     ) -> DeviceRegistration:
-        registered_devices = self.filter_devices_by_app_id(registered_devices)
-        key_handle = websafe_decode(response_dict.get("keyHandle", ""))
-        challenge = session.pop(self.SIGNING_SESSION_KEY, "")
+        with span(self.tracer, SIGNING):
+            device, signature_data = self.verify_signing_response(
+                session, response_dict, registered_devices
+            )
+            # Only update the counter once we've verified the device.
+            return self.update_counter(device, signature_data.counter)
+
+    def process_signing_body(
+        self,
+        session: typ.MutableMapping[str, typ.Any],
+        body: typ.Union[str, bytes],
+        registered_devices: typ.Collection[DeviceRegistration] = (),
+    ) -> DeviceRegistration:
+        """
+        As ``process_signing_response``; but given the raw JSON body the
+        client posted the response in.
+        """
+        with span(self.tracer, DECODE):
+            response_dict = load_response_body(body)
+        return self.process_signing_response(session, response_dict, registered_devices)
+
+    def process_signing_responses(
+        self,
+        requests: typ.Iterable[
+            typ.Tuple[
+                typ.MutableMapping[str, typ.Any],
+                typ.Mapping[str, str],
+                typ.Collection[DeviceRegistration],
+            ]
+        ],
+        *,
+        executor: typ.Optional[Executor] = None
+    ) -> typ.List[typ.Union[DeviceRegistration, Exception]]:
+        """
+        Process many ``(session, response_dict, registered_devices)`` requests.
+
+        The responses are verified concurrently on ``executor`` (or the
+        manager's executor); the counters are then updated in the calling
+        thread, in order. The result for each request is either the updated
+        device, or the exception that processing it raised.
+        """
+        if executor is None:
+            executor = self.get_executor()
+        futures = [
+            executor.submit(self.verify_signing_response, *request)
+            for request in requests
+        ]
+        results = []  # type: typ.List[typ.Union[DeviceRegistration, Exception]]
+        for future in futures:
+            try:
+                device, signature_data = future.result()
+                device = self.update_counter(device, signature_data.counter)
+            except Exception as e:
+                results.append(e)
+            else:
+                results.append(device)
+        return results
+
+    def update_counter(
+        self, device: DeviceRegistration, counter: int
+    ) -> DeviceRegistration:
+        """
+        Store the device's new counter; rejecting it if it has not increased.
+        """
+        with span(self.tracer, STORE):
+            if self.counter_sink is not None:
+                self.counter_sink.record(device, counter)
+                return device
+            check_counter_increased(device, counter)
+            return self.update_device_registration_counter(
+                device=device, counter=counter
+            )
+
+    def get_executor(self) -> Executor:
+        """The manager's executor; created on first use, once."""
+        executor = self.executor
+        if executor is None:
+            with _executor_lock:
+                executor = self.executor
+                if executor is None:
+                    executor = self.executor = ThreadPoolExecutor(
+                        max_workers=self.BATCH_MAX_WORKERS
+                    )
+        return executor
+
+    def verify_signing_response(
+        self,
+        session: typ.MutableMapping[str, typ.Any],
+        response_dict: typ.Mapping[str, str],
+        registered_devices: typ.Collection[DeviceRegistration] = (),
+    ) -> typ.Tuple[DeviceRegistration, "SignatureData"]:
+        """
+        Verify the response without updating the device's counter.
+
+        Returns the device that signed the response and the parsed signature.
+        """
+        client_data = self.decode_response_client_data(response_dict)
+        challenge = self.take_signing_challenge(session, response_dict, client_data)
+        return self.verify_signing_data(
+            response_dict, challenge, registered_devices, client_data=client_data
+        )
+
+    def take_signing_challenge(
+        self,
+        session: typ.MutableMapping[str, typ.Any],
+        response_dict: typ.Mapping[str, str],
+        client_data: typ.Optional[ClientData] = None,
+    ) -> str:
+        """Take the challenge the response answers, from the session."""
+        challenge = self.take_response_challenge(
+            session, self.SIGNING_SESSION_KEY, response_dict, client_data
+        )
         if not challenge:
             raise U2FStateException("Session missing required key.")
+        return challenge
+
+    def verify_signing_data(
+        self,
+        response_dict: typ.Mapping[str, str],
+        challenge: str,
+        registered_devices: typ.Collection[DeviceRegistration] = (),
+        *,
+        client_data: typ.Optional[ClientData] = None
+    ) -> typ.Tuple[DeviceRegistration, "SignatureData"]:
+        """
+        As ``verify_signing_response``; given the challenge, rather than the
+        session. It doesn't touch the session; so it can be run on any thread.
+        """
+        with span(self.tracer, DECODE):
+            try:
+                key_handle = websafe_decode(response_dict.get("keyHandle", ""))
+            except (TypeError, ValueError) as e:
+                raise U2FInvalidDataException("Invalid key handle.") from e
         device = self.get_key_by_handle(registered_devices, key_handle)
-        signature_data = self.verify_signature_data(response_dict, challenge, device)
-        # Only update the counter once we've verified the device.
-        counter = signature_data.counter
-        return self.update_device_registration_counter(device=device, counter=counter)
+        signature_data = self.verify_signature_data(
+            response_dict, challenge, device, client_data=client_data
+        )
+        return device, signature_data
 
     def get_key_by_handle(
-        self, registered_keys: typ.Collection[DeviceRegistration], key_handle: str
+        self, registered_keys: typ.Collection[DeviceRegistration], key_handle: bytes
     ) -> DeviceRegistration:
-        for key in registered_keys:
-            if key.key_handle == key_handle:
-                return key
+        if isinstance(registered_keys, DeviceSource):
+            device = registered_keys.get_device(self.app_id, key_handle)
+            if device is not None:
+                return device
+        else:
+            for key in self.filter_devices_by_app_id(registered_keys):
+                if key.key_handle == key_handle:
+                    return key
         raise U2FInvalidDataException("Given key not found")
 
     def verify_signature_data(
@@ -98,49 +301,81 @@ class U2FSigningManager(abc.ABC):
         response_dict: typ.Mapping[str, str],
         challenge: str,
         device: DeviceRegistration,
+        *,
+        client_data: typ.Optional[ClientData] = None
     ) -> "SignatureData":
-        try:
-            signature_data = SignatureData.from_base64(
-                response_dict.get("signatureData", "")
+        """
+        Verify the response's signature data; against ``challenge``, with the
+        device's public key.
+
+        ``client_data`` is the response's client data, if it has already been
+        decoded.
+        """
+        tracer = self.tracer
+        with span(tracer, DECODE):
+            try:
+                signature_data = SignatureData.from_base64(
+                    response_dict.get("signatureData", "")
+                )
+            except (TypeError, ValueError, IndexError) as e:
+                raise U2FInvalidDataException("Invalid signing data.") from e
+        # Client data comes in as base64(usually?); it is decoded once, and
+        #  the challenge parameter is the hash of exactly those bytes.
+        app_context = self.get_app_context()
+        with span(tracer, CLIENT_DATA):
+            if client_data is None:
+                client_data = ClientData(response_dict.get("clientData", ""))
+            client_data.check(
+                RequestType.SIGN,
+                app_context.app_id,
+                challenge,
+                app_context.trusted_facets,
             )
-        except (ValueError, IndexError) as e:
-            raise U2FInvalidDataException("Invalid signing data.") from e
-        # Client data comes in as base64(usually?), so we standardise it
-        #  into a decoded *string*. We then take the hash of that string
-        #  for the verification step.
-        client_data = validate_client_data(
-            response_dict.get("clientData", ""),
-            RequestType.SIGN,
-            self.app_id,
-            challenge,
-        )
-        challenge_param = sha_256(client_data.encode("utf-8"))
-        app_param = sha_256(self.app_id.encode("idna"))
-        signature_data.verify(app_param, challenge_param, device.public_key)
+            challenge_param = sha_256(client_data.data)
+        app_param = app_context.app_param
+        with span(tracer, VERIFY):
+            signature_data.verify(app_param, challenge_param, device.public_key)
         return signature_data
 
 
 class SignatureData:
+    """
+    A parsed ``signatureData`` response.
+
+    The signature is copied out of the original buffer on first access.
+    """
+
+    __slots__ = ("_data", "user_presence", "counter", "_signature")
+
     @classmethod
     def from_base64(cls, base64_data: typ.Union[str, bytes]) -> "SignatureData":
         return cls(websafe_decode(base64_data))  # type: ignore
 
     def __init__(self, data: bytes) -> None:
         # https://fidoalliance.org/specs/fido-u2f-v1.2-ps-20170411/fido-u2f-raw-message-formats-v1.2-ps-20170411.pdf
-        buf = bytearray(data)
-        self.user_presence = buf.pop(0)
-        self.counter = struct.unpack(">I", pop_bytes(buf, 4))[0]
-        self.signature = bytes(buf)
+        # 1 byte user presence, 4 byte big-endian counter, then the signature.
+        # The response is small enough that a memoryview costs more than it
+        #  saves; the buffer is kept as-is and only sliced for the signature.
+        if len(data) < 5:
+            raise U2FInvalidDataException("Signature data is truncated")
+        self._data = data
+        self.user_presence = data[0]
+        self.counter = _COUNTER.unpack_from(data, 1)[0]
+        self._signature = None  # type: typ.Optional[bytes]
+
+    @property
+    def signature(self) -> bytes:
+        if self._signature is None:
+            self._signature = bytes(self._data[5:])
+        return self._signature
 
     def verify(self, app_param: bytes, chal_param: bytes, der_pubkey: bytes):
-        pubkey = load_der_public_key(PUB_KEY_DER_PREFIX + der_pubkey, default_backend())
+        pubkey = load_public_key(der_pubkey)
         verifier = pubkey.verifier(self.signature, ec.ECDSA(hashes.SHA256()))
-        verifier.update(
-            app_param
-            + bytes([self.user_presence])
-            + struct.pack(">I", self.counter)
-            + chal_param
-        )
+        verifier.update(app_param)
+        # The user presence byte and counter, as sent by the device.
+        verifier.update(self._data[:5])
+        verifier.update(chal_param)
         try:
             verifier.verify()
         except InvalidSignature as e:
@@ -0,0 +1,217 @@
+"""
+Verify responses on a verification server (see ``fido_u2f.server``).
+
+Mix ``RemoteVerificationMixin`` into a manager and give it a
+``VerifierClient``; its ``verify_registration_data`` and
+``verify_signature_data`` then send the response to the server, and wait
+for the verdict, rather than verifying it in this process::
+
+    class Manager(RemoteVerificationMixin, U2FRegistrationManager,
+                  U2FSigningManager):
+        ...
+
+    manager = Manager(app_id, verifier_client=VerifierClient("/run/u2f.sock"))
+
+Everything else, such as the challenge and the device's counter, is still
+checked by the manager. The server's ``--attestation-roots`` take the place
+of the manager's ``attestation_trust_store``; if the manager has one, the
+server rejects its registrations unless it was started with roots.
+"""
+import itertools
+import json
+import socket
+import threading
+
+from .constants import VERIFY_CLIENT_TIMEOUT, VERIFY_SERVER_MAX_FRAME
+from .device import DeviceRegistration
+from .enums import U2FTransport
+from .exceptions import (
+    U2FException,
+    U2FInvalidDataException,
+    U2FStateException,
+    U2FVerifierException,
+)
+from .registration import RegistrationData
+from .reverify import REGISTER, SIGN
+from .server import FRAME_HEADER, Job, Reply, encode_frame
+from .tracing import VERIFY, span
+from .utils import ClientData, websafe_encode
+from .verification import SignatureData
+
+from . import _typing as typ  # isort:skip
+
+# The exceptions the server's replies may name; anything else it raised is
+#  a ``U2FVerifierException``.
+_EXCEPTIONS = {
+    cls.__name__: cls
+    for cls in (U2FException, U2FInvalidDataException, U2FStateException)
+}
+_TRANSPORTS_BY_NAME = {t.internal_name: t for t in U2FTransport}
+
+
+class VerifierClient:
+    """
+    A client of the verification server listening on ``path``.
+
+    Each thread has a connection of its own, opened when first needed; a job
+    whose connection fails is retried once, on a new connection.
+    ``timeout`` is the number of seconds to wait for a verdict.
+    """
+
+    def __init__(self, path: str, *, timeout: float = VERIFY_CLIENT_TIMEOUT) -> None:
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._ids = itertools.count(1)
+
+    def verify(self, job: Job) -> Reply:
+        """
+        Send the job and return the server's reply; if the response is valid.
+
+        Raises the exception the server gave for an invalid response; or
+        ``U2FVerifierException`` if it can't be reached.
+        """
+        job = dict(job, id=next(self._ids))
+        frame = encode_frame(job)
+        try:
+            reply = self._exchange(frame, job["id"])
+        except (OSError, ValueError):
+            # The server may have been restarted; the job is safe to repeat.
+            self.close()
+            try:
+                reply = self._exchange(frame, job["id"])
+            except (OSError, ValueError) as e:
+                self.close()
+                raise U2FVerifierException("The verification server failed") from e
+        if not reply.get("valid"):
+            error = reply.get("error", "")
+            cls = _EXCEPTIONS.get(reply.get("exception", ""))
+            if cls is None:
+                raise U2FVerifierException(
+                    "The verification server failed: {}".format(error)
+                )
+            raise cls(error)
+        return reply
+
+    def close(self) -> None:
+        """Close this thread's connection."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            self._local.connection = None
+            connection.close()
+
+    def _connection(self) -> socket.socket:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.settimeout(self.timeout)
+            try:
+                connection.connect(self.path)
+            except OSError:
+                connection.close()
+                raise
+            self._local.connection = connection
+        return connection
+
+    def _exchange(self, frame: bytes, job_id: int) -> Reply:
+        connection = self._connection()
+        connection.sendall(frame)
+        # Each thread has one job in flight at a time; so this is its reply.
+        (size,) = FRAME_HEADER.unpack(_receive(connection, FRAME_HEADER.size))
+        if size > VERIFY_SERVER_MAX_FRAME:
+            raise ValueError("The reply is too large")
+        reply = json.loads(_receive(connection, size).decode("utf-8"))
+        if reply.get("id") != job_id:
+            raise ValueError("The reply is for another job")
+        return reply
+
+
+def _receive(connection: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("The verification server closed the connection")
+        data += chunk
+    return bytes(data)
+
+
+class RemoteVerificationMixin:
+    """
+    Verify responses with a ``VerifierClient``; see the module's
+    documentation. Without a client, responses are verified in-process.
+    """
+
+    verifier_client = None  # type: typ.Optional[VerifierClient]
+
+    def __init__(
+        self,
+        *args: typ.Any,
+        verifier_client: typ.Optional[VerifierClient] = None,
+        **kwargs: typ.Any
+    ) -> None:
+        super().__init__(*args, **kwargs)  # type: ignore
+        self.verifier_client = verifier_client
+
+    def _remote_job(
+        self, record_type: str, response_dict: typ.Mapping[str, str], challenge: str
+    ) -> Job:
+        app_context = self.get_app_context()  # type: ignore
+        return {
+            "type": record_type,
+            "appId": app_context.app_id,
+            "trustedFacets": sorted(app_context.trusted_facets - {app_context.app_id}),
+            "challenge": challenge,
+            "response": dict(response_dict),
+        }
+
+    def verify_registration_data(
+        self,
+        response_dict: typ.Mapping[str, str],
+        challenge: str,
+        *,
+        client_data: typ.Optional[ClientData] = None
+    ) -> RegistrationData:
+        client = self.verifier_client
+        if client is None:
+            return super().verify_registration_data(  # type: ignore
+                response_dict, challenge, client_data=client_data
+            )
+        job = self._remote_job(REGISTER, response_dict, challenge)
+        if getattr(self, "attestation_trust_store", None) is not None:
+            # The server's roots are checked instead; so it must have some.
+            job["requireAttestation"] = True
+        with span(self.tracer, VERIFY):  # type: ignore
+            reply = client.verify(job)
+        # Already verified; so only the offsets are parsed here.
+        registration_data = RegistrationData.from_base64(
+            response_dict.get("registrationData", "")
+        )
+        transports = reply.get("transports")
+        if transports is not None:
+            byte = 0
+            for name in transports:
+                byte |= _TRANSPORTS_BY_NAME[name].value
+            transports = U2FTransport.from_byte(byte)
+        # Spares parsing the certificate, for the transports, here.
+        registration_data._transports = transports
+        return registration_data
+
+    def verify_signature_data(
+        self,
+        response_dict: typ.Mapping[str, str],
+        challenge: str,
+        device: DeviceRegistration,
+        *,
+        client_data: typ.Optional[ClientData] = None
+    ) -> SignatureData:
+        client = self.verifier_client
+        if client is None:
+            return super().verify_signature_data(  # type: ignore
+                response_dict, challenge, device, client_data=client_data
+            )
+        job = self._remote_job(SIGN, response_dict, challenge)
+        job["publicKey"] = websafe_encode(device.public_key)
+        with span(self.tracer, VERIFY):  # type: ignore
+            client.verify(job)
+        return SignatureData.from_base64(response_dict.get("signatureData", ""))
@@ -5,7 +5,9 @@ from setuptools import find_packages, setup
 
 requirements = ["cryptography>=2.3,<3"]
 
-flask_sample_requires = ["flask", "Flask-SQLAlchemy"]
+flask_requires = ["flask"]
+sqlalchemy_requires = ["sqlalchemy>=1.3"]
+flask_sample_requires = flask_requires + sqlalchemy_requires + ["Flask-SQLAlchemy"]
 
 
 packages = find_packages(where="./", include=["fido_u2f", "fido_u2f.*"])
@@ -28,9 +30,13 @@ setup(
     packages=packages,
     include_package_data=True,
     install_requires=requirements,
-    extras_require={"sample": flask_sample_requires},
+    extras_require={
+        "flask": flask_requires,
+        "sample": flask_sample_requires,
+        "sqlalchemy": sqlalchemy_requires,
+    },
     zip_safe=False,
-    package_data={"fido_u2f": ["py.typed"]},
+    package_data={"fido_u2f": ["py.typed", "static/*.js"]},
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Intended Audience :: Developers",